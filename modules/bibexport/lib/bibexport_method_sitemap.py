@@ -33,7 +33,7 @@ import gzip
 import time
 
 from invenio.search_engine import get_collection_reclist
-from invenio.dbquery import run_sql
+from invenio.dbquery import run_sql, run_sql_iter
 from invenio.config import CFG_SITE_URL, CFG_WEBDIR, CFG_ETCDIR, \
     CFG_SITE_RECORD, CFG_SITE_LANGS
 from invenio.intbitset import intbitset
@@ -75,7 +75,7 @@ def get_all_public_records(collections):
     for collection in collections:
         recids += get_collection_reclist(collection)
     query = 'SELECT id, modification_date FROM bibrec'
-    res = run_sql(query)
+    res = run_sql_iter(query)
     return [(recid, lastmod) for (recid, lastmod) in res if recid in recids]
 
 def get_all_public_collections(base_collections):
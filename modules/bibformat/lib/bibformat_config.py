@@ -24,7 +24,7 @@
 __revision__ = "$Id$"
 
 import os
-from invenio.config import CFG_ETCDIR, CFG_PYLIBDIR
+from invenio.config import CFG_ETCDIR, CFG_PYLIBDIR, CFG_CACHEDIR
 
 # True if old php format written in EL must be used by Invenio.
 # False if new python format must be used. If set to 'False' but
@@ -37,6 +37,23 @@ CFG_BIBFORMAT_ELEMENTS_IMPORT_PATH = "invenio.bibformat_elements"
 CFG_BIBFORMAT_ELEMENTS_PATH = "%s%sinvenio%sbibformat_elements" % (CFG_PYLIBDIR, os.sep, os.sep)
 CFG_BIBFORMAT_OUTPUTS_PATH = "%s%sbibformat%soutput_formats" % (CFG_ETCDIR, os.sep, os.sep)
 
+# File where preload_caches() saves the attributes of the format
+# elements, together with their import cost
+CFG_BIBFORMAT_ELEMENTS_CACHE_FILE = "%s%sbibformat%sformat_elements.cache" % (CFG_CACHEDIR, os.sep, os.sep)
+
+# True if the evaluation of the format elements must be profiled
+# (number of calls, time spent and SQL queries run, per output format
+# and format element).  See bibformat_engine.get_format_elements_profile().
+# Profiling can also be switched on at runtime with
+# bibformat_engine.enable_format_elements_profiling().
+CFG_BIBFORMAT_PROFILE_ELEMENTS = False
+
+# Maximum number of rendered format elements kept in memory by each
+# process.  Only the format elements that define a
+# 'cache_dependencies(bfo)' function are cached.  0 disables the
+# cache.
+CFG_BIBFORMAT_FRAGMENT_CACHE_SIZE = 10000
+
 # File extensions of formats
 CFG_BIBFORMAT_FORMAT_TEMPLATE_EXTENSION = "bft"
 CFG_BIBFORMAT_FORMAT_OUTPUT_EXTENSION = "bfo"
@@ -86,6 +86,50 @@ def get_modification_date(sysno, fmt="%Y-%m-%dT%H:%M:%SZ"):
         out = localtime_to_utc(res[0][0], fmt)
     return out
 
+def get_record_modification_date(recid):
+    """
+    Returns the raw date of last modification of the record 'recid', or
+    None if the record does not exist.
+
+    @param recid: the record ID
+    @return: modification date of the record
+    @rtype: string
+    """
+    res = run_sql("SELECT DATE_FORMAT(modification_date,'%%Y-%%m-%%d %%H:%%i:%%s') FROM bibrec WHERE id=%s", (recid,), 1)
+    if res:
+        return res[0][0]
+    return None
+
+def get_bibdocs_modification_date(recid):
+    """
+    Returns the date of last modification of the documents attached to
+    the record 'recid', or None if the record has no document.
+
+    @param recid: the record ID
+    @return: modification date of the most recently modified document
+    @rtype: string
+    """
+    res = run_sql("""SELECT DATE_FORMAT(MAX(bd.modification_date),'%%Y-%%m-%%d %%H:%%i:%%s')
+                       FROM bibrec_bibdoc AS bb, bibdoc AS bd
+                      WHERE bb.id_bibrec=%s AND bb.id_bibdoc=bd.id""", (recid,))
+    if res:
+        return res[0][0]
+    return None
+
+def get_citation_dicts_update_date():
+    """
+    Returns the date of last update of the citation dictionaries, or
+    None if they have never been computed.
+
+    @return: the date of last run of the citation ranking method
+    @rtype: string
+    """
+    res = run_sql("""SELECT DATE_FORMAT(last_updated, '%Y-%m-%d %H:%i:%s')
+                       FROM rnkMETHOD WHERE name='citation'""")
+    if res:
+        return res[0][0]
+    return None
+
 ## XML Marc related functions
 def get_tag_from_name(name):
     """
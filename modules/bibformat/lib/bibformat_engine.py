@@ -47,6 +47,9 @@ import inspect
 import traceback
 import zlib
 import cgi
+import time
+import cPickle
+from thread import allocate_lock, get_ident
 
 from invenio.config import \
      CFG_PATH_PHP, \
@@ -61,7 +64,7 @@ from invenio.bibrecord import \
      record_get_field_values, \
      record_xml_output
 from invenio.bibformat_xslt_engine import format
-from invenio.dbquery import run_sql
+from invenio.dbquery import run_sql, get_thread_run_sql_count
 from invenio.messages import \
      language_list_long, \
      wash_language, \
@@ -74,6 +77,9 @@ from invenio.bibformat_config import \
      CFG_BIBFORMAT_ELEMENTS_PATH, \
      CFG_BIBFORMAT_OUTPUTS_PATH, \
      CFG_BIBFORMAT_ELEMENTS_IMPORT_PATH, \
+     CFG_BIBFORMAT_ELEMENTS_CACHE_FILE, \
+     CFG_BIBFORMAT_PROFILE_ELEMENTS, \
+     CFG_BIBFORMAT_FRAGMENT_CACHE_SIZE, \
      InvenioBibFormatError
 from invenio.bibformat_utils import \
      record_get_xml, \
@@ -94,6 +100,28 @@ if CFG_PATH_PHP: #Remove when call_old_bibformat is removed
 format_templates_cache = {}
 format_elements_cache = {}
 format_outputs_cache = {}
+# Cache of the content of the elements and output formats directories
+# (indexed by directory path)
+format_elements_filenames_cache = {}
+format_outputs_filenames_cache = {}
+
+# Statistics on the evaluation of the format elements, filled when
+# profiling is enabled.  Indexed by (output format code, element
+# name), values are [number of calls, total time, max time, number of
+# SQL queries]
+format_elements_profile = {}
+format_elements_profile_lock = allocate_lock()
+format_elements_profiling = CFG_BIBFORMAT_PROFILE_ELEMENTS
+# Statistics collected by profile_format_records(), in the same form
+# as 'format_elements_profile'.  Indexed by thread ID, so that
+# concurrent requests each get the statistics of their own records.
+format_elements_thread_profiles = {}
+
+# Cache of the output of the format elements that define a
+# 'cache_dependencies(bfo)' function.  Indexed by (element name,
+# recid, parameters, language, output format), values are
+# (dependencies stamps, output)
+format_elements_fragments_cache = {}
 
 html_field = '<!--HTML-->' # String indicating that field should be
                            # treated as HTML (and therefore no escaping of
@@ -333,6 +361,9 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0,
 
     #Create a BibFormat Object to pass that contain record and context
     bfo = BibFormatObject(recID, ln, search_pattern, xml_record, user_info, of)
+    if verbose == 9:
+        # Also profile the format elements of this very record
+        bfo.elements_profile = {}
 
     if of.lower() != 'xm' and \
            (not bfo.get_record() or len(bfo.get_record()) <= 1):
@@ -383,6 +414,13 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0,
 
     out += out_
 
+    if verbose == 9 and bfo.elements_profile:
+        out += """\n<br/><span class="quicknote">
+        Format elements evaluation for record %i:
+        <pre>%s</pre>
+        </span>""" % (recID,
+                       cgi.escape(format_elements_profile_report(bfo.elements_profile)))
+
     return out
 
 def decide_format_template(bfo, of):
@@ -562,6 +600,12 @@ def eval_format_element(format_element, bfo, parameters=None, verbose=0):
     name, with given L{BibFormatObject} and parameters. Also returns
     the errors of the evaluation.
 
+    If profiling is enabled (see enable_format_elements_profiling()),
+    or if the given L{BibFormatObject} collects its own profile (see
+    format_record() in verbose mode 9), the number of calls, the time
+    spent and the number of SQL queries run are recorded for the
+    element.
+
     @param format_element: a format element structure as returned by get_format_element
     @param bfo: a L{BibFormatObject} used for formatting
     @param parameters: a dict of parameters to be used for formatting. Key is parameter and value is value of parameter
@@ -570,6 +614,51 @@ def eval_format_element(format_element, bfo, parameters=None, verbose=0):
                                                        7: errors and warnings,
                                                        9: errors and warnings, stop if error (debug mode ))
 
+    @return: tuple (result, errors)
+    """
+    thread_profile = format_elements_thread_profiles.get(get_ident())
+    if not format_elements_profiling and bfo.elements_profile is None and \
+           thread_profile is None:
+        return _eval_format_element(format_element, bfo, parameters, verbose)
+
+    nb_queries = get_thread_run_sql_count()
+    start_time = time.time()
+    try:
+        return _eval_format_element(format_element, bfo, parameters, verbose)
+    finally:
+        elapsed_time = time.time() - start_time
+        nb_queries = get_thread_run_sql_count() - nb_queries
+        if format_element is None:
+            name = "None"
+        else:
+            name = format_element['attrs']['name']
+        key = (bfo.output_format, name)
+        profiles = []
+        if format_elements_profiling:
+            profiles.append(format_elements_profile)
+        if bfo.elements_profile is not None:
+            profiles.append(bfo.elements_profile)
+        if thread_profile is not None:
+            profiles.append(thread_profile)
+        format_elements_profile_lock.acquire()
+        try:
+            for profile in profiles:
+                stats = profile.get(key)
+                if stats is None:
+                    profile[key] = [1, elapsed_time, elapsed_time, nb_queries]
+                else:
+                    stats[0] += 1
+                    stats[1] += elapsed_time
+                    if elapsed_time > stats[2]:
+                        stats[2] = elapsed_time
+                    stats[3] += nb_queries
+        finally:
+            format_elements_profile_lock.release()
+
+def _eval_format_element(format_element, bfo, parameters=None, verbose=0):
+    """
+    Evaluates the given format element. See eval_format_element().
+
     @return: tuple (result, errors)
     """
     if parameters is None:
@@ -590,6 +679,21 @@ def eval_format_element(format_element, bfo, parameters=None, verbose=0):
 
     if format_element is not None and format_element['type'] == "python":
         # a) We found an element with the tag name, of type "python"
+
+        # Reuse the output of a previous evaluation if the element
+        # allows it, and nothing it depends on has changed since
+        fragment_key = None
+        if format_element['cache_function'] is not None and \
+               CFG_BIBFORMAT_FRAGMENT_CACHE_SIZE and \
+               bfo.xml_record is None and bfo.recID:
+            (fragment_key, fragment_stamps) = \
+                           get_fragment_cache_key(format_element, bfo,
+                                                  parameters)
+            if fragment_key is not None:
+                fragment = format_elements_fragments_cache.get(fragment_key)
+                if fragment is not None and fragment[0] == fragment_stamps:
+                    return (fragment[1], errors)
+
         # Prepare a dict 'params' to pass as parameter to 'format'
         # function of element
         params = {}
@@ -685,6 +789,12 @@ def eval_format_element(format_element, bfo, parameters=None, verbose=0):
         if output_text == "":
             output_text = default_value
 
+        if fragment_key is not None and not errors:
+            if len(format_elements_fragments_cache) > CFG_BIBFORMAT_FRAGMENT_CACHE_SIZE:
+                format_elements_fragments_cache.clear()
+            format_elements_fragments_cache[fragment_key] = (fragment_stamps,
+                                                             output_text)
+
         return (output_text, errors)
 
     elif format_element is not None and format_element['type'] == "field":
@@ -774,6 +884,67 @@ def eval_format_element(format_element, bfo, parameters=None, verbose=0):
                     str(exc.message)+'</span></b>', errors)
 
 
+def get_fragment_cache_key(format_element, bfo, parameters):
+    """
+    Returns the key under which the output of the given format element
+    is cached, together with the current stamps of the data it depends
+    on.  A cached output can be reused as long as the stamps did not
+    change.
+
+    The element declares what its output depends on by defining a
+    'cache_dependencies(bfo)' function, returning a list of:
+      - 'record': the record metadata (bibrec modification date)
+      - 'bibdocs': the documents attached to the record
+      - 'citations': the citation dictionaries
+    or None if this very evaluation must not be cached (for example
+    when the output depends on the user).
+
+    @param format_element: a format element structure as returned by get_format_element
+    @param bfo: a L{BibFormatObject} used for formatting
+    @param parameters: a dict of parameters to be used for formatting
+    @return: tuple (key, stamps), or (None, None) if the output must not be cached
+    """
+    try:
+        dependencies = apply(format_element['cache_function'], (),
+                             {'bfo': bfo})
+        if dependencies is None:
+            return (None, None)
+        stamps = tuple([get_fragment_dependency_stamp(bfo, dependency) \
+                        for dependency in dependencies])
+    except Exception:
+        register_exception(req=bfo.req)
+        return (None, None)
+
+    params = parameters.items()
+    params.sort()
+    key = (format_element['attrs']['name'], bfo.recID, tuple(params),
+           bfo.lang, bfo.output_format)
+    return (key, stamps)
+
+def get_fragment_dependency_stamp(bfo, dependency):
+    """
+    Returns the current stamp of one of the dependencies a cached
+    format element can declare (see get_fragment_cache_key()).
+
+    Stamps are computed once per L{BibFormatObject}, i.e. once per
+    formatted record.
+
+    @param bfo: a L{BibFormatObject} used for formatting
+    @param dependency: 'record', 'bibdocs' or 'citations'
+    @return: the stamp of the dependency
+    """
+    stamps = bfo.fragment_cache_stamps
+    if not stamps.has_key(dependency):
+        if dependency == 'record':
+            stamps[dependency] = bibformat_dblayer.get_record_modification_date(bfo.recID)
+        elif dependency == 'bibdocs':
+            stamps[dependency] = bibformat_dblayer.get_bibdocs_modification_date(bfo.recID)
+        elif dependency == 'citations':
+            stamps[dependency] = bibformat_dblayer.get_citation_dicts_update_date()
+        else:
+            raise InvenioBibFormatError('Unknown format element cache dependency %s.' % dependency)
+    return stamps[dependency]
+
 def filter_languages(format_template, ln='en'):
     """
     Filters the language tags that do not correspond to the specified language.
@@ -977,7 +1148,8 @@ def get_format_element(element_name, verbose=0, with_built_in_params=False):
       {'attrs': {some attributes in dict. See get_format_element_attrs_from_*}
       'code': the_function_code,
       'type':"field" or "python" depending if element is defined in file or table,
-      'escape_function': the function to call to know if element output must be escaped}
+      'escape_function': the function to call to know if element output must be escaped,
+      'cache_function': the function to call to know if element output can be cached}
 
     @param element_name: the name of the format element to load
     @param verbose: the level of verbosity from 0 to 9 (O: silent,
@@ -1015,6 +1187,7 @@ def get_format_element(element_name, verbose=0, with_built_in_params=False):
                 with_built_in_params),
                               'code':None,
                               'escape_function':None,
+                              'cache_function':None,
                               'type':"field"}
             # Cache and returns
             format_elements_cache[name] = format_element
@@ -1099,6 +1272,12 @@ def get_format_element(element_name, verbose=0, with_built_in_params=False):
                                    None)
         format_element['escape_function'] = function_escape
 
+        # Load function 'cache_dependencies()' inside element
+        function_cache = getattr(module.__dict__[module_name],
+                                 'cache_dependencies',
+                                 None)
+        format_element['cache_function'] = function_cache
+
         # Prepare, cache and return
         format_element['attrs'] = get_format_element_attrs_from_function( \
                 function_format,
@@ -1135,7 +1314,7 @@ def get_format_elements(with_built_in_params=False):
     for name in mappings:
         format_elements[name.upper().replace(" ", "_").strip()] = get_format_element(name, with_built_in_params=with_built_in_params)
 
-    files = os.listdir(CFG_BIBFORMAT_ELEMENTS_PATH)
+    files = _get_format_elements_filenames()[0]
     for filename in files:
         filename_test = filename.upper().replace(" ", "_")
         if filename_test.endswith(".PY") and filename.upper() != "__INIT__.PY":
@@ -1586,19 +1765,41 @@ def resolve_format_element_filename(element_name):
     else:
         name = element_name.replace(" ", "_").upper()
 
-    files = os.listdir(CFG_BIBFORMAT_ELEMENTS_PATH)
-    for filename in files:
-        test_filename = filename.replace(" ", "_").upper()
+    filename = _get_format_elements_filenames()[1].get(name)
+    if filename is None:
+        # The directory might have changed since we cached its content
+        filename = _get_format_elements_filenames(refresh=True)[1].get(name)
 
-        if test_filename == name or \
-        test_filename == "BFE_" + name or \
-        "BFE_" + test_filename == name:
-            return filename
+    # If no element with that name is found, do not log error, as it
+    # might be a normal execution case: element can be in database
+    return filename
 
-    # No element with that name found
-    # Do not log error, as it might be a normal execution case:
-    # element can be in database
-    return None
+def _get_format_elements_filenames(refresh=False):
+    """
+    Returns the content of the format elements directory, cached.
+
+    The returned tuple is (filenames, names) where 'filenames' is the
+    list of files of the directory and 'names' is a dictionary mapping
+    every name under which an element can be called (uppercase, with
+    or without 'BFE_' prefix) to the filename of the element.
+
+    @param refresh: if True, read the directory again
+    @return: a tuple (filenames, names)
+    """
+    if refresh or \
+           not format_elements_filenames_cache.has_key(CFG_BIBFORMAT_ELEMENTS_PATH):
+        files = os.listdir(CFG_BIBFORMAT_ELEMENTS_PATH)
+        names = {}
+        for filename in files:
+            test_filename = filename.replace(" ", "_").upper()
+            # First file found wins, as when looping over the directory
+            names.setdefault(test_filename, filename)
+            names.setdefault("BFE_" + test_filename, filename)
+            if test_filename.startswith("BFE_"):
+                names.setdefault(test_filename[4:], filename)
+        format_elements_filenames_cache[CFG_BIBFORMAT_ELEMENTS_PATH] = \
+                                                         (files, names)
+    return format_elements_filenames_cache[CFG_BIBFORMAT_ELEMENTS_PATH]
 
 def resolve_output_format_filename(code, verbose=0):
     """
@@ -1621,9 +1822,15 @@ def resolve_output_format_filename(code, verbose=0):
         code = re.sub(r"\W", "", code)
         code += "."+CFG_BIBFORMAT_FORMAT_OUTPUT_EXTENSION
 
-    files = os.listdir(CFG_BIBFORMAT_OUTPUTS_PATH)
-    for filename in files:
-        if filename.upper() == code.upper():
+    for refresh in (False, True):
+        # The directory might have changed since we cached its content
+        if refresh or \
+               not format_outputs_filenames_cache.has_key(CFG_BIBFORMAT_OUTPUTS_PATH):
+            format_outputs_filenames_cache[CFG_BIBFORMAT_OUTPUTS_PATH] = \
+                dict([(filename.upper(), filename) for filename in \
+                      reversed(os.listdir(CFG_BIBFORMAT_OUTPUTS_PATH))])
+        filename = format_outputs_filenames_cache[CFG_BIBFORMAT_OUTPUTS_PATH].get(code.upper())
+        if filename is not None:
             return filename
 
     # No output format with that name found
@@ -1727,6 +1934,244 @@ def clear_caches():
     format_templates_cache = {}
     format_elements_cache = {}
     format_outputs_cache = {}
+    format_elements_filenames_cache.clear()
+    format_outputs_filenames_cache.clear()
+    format_elements_fragments_cache.clear()
+
+def preload_caches(save_to_file=True, verbose=0):
+    """
+    Load all the format elements, output formats and format templates
+    into the caches of this process, so that the first formatting
+    requests do not have to pay for it.
+
+    Meant to be called once when a process starts, e.g. at WSGI
+    application start-up.  The attributes of the format elements, and
+    the time spent importing each of them, can be saved to
+    CFG_BIBFORMAT_ELEMENTS_CACHE_FILE, where they can be read back
+    with get_preload_report().
+
+    The returned report is::
+      {'date': time when the caches were loaded,
+       'total_time': seconds spent loading everything,
+       'elements': [{'name': "BFE_TITLE", 'filename': "bfe_title.py",
+                     'import_time': seconds, 'attrs': {...}}, ...],
+       'broken_elements': ["bfe_foo.py", ...],
+       'output_formats': number of output formats loaded,
+       'format_templates': number of format templates loaded}
+
+    'elements' is sorted by decreasing import time.
+
+    @param save_to_file: if True, save the report to CFG_BIBFORMAT_ELEMENTS_CACHE_FILE
+    @param verbose: the level of verbosity from 0 to 9 (O: silent,
+                                                       5: errors,
+                                                       7: errors and warnings,
+                                                       9: errors and warnings, stop if error (debug mode ))
+    @return: the report of the loading
+    """
+    start_time = time.time()
+    elements = []
+    broken_elements = []
+    for filename in _get_format_elements_filenames(refresh=True)[0]:
+        element_name = filename.upper().replace(" ", "_")
+        if not element_name.endswith(".PY") or element_name == "__INIT__.PY":
+            continue
+        # Load under the same name as get_format_elements(), so that
+        # the cached element has the right 'name' attribute
+        if element_name.startswith("BFE_"):
+            element_name = element_name[4:]
+        element_name = element_name[:-3]
+        element_start_time = time.time()
+        element = get_format_element(element_name, verbose,
+                                     with_built_in_params=True)
+        import_time = time.time() - element_start_time
+        if element is None:
+            broken_elements.append(filename)
+            continue
+        elements.append({'name': element['attrs']['name'],
+                         'filename': filename,
+                         'import_time': import_time,
+                         'attrs': element['attrs']})
+    elements.sort(key=lambda element: element['import_time'], reverse=True)
+
+    output_formats = get_output_formats(with_attributes=True)
+    format_templates = get_format_templates(with_attributes=True)
+
+    report = {'date': start_time,
+              'total_time': time.time() - start_time,
+              'elements': elements,
+              'broken_elements': broken_elements,
+              'output_formats': len(output_formats),
+              'format_templates': len(format_templates)}
+
+    if save_to_file:
+        try:
+            cache_dir = os.path.dirname(CFG_BIBFORMAT_ELEMENTS_CACHE_FILE)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_filename = '%s.%i' % (CFG_BIBFORMAT_ELEMENTS_CACHE_FILE, os.getpid())
+            cache_file = open(tmp_filename, 'w')
+            cPickle.dump(report, cache_file, -1)
+            cache_file.close()
+            os.rename(tmp_filename, CFG_BIBFORMAT_ELEMENTS_CACHE_FILE)
+        except (IOError, OSError), e:
+            register_exception()
+            if verbose >= 5:
+                sys.stderr.write("Could not save %s: %s\n" % \
+                                 (CFG_BIBFORMAT_ELEMENTS_CACHE_FILE, e))
+
+    return report
+
+def get_preload_report():
+    """
+    Returns the report saved by the last call to preload_caches(), or
+    None if it cannot be read.
+
+    @return: the report, as returned by preload_caches()
+    """
+    try:
+        cache_file = open(CFG_BIBFORMAT_ELEMENTS_CACHE_FILE)
+        try:
+            return cPickle.load(cache_file)
+        finally:
+            cache_file.close()
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return None
+
+def format_preload_report(report, nb_elements=None):
+    """
+    Returns a plain text version of a report returned by preload_caches().
+
+    @param report: the report to print
+    @param nb_elements: print only this number of most costly elements
+    @return: the report, as text
+    """
+    out = ["Caches loaded in %.3f s on %s: %i format elements, "
+           "%i output formats, %i format templates." % \
+           (report['total_time'],
+            time.strftime("%Y-%m-%d %H:%M:%S",
+                          time.localtime(report['date'])),
+            len(report['elements']),
+            report['output_formats'],
+            report['format_templates'])]
+    if report['broken_elements']:
+        out.append("Format elements that could not be loaded: %s" % \
+                   ", ".join(report['broken_elements']))
+    out.append("%-40s %12s" % ("Format element", "Import (ms)"))
+    for element in report['elements'][:nb_elements]:
+        out.append("%-40s %12.2f" % (element['filename'],
+                                     element['import_time'] * 1000))
+    return "\n".join(out)
+
+def enable_format_elements_profiling(enable=True):
+    """
+    Enables (or disables) the profiling of the format elements in
+    this process.  Profiling is enabled by default if
+    CFG_BIBFORMAT_PROFILE_ELEMENTS is True.
+
+    @param enable: if True, enable profiling. Else disable it.
+    @return: None
+    """
+    global format_elements_profiling
+    format_elements_profiling = enable
+
+def is_format_elements_profiling_enabled():
+    """
+    Returns True if the format elements are currently profiled in this
+    process.
+    """
+    return format_elements_profiling
+
+def reset_format_elements_profile():
+    """
+    Forgets the statistics collected so far on the format elements.
+
+    @return: None
+    """
+    format_elements_profile_lock.acquire()
+    try:
+        format_elements_profile.clear()
+    finally:
+        format_elements_profile_lock.release()
+
+def get_format_elements_profile(profile=None, sortby="time"):
+    """
+    Returns the statistics collected on the evaluation of the format
+    elements, as a list of dicts::
+      [{'output_format': "HB", 'element': "TITLE", 'calls': 10,
+        'time': total seconds, 'max_time': seconds,
+        'avg_time': seconds, 'queries': number of SQL queries}, ...]
+
+    Time includes the time spent in format elements called by the
+    element.
+
+    @param profile: the statistics to use. If None, use the ones collected in this process
+    @param sortby: sort by decreasing 'time', 'avg_time', 'max_time', 'calls' or 'queries'
+    @return: the list of statistics, by decreasing value of 'sortby'
+    """
+    if profile is None:
+        profile = format_elements_profile
+    format_elements_profile_lock.acquire()
+    try:
+        profile = [(key, tuple(stats)) for (key, stats) in profile.items()]
+    finally:
+        format_elements_profile_lock.release()
+    out = []
+    for (output_format, element), stats in profile:
+        (calls, total_time, max_time, queries) = stats
+        out.append({'output_format': output_format,
+                    'element': element,
+                    'calls': calls,
+                    'time': total_time,
+                    'max_time': max_time,
+                    'avg_time': total_time / calls,
+                    'queries': queries})
+    out.sort(key=lambda stats: stats[sortby], reverse=True)
+    return out
+
+def format_elements_profile_report(profile=None, sortby="time",
+                                   nb_elements=None):
+    """
+    Returns a plain text version of the statistics collected on the
+    evaluation of the format elements.
+
+    @param profile: the statistics to print. If None, use the ones collected in this process
+    @param sortby: sort by decreasing 'time', 'avg_time', 'max_time', 'calls' or 'queries'
+    @param nb_elements: print only this number of elements
+    @return: the report, as text
+    """
+    out = ["%-6s %-30s %8s %12s %10s %10s %8s" % \
+           ("Output", "Format element", "Calls", "Total (ms)",
+            "Avg (ms)", "Max (ms)", "Queries")]
+    for stats in get_format_elements_profile(profile, sortby)[:nb_elements]:
+        out.append("%-6s %-30s %8i %12.2f %10.2f %10.2f %8i" % \
+                   (stats['output_format'], stats['element'],
+                    stats['calls'], stats['time'] * 1000,
+                    stats['avg_time'] * 1000, stats['max_time'] * 1000,
+                    stats['queries']))
+    return "\n".join(out)
+
+def profile_format_records(recids, of, ln=CFG_SITE_LANG, user_info=None):
+    """
+    Formats the given records with profiling of the format elements
+    enabled, and returns the statistics collected on these records
+    only.  The statistics collected so far in this process are left
+    untouched.
+
+    @param recids: the IDs of the records to format
+    @param of: the output format code to use
+    @param ln: the language to use to format the records
+    @param user_info: the information of the user who formats the records
+    @return: the statistics, to be passed to get_format_elements_profile()
+    """
+    thread_id = get_ident()
+    profile = {}
+    format_elements_thread_profiles[thread_id] = profile
+    try:
+        for recid in recids:
+            format_record(recid, of, ln=ln, user_info=user_info)
+        return profile
+    finally:
+        del format_elements_thread_profiles[thread_id]
 
 class BibFormatObject:
     """
@@ -1761,6 +2206,11 @@ class BibFormatObject:
 
     req = None # DEPRECATED: use bfo.user_info instead. Used by WebJournal.
 
+    # Statistics on the format elements evaluated with this object,
+    # in the same form as 'format_elements_profile'. None if they
+    # must not be collected.
+    elements_profile = None
+
     def __init__(self, recID, ln=CFG_SITE_LANG, search_pattern=None,
                  xml_record=None, user_info=None, output_format=''):
         """
@@ -1809,6 +2259,9 @@ class BibFormatObject:
         self.user_info = user_info
         if self.user_info is None:
             self.user_info = collect_user_info(None)
+        # Stamps of the data the cached format elements depend on
+        # (see get_fragment_dependency_stamp())
+        self.fragment_cache_stamps = {}
 
     def get_record(self):
         """
@@ -2128,9 +2581,21 @@ def bf_profile():
     return
 
 if __name__ == "__main__":
-    import profile
-    import pstats
-    #bf_profile()
-    profile.run('bf_profile()', "bibformat_profile")
-    p = pstats.Stats("bibformat_profile")
-    p.strip_dirs().sort_stats("cumulative").print_stats()
+    if len(sys.argv) > 1 and sys.argv[1] == "--elements":
+        # Report on the cost of each format element:
+        # bibformat_engine.py --elements [output format [number of records]]
+        of = "HD"
+        nb_records = 50
+        if len(sys.argv) > 2:
+            of = sys.argv[2]
+        if len(sys.argv) > 3:
+            nb_records = int(sys.argv[3])
+        print format_elements_profile_report(
+            profile_format_records(range(1, nb_records + 1), of))
+    else:
+        import profile
+        import pstats
+        #bf_profile()
+        profile.run('bf_profile()', "bibformat_profile")
+        p = pstats.Stats("bibformat_profile")
+        p.strip_dirs().sort_stats("cumulative").print_stats()
@@ -243,6 +243,53 @@ class FormatElementTest(unittest.TestCase):
         self.assert_("TEST_3" not in elements.keys())
         self.assert_("TEST_4" not in elements.keys())
 
+    def test_preload_caches(self):
+        """bibformat - preloading of format elements"""
+        bibformat_engine.CFG_BIBFORMAT_ELEMENTS_PATH = CFG_BIBFORMAT_ELEMENTS_PATH
+        bibformat_engine.CFG_BIBFORMAT_ELEMENTS_IMPORT_PATH = CFG_BIBFORMAT_ELEMENTS_IMPORT_PATH
+        bibformat_engine.CFG_BIBFORMAT_OUTPUTS_PATH = CFG_BIBFORMAT_OUTPUTS_PATH
+        bibformat_engine.CFG_BIBFORMAT_TEMPLATES_PATH = CFG_BIBFORMAT_TEMPLATES_PATH
+
+        report = bibformat_engine.preload_caches(save_to_file=False)
+        loaded_elements = [element['name'] for element in report['elements']]
+        self.assert_("TEST_1" in loaded_elements)
+        self.assert_("TEST_2" in loaded_elements)
+        self.assert_("bfe_test_4.py" in report['broken_elements'])
+        self.assert_("test3.py" in report['broken_elements'])
+        import_times = [element['import_time'] for element in report['elements']]
+        self.assertEqual(import_times, sorted(import_times, reverse=True))
+        self.assertEqual(bibformat_engine.format_elements_cache["TEST_1.PY"]["attrs"]["name"], "TEST_1")
+
+    def test_format_element_fragments_cache(self):
+        """bibformat - caching of the output of format elements"""
+        bibformat_engine.CFG_BIBFORMAT_ELEMENTS_PATH = CFG_BIBFORMAT_ELEMENTS_PATH
+        bibformat_engine.CFG_BIBFORMAT_ELEMENTS_IMPORT_PATH = CFG_BIBFORMAT_ELEMENTS_IMPORT_PATH
+        bibformat_engine.clear_caches()
+        element = bibformat_engine.get_format_element("test_6")
+        self.assert_(element['cache_function'] is not None)
+
+        bfo = bibformat_engine.BibFormatObject(recID=10, ln='en')
+        bfo.fragment_cache_stamps['record'] = '2012-01-01 00:00:00'
+        (result_1, dummy) = bibformat_engine.eval_format_element(element, bfo, {'param1': 'a'})
+        (result_2, dummy) = bibformat_engine.eval_format_element(element, bfo, {'param1': 'a'})
+        self.assertEqual(result_1, result_2)
+        # Different parameters
+        (result_3, dummy) = bibformat_engine.eval_format_element(element, bfo, {'param1': 'b'})
+        self.assertNotEqual(result_1[1:], result_3[1:])
+
+        # Same record, modified since
+        bfo = bibformat_engine.BibFormatObject(recID=10, ln='en')
+        bfo.fragment_cache_stamps['record'] = '2012-01-02 00:00:00'
+        (result_4, dummy) = bibformat_engine.eval_format_element(element, bfo, {'param1': 'a'})
+        self.assertNotEqual(result_1, result_4)
+
+        # Element does not want to be cached in French
+        bfo = bibformat_engine.BibFormatObject(recID=10, ln='fr')
+        bfo.fragment_cache_stamps['record'] = '2012-01-02 00:00:00'
+        (result_5, dummy) = bibformat_engine.eval_format_element(element, bfo, {'param1': 'a'})
+        (result_6, dummy) = bibformat_engine.eval_format_element(element, bfo, {'param1': 'a'})
+        self.assertNotEqual(result_5, result_6)
+
     def test_get_tags_used_by_element(self):
         """bibformat - identification of tag usage inside element"""
         bibformat_engine.CFG_BIBFORMAT_ELEMENTS_PATH = bibformat_config.CFG_BIBFORMAT_ELEMENTS_PATH
@@ -791,6 +838,35 @@ class FormatTest(unittest.TestCase):
 
         self.assertEqual(result,'''<h1>hi</h1> this is my template\ntest<bfe_non_existing_element must disappear/><test_1  non prefixed element must stay as any normal tag/>tfrgarbage\n<br/>test me!&lt;b&gt;ok&lt;/b&gt;a default valueeditor\n<br/>test me!<b>ok</b>a default valueeditor\n<br/>test me!&lt;b&gt;ok&lt;/b&gt;a default valueeditor\n99999''')
 
+    def test_format_elements_profile(self):
+        """ bibformat - profiling of format elements"""
+        bibformat_engine.CFG_BIBFORMAT_OUTPUTS_PATH = CFG_BIBFORMAT_OUTPUTS_PATH
+        bibformat_engine.CFG_BIBFORMAT_ELEMENTS_PATH = CFG_BIBFORMAT_ELEMENTS_PATH
+        bibformat_engine.CFG_BIBFORMAT_ELEMENTS_IMPORT_PATH = CFG_BIBFORMAT_ELEMENTS_IMPORT_PATH
+        bibformat_engine.CFG_BIBFORMAT_TEMPLATES_PATH = CFG_BIBFORMAT_TEMPLATES_PATH
+
+        bibformat_engine.reset_format_elements_profile()
+        bibformat_engine.enable_format_elements_profiling()
+        try:
+            bibformat_engine.format_record(recID=None, ln='fr', of="test3", xml_record=self.xml_text_3)
+        finally:
+            bibformat_engine.enable_format_elements_profiling(False)
+        profile = bibformat_engine.get_format_elements_profile(sortby="calls")
+        self.assertEqual(profile[0]['output_format'], "test3")
+        self.assertEqual(profile[0]['element'], "TEST_5")
+        self.assertEqual(profile[0]['calls'], 3)
+        self.assert_("TEST_1" in [stats['element'] for stats in profile])
+
+        # Nothing is collected once profiling is disabled
+        bibformat_engine.reset_format_elements_profile()
+        bibformat_engine.format_record(recID=None, ln='fr', of="test3", xml_record=self.xml_text_3)
+        self.assertEqual(bibformat_engine.get_format_elements_profile(), [])
+
+        # Per-record profile in verbose mode
+        result = bibformat_engine.format_record(recID=0, ln='fr', of="test3", verbose=9, xml_record=self.xml_text_3)
+        self.assert_("TEST_5" in result)
+        self.assertEqual(bibformat_engine.get_format_elements_profile(), [])
+
 
 class MarcFilteringTest(unittest.TestCase):
     """ bibformat - MARC tag filtering tests"""
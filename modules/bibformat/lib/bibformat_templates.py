@@ -86,6 +86,10 @@ class Template:
         <dd>Documentation of the format elements to be used inside format templates.</dd>
         </dl>
         <dl>
+        <dt><a href="%(siteurl)s/admin/bibformat/bibformatadmin.py/format_elements_profile?ln=%(ln)s">Format Elements Profile</a></dt>
+        <dd>Time and SQL queries spent in each format element.</dd>
+        </dl>
+        <dl>
         <dt><a href="%(siteurl)s/help/admin/bibformat-admin-guide">BibFormat Admin Guide</a></dt>
         <dd>Documentation about BibFormat administration</dd>
         </dl>
@@ -1768,6 +1772,123 @@ class Template:
         out += '''</td></tr></table>'''
         return out
 
+    def tmpl_admin_format_elements_profile(self, ln, of, p, nb_records,
+                                           output_formats, test_profile,
+                                           process_profile, profiling_enabled):
+        """
+        Prints the page reporting the cost of the format elements.
+
+        @param ln: language
+        @param of: the code of the output format that has been profiled
+        @param p: the search pattern used to select the profiled records
+        @param nb_records: the maximum number of profiled records
+        @param output_formats: a list of (code, name) of the output formats
+        @param test_profile: the statistics of the profiled records, as returned by bibformat_engine.get_format_elements_profile(). None if no record was profiled
+        @param process_profile: the statistics collected by this process
+        @param profiling_enabled: True if profiling is enabled in this process
+        @return: HTML markup
+        """
+        _ = gettext_set_language(ln)    # load the right message language
+
+        out = '''
+        <form method="post" action="format_elements_profile?ln=%(ln)s">
+        <table>
+        <tr>
+        <td class="admintdright">Output format:</td>
+        <td class="admintdleft"><select name="of">
+        ''' % {'ln': ln}
+        for (code, name) in output_formats:
+            if code == of:
+                selected = ' selected="selected"'
+            else:
+                selected = ''
+            out += '''<option value="%(code)s"%(selected)s>%(name)s (%(code)s)</option>''' % \
+                   {'code': cgi.escape(code, quote=True),
+                    'name': cgi.escape(name),
+                    'selected': selected}
+        out += '''
+        </select></td>
+        </tr>
+        <tr>
+        <td class="admintdright">Format records matching:</td>
+        <td class="admintdleft"><input type="text" name="p" value="%(p)s"/></td>
+        </tr>
+        <tr>
+        <td class="admintdright">Maximum number of records:</td>
+        <td class="admintdleft"><input type="text" name="nb_records" value="%(nb_records)s" size="5"/></td>
+        </tr>
+        <tr><td>&nbsp;</td>
+        <td class="admintdleft"><input type="submit" class="adminbutton" value="Profile"/></td>
+        </tr>
+        </table>
+        </form>
+        ''' % {'p': cgi.escape(p, quote=True),
+               'nb_records': nb_records}
+
+        if test_profile is not None:
+            out += '''<h3>Profile of output format %(of)s</h3>''' % \
+                   {'of': cgi.escape(of)}
+            out += self.tmpl_admin_format_elements_profile_table(ln, test_profile)
+
+        if profiling_enabled:
+            status = '''Profiling is enabled in this process
+            <input type="submit" class="adminbutton" name="action" value="disable"/>
+            <input type="submit" class="adminbutton" name="action" value="reset"/>'''
+        else:
+            status = '''Profiling is disabled in this process
+            <input type="submit" class="adminbutton" name="action" value="enable"/>'''
+        out += '''<h3>Profile of this process</h3>
+        <form method="post" action="format_elements_profile?ln=%(ln)s">
+        <p>%(status)s</p>
+        </form>''' % {'ln': ln, 'status': status}
+        out += self.tmpl_admin_format_elements_profile_table(ln, process_profile)
+
+        return out
+
+    def tmpl_admin_format_elements_profile_table(self, ln, profile):
+        """
+        Prints the statistics collected on the format elements as a table.
+
+        @param ln: language
+        @param profile: the statistics, as returned by bibformat_engine.get_format_elements_profile()
+        @return: HTML markup
+        """
+        if not profile:
+            return '''<p><i>No format element has been profiled.</i></p>'''
+
+        out = '''
+        <table class="admin_wvar" cellspacing="0">
+        <tr>
+        <th class="adminheaderleft">Output format</th>
+        <th class="adminheaderleft">Format element</th>
+        <th class="adminheaderright">Calls</th>
+        <th class="adminheaderright">Total (ms)</th>
+        <th class="adminheaderright">Average (ms)</th>
+        <th class="adminheaderright">Max (ms)</th>
+        <th class="adminheaderright">SQL queries</th>
+        </tr>
+        '''
+        for stats in profile:
+            out += '''
+            <tr>
+            <td class="admintdleft">%(output_format)s</td>
+            <td class="admintdleft">%(element)s</td>
+            <td class="admintdright">%(calls)i</td>
+            <td class="admintdright">%(time).2f</td>
+            <td class="admintdright">%(avg_time).2f</td>
+            <td class="admintdright">%(max_time).2f</td>
+            <td class="admintdright">%(queries)i</td>
+            </tr>
+            ''' % {'output_format': cgi.escape(stats['output_format']),
+                   'element': cgi.escape(stats['element']),
+                   'calls': stats['calls'],
+                   'time': stats['time'] * 1000,
+                   'avg_time': stats['avg_time'] * 1000,
+                   'max_time': stats['max_time'] * 1000,
+                   'queries': stats['queries']}
+        out += '''</table>'''
+        return out
+
     def tmpl_admin_add_format_element(self, ln):
         """
         Shows how to add a format element (mainly doc)
@@ -416,6 +416,55 @@ def perform_request_format_element_test(bfe, ln=CFG_SITE_LANG, param_values=None
                                                               param_descriptions,
                                                               result)
 
+def perform_request_format_elements_profile(ln=CFG_SITE_LANG, of="",
+                                            p="", nb_records=10,
+                                            action="", user_info=None):
+    """
+    Returns the page reporting the cost of the format elements.
+
+    Shows the statistics collected by this process (if profiling is
+    enabled), and, if an output format is given, the statistics of
+    the formatting of the first records matching the search pattern
+    'p' with this output format.
+
+    @param ln: language
+    @param of: the code of the output format to profile
+    @param p: search pattern selecting the records to format
+    @param nb_records: the maximum number of records to format
+    @param action: 'reset' to forget the statistics of this process,
+                   'enable' or 'disable' to switch profiling on or off
+    @param user_info: the user_info of this request
+    @return: HTML markup of the format elements profile page
+    """
+    if action == "reset":
+        bibformat_engine.reset_format_elements_profile()
+    elif action == "enable":
+        bibformat_engine.enable_format_elements_profiling(True)
+    elif action == "disable":
+        bibformat_engine.enable_format_elements_profiling(False)
+
+    test_profile = None
+    if of:
+        recIDs = perform_request_search(p=p)[:nb_records]
+        test_profile = bibformat_engine.get_format_elements_profile(
+            bibformat_engine.profile_format_records(recIDs, of, ln=ln,
+                                                    user_info=user_info))
+
+    output_formats = [(output_format['attrs']['code'],
+                       output_format['attrs']['names']['generic']) \
+                      for output_format in \
+                      bibformat_engine.get_output_formats(with_attributes=True).values()]
+    output_formats.sort()
+
+    return bibformat_templates.tmpl_admin_format_elements_profile(ln,
+                                                                  of,
+                                                                  p,
+                                                                  nb_records,
+                                                                  output_formats,
+                                                                  test_profile,
+                                                                  bibformat_engine.get_format_elements_profile(),
+                                                                  bibformat_engine.is_format_elements_profiling_enabled())
+
 def perform_request_output_formats_management(ln=CFG_SITE_LANG, sortby="code"):
     """
     Returns the main management console for output formats.
@@ -42,7 +42,7 @@ try:
     from invenio.bibtask import task_init, write_message, task_set_option, \
             task_get_option, task_update_progress, task_has_option, \
             task_low_level_submission, task_sleep_now_if_required, \
-            task_get_task_param
+            task_get_task_param, task_count_records
     import os
     import time
     import zlib
@@ -283,6 +283,7 @@ def iterate_over_new(list, fmt):
         t2 = os.times()[4]
         tbibformat += (t2 - t1)
         count += 1
+        task_count_records()
         if (count % 100) == 0:
             write_message("   ... formatted %s records out of %s" % (count, tot))
             task_update_progress('Formatted %s out of %s' % (count, tot))
@@ -312,6 +313,7 @@ def iterate_over_old(list, fmt):
 
         n_rec = n_rec + 1
         total_rec = total_rec + 1
+        task_count_records()
 
         message = "Processing record: %d" % (record)
         write_message(message, verbose=9)
@@ -164,6 +164,13 @@ def escape_values(bfo):
     """
     return 0
 
+def cache_dependencies(bfo):
+    """
+    Called by BibFormat in order to know if the output of this element
+    can be cached, and until when it remains valid.
+    """
+    return ['record', 'bibdocs']
+
 def get_files(bfo, distinguish_main_and_additional_files=True, include_subformat_icons=False):
     """
     Returns the files available for the given record.
@@ -69,3 +69,10 @@ def escape_values(bfo):
     should be escaped.
     """
     return 0
+
+def cache_dependencies(bfo):
+    """
+    Called by BibFormat in order to know if the output of this element
+    can be cached, and until when it remains valid.
+    """
+    return ['record', 'bibdocs']
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2012 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+"""BibFormat element - test file for the cache of format elements
+"""
+__revision__ = "$Id$"
+
+nb_calls = 0
+
+def format_element(bfo, param1=""):
+    """
+    Prints the parameter, followed by the number of times the element
+    has been evaluated
+
+    @param param1: desc 1
+    """
+    global nb_calls
+    nb_calls += 1
+    return "%s%i" % (param1, nb_calls)
+
+def cache_dependencies(bfo):
+    """
+    Cache the output, excepted in French
+    """
+    if bfo.lang == 'fr':
+        return None
+    return ['record']
@@ -906,6 +906,52 @@ def format_elements_doc(req, ln=CFG_SITE_LANG):
                                    text=auth_msg,
                                    navtrail=navtrail_previous_links)
 
+def format_elements_profile(req, ln=CFG_SITE_LANG, of="", p="",
+                            nb_records="10", action=""):
+    """
+    Page reporting the time and SQL queries spent in each format
+    element. Check for authentication and print the statistics.
+
+    @param req: the request object
+    @param ln: language
+    @param of: the code of the output format to profile
+    @param p: search pattern selecting the records to format
+    @param nb_records: the maximum number of records to format
+    @param action: 'reset', 'enable' or 'disable' the profiling of this process (POST only)
+    @return: a web page
+    """
+    ln = wash_language(ln)
+    _ = gettext_set_language(ln)
+    navtrail_previous_links = bibformatadminlib.getnavtrail()
+
+    (auth_code, auth_msg) = check_user(req, 'cfgbibformat')
+    if not auth_code:
+        of = wash_url_argument(of, 'str')
+        p = wash_url_argument(p, 'str')
+        nb_records = wash_url_argument(nb_records, 'int')
+        action = wash_url_argument(action, 'str')
+        if req.method != 'POST':
+            ## changing the state of the process needs a POST request
+            action = ""
+        user_info = collect_user_info(req)
+        uid = user_info['uid']
+        return page(title=_("Format Elements Profile"),
+                body=bibformatadminlib.perform_request_format_elements_profile(ln=ln,
+                                                                               of=of,
+                                                                               p=p,
+                                                                               nb_records=nb_records,
+                                                                               action=action,
+                                                                               user_info=user_info),
+                uid=uid,
+                language=ln,
+                navtrail = navtrail_previous_links,
+                lastupdated=__lastupdated__,
+                req=req)
+    else:
+        return page_not_authorized(req=req,
+                                   text=auth_msg,
+                                   navtrail=navtrail_previous_links)
+
 def format_element_show_dependencies(req, bfe, ln=CFG_SITE_LANG):
     """
     Shows format element dependencies
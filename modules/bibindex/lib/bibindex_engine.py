@@ -56,16 +56,17 @@ from invenio.websubmit_file_converter import convert_file, get_file_converter_lo
 from invenio.search_engine import perform_request_search, \
      get_index_stemming_language, \
      get_synonym_terms
-from invenio.dbquery import run_sql, DatabaseError, serialize_via_marshal, \
-     deserialize_via_marshal, wash_table_column_name
+from invenio.dbquery import run_sql, run_sql_in, DatabaseError, \
+     serialize_via_marshal, deserialize_via_marshal, wash_table_column_name
 from invenio.bibindex_engine_washer import wash_index_term
 from invenio.bibtask import task_init, write_message, get_datetime, \
     task_set_option, task_get_option, task_get_task_param, \
-    task_update_progress, task_sleep_now_if_required
+    task_update_progress, task_sleep_now_if_required, task_count_records
 from invenio.intbitset import intbitset
 from invenio.errorlib import register_exception
 from invenio.htmlutils import get_links_in_html_page
-from invenio.search_engine_utils import get_fieldvalues
+from invenio.search_engine_utils import get_fieldvalues, \
+     get_fieldvalues_for_records
 from invenio.solrutils_bibindex_indexer import solr_add_fulltext, solr_commit
 from invenio.xapianutils_bibindex_indexer import xapian_add
 
@@ -913,6 +914,7 @@ class WordTable:
                 flush_count = flush_count + i_high - i_low + 1
                 chunksize_count = chunksize_count + i_high - i_low + 1
                 records_done = records_done + just_processed
+                task_count_records(just_processed)
                 write_message("%s adding records #%d-#%d ended  " % \
                         (self.tablename, i_low, i_high))
 
@@ -1030,7 +1032,10 @@ class WordTable:
                     ## FIXME: Quick hack to be sure that hidden files are
                     ## actually indexed.
                     res = set(res)
-                    for recid in xrange(int(recID1), int(recID2) + 1):
+                    recids_with_docs = run_sql_in("""SELECT id_bibrec, id_bibdoc
+                        FROM bibrec_bibdoc WHERE id_bibrec IN (%(ids)s)""",
+                        xrange(int(recID1), int(recID2) + 1))
+                    for recid in recids_with_docs:
                         for bibdocfile in BibRecDocs(recid).list_latest_files():
                             res.add((recid, bibdocfile.get_url()))
                 for row in sorted(res):
@@ -1055,9 +1060,10 @@ class WordTable:
         # were there some words for these recIDs found?
         if len(wlist) == 0: return 0
         recIDs = wlist.keys()
+        collections = get_fieldvalues_for_records(recIDs, "980__c")
         for recID in recIDs:
             # was this record marked as deleted?
-            if "DELETED" in self.get_field(recID, "980__c"):
+            if "DELETED" in collections.get(recID, []):
                 wlist[recID] = []
                 write_message("... record %d was declared deleted, removing its word list" % recID, verbose=9)
             write_message("... record %d, termlist: %s" % (recID, wlist[recID]), verbose=9)
@@ -90,6 +90,7 @@ from invenio.bibrank_tag_based_indexer import \
      download_weight_filtering_user, \
      download_weight_total, \
      file_similarity_by_times_downloaded, \
+     reading_similarity, \
      index_term_count
 from invenio.bibrank_word_indexer import word_similarity #@UnusedImport
 from invenio.bibrank_citerank_indexer import citerank #@UnusedImport
@@ -27,7 +27,7 @@ import ConfigParser
 from itertools import islice
 from datetime import datetime
 
-from invenio.dbquery import run_sql, serialize_via_marshal, \
+from invenio.dbquery import run_sql, run_sql_iter, serialize_via_marshal, \
                             deserialize_via_marshal
 from invenio.bibindex_engine import CFG_JOURNAL_PUBINFO_STANDARD_FORM
 from invenio.search_engine import search_pattern, search_unit
@@ -932,7 +932,7 @@ def get_initial_author_dict():
     """read author->citedinlist dict from the db"""
     adict = {}
     try:
-        ah = run_sql("SELECT aterm,hitlist FROM rnkAUTHORDATA")
+        ah = run_sql_iter("SELECT aterm,hitlist FROM rnkAUTHORDATA")
         for (a, h) in ah:
             adict[a] = deserialize_via_marshal(h)
         return adict
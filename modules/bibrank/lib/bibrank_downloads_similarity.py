@@ -20,10 +20,13 @@
 __revision__ = \
    "$Id$"
 
+import heapq
+
 from invenio.config import \
      CFG_ACCESS_CONTROL_LEVEL_SITE, \
+     CFG_BIBRANK_PRECOMPUTED_READING_SIMILARITY, \
      CFG_CERN_SITE
-from invenio.dbquery import run_sql
+from invenio.dbquery import run_sql, serialize_via_marshal, deserialize_via_marshal
 from invenio.bibrank_downloads_indexer import database_tuples_to_single_list
 from invenio.search_engine_utils import get_fieldvalues
 
@@ -70,6 +73,8 @@ def calculate_reading_similarity_list(recid, type="pageviews"):
        depending whether we want to obtain page view similarity or
        download similarity.
     """
+    if CFG_BIBRANK_PRECOMPUTED_READING_SIMILARITY:
+        return get_precomputed_reading_similarity_list(recid, type)
     if CFG_CERN_SITE:
         return [] # CERN hack 2009-11-23 to ease the load
     if type == "downloads":
@@ -97,3 +102,125 @@ def calculate_reading_similarity_list(recid, type="pageviews"):
                       " GROUP BY id_bibrec ORDER BY c DESC LIMIT 10",
                       (recid,))
     return res
+
+def get_precomputed_reading_similarity_list(recid, type="pageviews"):
+    """Return the reading similarity list of RECID, as computed by
+       calculate_reading_similarity_list(), but read from the lists
+       maintained by the reading_similarity rank method (see
+       update_reading_similarity()) instead of from the page view or
+       download tables.
+    """
+    if type != "downloads":
+        type = "pageviews"
+    res = run_sql("SELECT similarlist FROM rnkREADINGSIMILARITY" \
+                  " WHERE id_bibrec=%s AND type=%s", (recid, type))
+    if not res:
+        return []
+    return deserialize_via_marshal(res[0][0])
+
+def get_reading_events_table(type):
+    """Return the table name and the time column name holding the
+       reading events of TYPE (`pageviews' or `downloads').
+    """
+    if type == "downloads":
+        return ("rnkDOWNLOADS", "download_time")
+    else: # default
+        return ("rnkPAGEVIEWS", "view_time")
+
+def count_reading_cooccurrences(new_reads, old_reads, max_reads_per_host=None):
+    """Return the co-occurrences brought by new reading events, as a
+       dictionary {recid1: {recid2: count}}, where count is the number
+       of client hosts that read both recid1 and recid2 for the first
+       time.  NEW_READS and OLD_READS are dictionaries {client_host:
+       set of recids} of the records read by each client host in the
+       new events and before them.  The client hosts that read more
+       than MAX_READS_PER_HOST records in all (robots, proxies...) are
+       skipped: they say little about the similarity of the records
+       and would cost a number of pairs quadratic in their reads.
+    """
+    delta = {}
+    for client_host, recids in new_reads.iteritems():
+        old_recids = old_reads.get(client_host, set())
+        if max_reads_per_host is not None and \
+               len(old_recids | recids) > max_reads_per_host:
+            continue
+        recids = recids - old_recids
+        for recid in recids:
+            counts = delta.setdefault(recid, {})
+            for other_recid in old_recids:
+                counts[other_recid] = counts.get(other_recid, 0) + 1
+                other_counts = delta.setdefault(other_recid, {})
+                other_counts[recid] = other_counts.get(recid, 0) + 1
+            for other_recid in recids:
+                if other_recid != recid:
+                    counts[other_recid] = counts.get(other_recid, 0) + 1
+    return delta
+
+def update_reading_similarity(type, since, until, nb_similar=10, chunk_size=1000,
+                              max_reads_per_host=1000):
+    """Update the reading similarity (``people who viewed this page
+       have also viewed'') of the records read between SINCE and
+       UNTIL, without rescanning the whole event tables.
+
+       For each record, rnkREADINGSIMILARITY keeps the number of
+       different client hosts having read both it and each other
+       record (the row of a sparse co-occurrence matrix), and the
+       NB_SIMILAR records with the highest counts.  Only the client
+       hosts that read something between SINCE and UNTIL are looked
+       at, and only the pairs of records involving a record that a
+       host read for the first time are counted, so each host is
+       counted once per pair of records, as in
+       calculate_reading_similarity_list().  The client hosts having
+       read more than MAX_READS_PER_HOST records are ignored (see
+       count_reading_cooccurrences()).
+
+       Return the number of records whose similarity was updated.
+    """
+    tablename, timecolumn = get_reading_events_table(type)
+    # firstly find what the client hosts have read for the first time:
+    new_reads = {}
+    for client_host, recid in run_sql("SELECT DISTINCT client_host, id_bibrec" \
+                                      "  FROM " + tablename + \
+                                      " WHERE " + timecolumn + ">=%s" \
+                                      "   AND " + timecolumn + "<%s" \
+                                      "   AND client_host IS NOT NULL" \
+                                      "   AND id_bibrec IS NOT NULL",
+                                      (since, until)):
+        new_reads.setdefault(client_host, set()).add(recid)
+    # no need to look at the past reads of the hosts already read too much:
+    if max_reads_per_host is not None:
+        for client_host, recids in new_reads.items():
+            if len(recids) > max_reads_per_host:
+                del new_reads[client_host]
+    old_reads = {}
+    client_hosts = new_reads.keys()
+    for i in xrange(0, len(client_hosts), chunk_size):
+        chunk = client_hosts[i:i + chunk_size]
+        for client_host, recid in run_sql("SELECT DISTINCT client_host, id_bibrec" \
+                                          "  FROM " + tablename + \
+                                          " WHERE client_host IN (" + ("%s," * len(chunk))[:-1] + ")" \
+                                          "   AND " + timecolumn + "<%s" \
+                                          "   AND id_bibrec IS NOT NULL",
+                                          tuple(chunk) + (since,)):
+            old_reads.setdefault(client_host, set()).add(recid)
+    # secondly count the new co-occurrences:
+    delta = count_reading_cooccurrences(new_reads, old_reads, max_reads_per_host)
+    # thirdly merge them with the stored co-occurrences:
+    recids = delta.keys()
+    for i in xrange(0, len(recids), chunk_size):
+        chunk = recids[i:i + chunk_size]
+        stored = dict(run_sql("SELECT id_bibrec, cooccurrences FROM rnkREADINGSIMILARITY" \
+                              " WHERE type=%s AND id_bibrec IN (" + ("%s," * len(chunk))[:-1] + ")",
+                              (type,) + tuple(chunk)))
+        for recid in chunk:
+            if recid in stored:
+                counts = deserialize_via_marshal(stored[recid])
+                for other_recid, count in delta[recid].iteritems():
+                    counts[other_recid] = counts.get(other_recid, 0) + count
+            else:
+                counts = delta[recid]
+            similarlist = heapq.nlargest(nb_similar, counts.iteritems(), key=lambda x: x[1])
+            run_sql("REPLACE INTO rnkREADINGSIMILARITY (id_bibrec, type, cooccurrences, similarlist)" \
+                    " VALUES (%s,%s,%s,%s)",
+                    (recid, type, serialize_via_marshal(counts), serialize_via_marshal(similarlist)))
+    return len(recids)
@@ -0,0 +1,56 @@
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+__revision__ = "$Id$"
+
+import unittest
+
+from invenio import bibrank_downloads_similarity
+from invenio.testutils import make_test_suite, run_test_suite
+
+class TestReadingCooccurrences(unittest.TestCase):
+    """Test the incremental counting of reading co-occurrences."""
+
+    def test_count_reading_cooccurrences_new_hosts(self):
+        """bibrank downloads similarity - co-occurrences of new client hosts"""
+        self.assertEqual({1: {2: 2, 3: 1}, 2: {1: 2, 3: 1}, 3: {1: 1, 2: 1}},
+                         bibrank_downloads_similarity.count_reading_cooccurrences(
+                             {10: set([1, 2, 3]), 11: set([1, 2])}, {}))
+
+    def test_count_reading_cooccurrences_known_hosts(self):
+        """bibrank downloads similarity - co-occurrences of known client hosts"""
+        # host 10 already read 1 and 2: only the pairs involving 3 are new,
+        # and reading 2 again does not count
+        self.assertEqual({3: {1: 1, 2: 1}, 1: {3: 1}, 2: {3: 1}},
+                         bibrank_downloads_similarity.count_reading_cooccurrences(
+                             {10: set([2, 3])}, {10: set([1, 2])}))
+
+    def test_count_reading_cooccurrences_busy_hosts(self):
+        """bibrank downloads similarity - client hosts reading too much are skipped"""
+        # host 11 read 4 records in all: over the limit, whether they
+        # are new or old reads
+        self.assertEqual({1: {2: 1}, 2: {1: 1}},
+                         bibrank_downloads_similarity.count_reading_cooccurrences(
+                             {10: set([1, 2]), 11: set([1, 2, 3])}, {11: set([4])}, 3))
+        self.assertEqual({},
+                         bibrank_downloads_similarity.count_reading_cooccurrences(
+                             {11: set([1, 2, 3, 4])}, {}, 3))
+
+TEST_SUITE = make_test_suite(TestReadingCooccurrences,)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -26,25 +26,32 @@ import math
 import re
 import ConfigParser
 import copy
+from array import array
+from operator import itemgetter
 
 
 from invenio.config import \
      CFG_SITE_LANG, \
      CFG_ETCDIR, \
      CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS
-from invenio.dbquery import run_sql, deserialize_via_marshal, wash_table_column_name
+from invenio.dbquery import run_sql, run_sql_iter, deserialize_via_marshal, \
+     wash_table_column_name, get_table_update_time
 from invenio.errorlib import register_exception
 from invenio.webpage import adderrorbox
 from invenio.bibindex_engine_stemmer import stem
 from invenio.bibindex_engine_stopwords import is_stopword
 from invenio.bibrank_citation_searcher import get_cited_by, get_cited_by_weight
 from invenio.intbitset import intbitset
-from invenio.bibrank_word_searcher import find_similar
+from invenio.bibrank_word_searcher import find_similar, sort_reclist
 # Do not remove these lines, it is necessary for func_object = globals().get(function)
 from invenio.bibrank_word_searcher import word_similarity
 from invenio.solrutils_bibrank_searcher import word_similarity_solr
 from invenio.xapianutils_bibrank_searcher import word_similarity_xapian
 
+## ranking data of the methods ranked by rank_by_method, by method code:
+## (rnkMETHODDATA update time, {recid: value}, intbitset of the ranked
+## recids, array of the ranked recids sorted by ascending value)
+rank_method_data_cache = {}
 
 def compare_on_val(first, second):
     return cmp(second[1], first[1])
@@ -150,6 +157,8 @@ def create_rnkmethod_cache():
             methods[rank_method_code]["max_nr_words_upper"] = int(config.get("find_similar", "max_nr_words_upper"))
             methods[rank_method_code]["max_nr_words_lower"] = int(config.get("find_similar", "max_nr_words_lower"))
             methods[rank_method_code]["default_min_relevance"] = int(config.get("find_similar", "default_min_relevance"))
+            if config.has_option("find_similar", "nb_similar_records"):
+                methods[rank_method_code]["nb_similar_records"] = int(config.get("find_similar", "nb_similar_records"))
 
         if cfg_function in ('word_similarity_solr', 'word_similarity_xapian'):
             create_external_ranking_settings(rank_method_code, config)
@@ -241,6 +250,9 @@ def rank_records(rank_method_code, rank_limit_relevance, hitset_global, pattern=
             voutput += "function: %s <br/> " % function
             voutput += "pattern:  %s <br/>" % str(pattern)
 
+        # only the records up to the requested page need to be sorted:
+        nb_records = get_nb_records_to_rank(rg, jrec)
+
         if func_object and pattern and pattern[0][0:6] == "recid:" and function == "word_similarity":
             result = find_similar(rank_method_code, pattern[0][6:], hitset, rank_limit_relevance, verbose, methods)
         elif rank_method_code == "citation":
@@ -252,7 +264,9 @@ def rank_records(rank_method_code, rank_limit_relevance, hitset_global, pattern=
 
         elif func_object:
             if function == "word_similarity":
-                result = func_object(rank_method_code, pattern, hitset, rank_limit_relevance, verbose, methods)
+                result = func_object(rank_method_code, pattern, hitset, rank_limit_relevance, verbose, methods, nb_records)
+            elif function == "combine_method":
+                result = func_object(rank_method_code, pattern, hitset, rank_limit_relevance, verbose, nb_records)
             elif function in ("word_similarity_solr", "word_similarity_xapian"):
                 if not rg:
                     rg = CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS
@@ -276,7 +290,7 @@ def rank_records(rank_method_code, rank_limit_relevance, hitset_global, pattern=
             else:
                 result = func_object(rank_method_code, pattern, hitset, rank_limit_relevance, verbose)
         else:
-            result = rank_by_method(rank_method_code, pattern, hitset, rank_limit_relevance, verbose)
+            result = rank_by_method(rank_method_code, pattern, hitset, rank_limit_relevance, verbose, nb_records)
     except Exception, e:
         register_exception()
         result = (None, "", adderrorbox("An error occured when trying to rank the search result "+rank_method_code, ["Unexpected error: %s<br />" % (e,)]), voutput)
@@ -301,8 +315,20 @@ def rank_records(rank_method_code, rank_limit_relevance, hitset_global, pattern=
     #result = (None, "", adderrorbox("Debug ",rank_method_code+" "+dbg),"",voutput);
     return result
 
-def combine_method(rank_method_code, pattern, hitset, rank_limit_relevance,verbose):
-    """combining several methods into one based on methods/percentage in config file"""
+def get_nb_records_to_rank(rg, jrec):
+    """Return how many of the best records have to be sorted in order to
+    display the page of RG records starting at JREC, or None if all of
+    them have to.  As in search_engine.get_interval_for_records_to_sort(),
+    rg=-9999 means all the records and other negative values of RG (they
+    can come from the URL) count as abs(rg)."""
+
+    if not rg or rg == -9999:
+        return None
+    return abs(rg) + max(jrec or 0, 0)
+
+def combine_method(rank_method_code, pattern, hitset, rank_limit_relevance,verbose, nb_records=None):
+    """combining several methods into one based on methods/percentage in config file
+    nb_records - if set, only the nb_records best records are sorted (see sort_reclist)"""
 
     global voutput
     result = {}
@@ -322,13 +348,31 @@ def combine_method(rank_method_code, pattern, hitset, rank_limit_relevance,verbo
                 if value > 0:
                     result[recID] = result.get(recID, 0) + int((float(i) / len(this_result)) * float(percent))
 
-        result = result.items()
-        result.sort(lambda x, y: cmp(x[1], y[1]))
+        result = sort_reclist(result.items(), nb_records)
         return (result, "(", ")", voutput)
     except Exception, e:
         return (None, "Warning: %s method cannot be used for ranking your query." % rank_method_code, "", voutput)
 
-def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance,verbose):
+def get_rank_method_data(rank_method_code):
+    """Returns the ranking data of a method ranked by rank_by_method, as a tuple
+    ({recid: value}, intbitset of the ranked recids, array of the ranked recids sorted
+    by ascending value), or None if the method has no ranking data.  The data is
+    deserialized and sorted once, and kept in memory until rnkMETHODDATA changes."""
+
+    update_time = get_table_update_time('rnkMETHODDATA')
+    cached = rank_method_data_cache.get(rank_method_code)
+    if cached and cached[0] == update_time:
+        return cached[1:]
+    rnkdict = run_sql("SELECT relevance_data FROM rnkMETHODDATA,rnkMETHOD where rnkMETHOD.id=id_rnkMETHOD and rnkMETHOD.name=%s", (rank_method_code,))
+    if not rnkdict:
+        return None
+    rnkdict = deserialize_via_marshal(rnkdict[0][0])
+    # ties are sorted by recid, as when sorting the (recid, value) list of a hitset
+    sorted_recids = array('l', sorted(rnkdict, key=lambda recid: (rnkdict[recid], recid)))
+    rank_method_data_cache[rank_method_code] = (update_time, rnkdict, intbitset(sorted_recids), sorted_recids)
+    return (rnkdict, rank_method_data_cache[rank_method_code][2], sorted_recids)
+
+def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance,verbose, nb_records=None):
     """Ranking of records based on predetermined values.
     input:
     rank_method_code - the code of the method, from the name field in rnkMETHOD, used to get predetermined values from
@@ -337,6 +381,9 @@ def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance,verbos
     hitset - a list of hits for the query found by search_engine
     rank_limit_relevance - show only records with a rank value above this
     verbose - verbose value
+    nb_records - if set, only the nb_records best records are sorted: they are found by walking
+    down the records sorted by value until nb_records of them are in hitset, and the other
+    ranked records are kept before them unsorted
     output:
     reclist - a list of sorted records, with unsorted added to the end: [[23,34], [344,24], [1,01]]
     prefix - what to show before the rank value
@@ -345,9 +392,9 @@ def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance,verbos
 
     global voutput
     voutput = ""
-    rnkdict = run_sql("SELECT relevance_data FROM rnkMETHODDATA,rnkMETHOD where rnkMETHOD.id=id_rnkMETHOD and rnkMETHOD.name=%s", (rank_method_code,))
+    rank_method_data = get_rank_method_data(rank_method_code)
 
-    if not rnkdict:
+    if not rank_method_data:
         return (None, "Warning: Could not load ranking data for method %s." % rank_method_code, "", voutput)
 
     max_recid = 0
@@ -372,37 +419,50 @@ def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance,verbos
             else:
                 return (None, "Warning: Given record IDs are out of range.", "", voutput)
 
-    rnkdict = deserialize_via_marshal(rnkdict[0][0])
+    (rnkdict, ranked_recids, sorted_recids) = rank_method_data
     if verbose > 0:
         voutput += "<br />Running rank method: %s, using rank_by_method function in bibrank_record_sorter<br />" % rank_method_code
         voutput += "Ranking data loaded, size of structure: %s<br />" % len(rnkdict)
-    lrecIDs = list(hitset)
 
     if verbose > 0:
-        voutput += "Number of records to rank: %s<br />" % len(lrecIDs)
+        voutput += "Number of records to rank: %s<br />" % len(hitset)
     reclist = []
     reclist_addend = []
 
-    if not lwords_hitset: #rank all docs, can this be speed up using something else than for loop?
-        for recID in lrecIDs:
-            if rnkdict.has_key(recID):
-                reclist.append((recID, rnkdict[recID]))
-                del rnkdict[recID]
-            else:
-                reclist_addend.append((recID, 0))
+    if not lwords_hitset: #rank all docs
+        hitset = intbitset(hitset)
+        hitset_ranked = hitset & ranked_recids
+        reclist_addend = [(recID, 0) for recID in hitset - ranked_recids]
+        if nb_records is not None and 0 < nb_records < len(hitset_ranked):
+            # walk down from the best record until enough of them are hits
+            best = []
+            i = len(sorted_recids) - 1
+            while len(best) < nb_records:
+                if sorted_recids[i] in hitset_ranked:
+                    best.append(sorted_recids[i])
+                i -= 1
+            best.reverse()
+            hitset_ranked -= intbitset(best)
+            reclist = [(recID, rnkdict[recID]) for recID in hitset_ranked] + \
+                      [(recID, rnkdict[recID]) for recID in best]
+        elif len(hitset_ranked) * 10 < len(sorted_recids):
+            # few hits: sorting them is faster than walking all the ranked records
+            reclist = [(recID, rnkdict[recID]) for recID in hitset_ranked]
+            reclist.sort(key=itemgetter(1))
+        else:
+            reclist = [(recID, rnkdict[recID]) for recID in sorted_recids if recID in hitset_ranked]
     else: #rank docs in hitset, can this be speed up using something else than for loop?
         for recID in lwords_hitset:
             if rnkdict.has_key(recID) and recID in hitset:
                 reclist.append((recID, rnkdict[recID]))
-                del rnkdict[recID]
             elif recID in hitset:
                 reclist_addend.append((recID, 0))
+        reclist = sort_reclist(reclist, nb_records)
 
     if verbose > 0:
         voutput += "Number of records ranked: %s<br />" % len(reclist)
         voutput += "Number of records not ranked: %s<br />" % len(reclist_addend)
 
-    reclist.sort(lambda x, y: cmp(x[1], y[1]))
     return (reclist_addend + reclist, methods[rank_method_code]["prefix"], methods[rank_method_code]["postfix"], voutput)
 
 def find_citations(rank_method_code, recID, hitset, verbose):
@@ -440,3 +500,35 @@ def find_citations(rank_method_code, recID, hitset, verbose):
         return (ret,"(", ")", "")
     else:
         return ((),"", "", "")
+
+def rank_records_profile(rank_method_code, hitset=None, rg=10, nb_runs=10):
+    """
+    Runs a benchmark of rank_records() ranking the whole hitset and
+    sorting only the first page of it.
+
+    @param rank_method_code: the rank method to benchmark
+    @param hitset: the records to rank (defaults to all the records)
+    @param rg: the number of records of the page
+    @param nb_runs: the number of times each ranking is run
+    @return: a list of tuples (ranking, seconds per run)
+    """
+    if hitset is None:
+        hitset = intbitset()
+        for res in run_sql_iter("SELECT id FROM bibrec", batches=True):
+            hitset |= intbitset(res)
+    results = []
+    for (name, page_size) in (("exhaustive", None), ("first page", rg)):
+        start = time.time()
+        for dummy in range(nb_runs):
+            rank_records(rank_method_code, 0, hitset, rg=page_size)
+        elapsed = (time.time() - start) / nb_runs
+        results.append((name, elapsed))
+        print "%-12s %8d records %8.4f s" % (name, len(hitset), elapsed)
+    return results
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        rank_records_profile(sys.argv[1])
+    else:
+        print "Usage: %s rank_method_code" % sys.argv[0]
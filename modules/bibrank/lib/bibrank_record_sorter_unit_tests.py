@@ -24,6 +24,7 @@ __revision__ = "$Id$"
 import unittest
 
 from invenio import bibrank_word_searcher
+from invenio import bibrank_record_sorter
 from invenio.intbitset import intbitset
 from invenio.testutils import make_test_suite, run_test_suite
 
@@ -47,6 +48,36 @@ class TestListSetOperations(unittest.TestCase):
         self.assertEqual(({1: 7, 2: 7, 5: 5}, {1: 1, 2: 1, 5: 1}),  bibrank_word_searcher.calculate_record_relevance(("testterm", 2.0),
 {"Gi":(0, 50.0), 1: (3, 4.0), 2: (4, 5.0), 5: (1, 3.5)}, hitset, {}, {}, 0, None))
 
+    def test_calculate_record_relevance_small_hitset(self):
+        """bibrank record sorter - calculating relevances for a hitset smaller than the hitlist"""
+        hitset = intbitset([2, 5, 7])
+        self.assertEqual(({2: 7, 5: 5}, {2: 1, 5: 1}),  bibrank_word_searcher.calculate_record_relevance(("testterm", 2.0),
+{"Gi":(0, 50.0), 1: (3, 4.0), 2: (4, 5.0), 3: (1, 1.0), 4: (2, 2.0), 5: (1, 3.5)}, hitset, {}, {}, 0, None))
+
+    def test_sort_reclist(self):
+        """bibrank record sorter - sorting only the best records"""
+        reclist = [(1, 50), (2, 30), (3, 70), (4, 10), (5, 70), (6, 20)]
+        self.assertEqual([(4, 10), (6, 20), (2, 30), (1, 50), (3, 70), (5, 70)],
+                         bibrank_word_searcher.sort_reclist(list(reclist)))
+        self.assertEqual([(2, 30), (4, 10), (6, 20), (1, 50), (3, 70), (5, 70)],
+                         bibrank_word_searcher.sort_reclist(list(reclist), 3))
+
+    def test_sort_reclist_negative_window(self):
+        """bibrank record sorter - sorting all the records for a negative window"""
+        reclist = [(1, 50), (2, 30), (3, 70), (4, 10), (5, 70), (6, 20)]
+        for nb_records in (-9999, -3, 0):
+            self.assertEqual([(4, 10), (6, 20), (2, 30), (1, 50), (3, 70), (5, 70)],
+                             bibrank_word_searcher.sort_reclist(list(reclist), nb_records))
+
+    def test_nb_records_to_rank(self):
+        """bibrank record sorter - number of records to rank for a page"""
+        self.assertEqual(None, bibrank_record_sorter.get_nb_records_to_rank(0, 1))
+        self.assertEqual(None, bibrank_record_sorter.get_nb_records_to_rank(-9999, 1))
+        self.assertEqual(None, bibrank_record_sorter.get_nb_records_to_rank(-9999, 11))
+        self.assertEqual(11, bibrank_record_sorter.get_nb_records_to_rank(10, 1))
+        self.assertEqual(11, bibrank_record_sorter.get_nb_records_to_rank(-10, 1))
+        self.assertEqual(10, bibrank_record_sorter.get_nb_records_to_rank(-10, -5))
+
 TEST_SUITE = make_test_suite(TestListSetOperations,)
 
 if __name__ == "__main__":
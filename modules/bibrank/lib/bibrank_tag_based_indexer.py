@@ -33,6 +33,7 @@ from invenio.config import \
 from invenio.search_engine import perform_request_search
 from invenio.bibrank_citation_indexer import get_citation_weight, print_missing, get_cit_dict, insert_into_cit_db
 from invenio.bibrank_downloads_indexer import *
+from invenio.bibrank_downloads_similarity import update_reading_similarity
 from invenio.dbquery import run_sql, serialize_via_marshal, deserialize_via_marshal, \
      wash_table_column_name, get_table_update_time
 from invenio.errorlib import register_exception
@@ -81,6 +82,11 @@ def file_similarity_by_times_downloaded_repair_exec():
     write_message("Repairing for this ranking method is not defined. Skipping.")
     return
 
+def reading_similarity_repair_exec():
+    """Repair reading similarity ranking method"""
+    write_message("Repairing for this ranking method is not defined. Use -R to recalculate it. Skipping.")
+    return
+
 def single_tag_rank_method_repair_exec():
     """Repair single tag ranking method"""
     write_message("Repairing for this ranking method is not defined. Skipping.")
@@ -156,6 +162,36 @@ def file_similarity_by_times_downloaded_exec(rank_method_code, name, config):
     time2 = time.time()
     return {"time":time2-time1}
 
+def reading_similarity(run):
+    return bibrank_engine(run)
+
+def reading_similarity_exec(rank_method_code, name, config):
+    """Update the reading similarity lists of the records read since
+    the last run, or of all the records if asked to recalculate"""
+    begin_date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+    time1 = time.time()
+    if task_get_option("quick") == "no":
+        last_updated = "0000-00-00 00:00:00"
+    else:
+        last_updated = get_lastupdated(rank_method_code) or "0000-00-00 00:00:00"
+    nb_similar = int(config.get("reading_similarity", "nb_similar_records"))
+    if config.has_option("reading_similarity", "max_reads_per_host"):
+        max_reads_per_host = int(config.get("reading_similarity", "max_reads_per_host"))
+    else:
+        max_reads_per_host = 1000
+    for type in config.get("reading_similarity", "types").split(","):
+        type = type.strip()
+        if task_get_option("quick") == "no":
+            run_sql("DELETE FROM rnkREADINGSIMILARITY WHERE type=%s", (type, ))
+        write_message("Updating %s reading similarity since %s" % (type, last_updated))
+        nb_records = update_reading_similarity(type, last_updated, begin_date, nb_similar,
+                                               max_reads_per_host=max_reads_per_host)
+        write_message("Updated %s reading similarity of %s records" % (type, nb_records))
+        task_sleep_now_if_required(can_stop_too=True)
+    run_sql("UPDATE rnkMETHOD SET last_updated=%s WHERE name=%s", (begin_date, rank_method_code))
+    time2 = time.time()
+    return {"time":time2-time1}
+
 def single_tag_rank_method_exec(rank_method_code, name, config):
     """Creating the rank method data"""
     begin_date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
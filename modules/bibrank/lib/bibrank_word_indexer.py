@@ -28,14 +28,16 @@ from invenio.config import \
      CFG_SITE_LANG, \
      CFG_ETCDIR
 from invenio.search_engine import perform_request_search, wash_index_term
-from invenio.dbquery import run_sql, DatabaseError, serialize_via_marshal, deserialize_via_marshal
+from invenio.dbquery import run_sql, run_sql_iter, DatabaseError, serialize_via_marshal, deserialize_via_marshal
 from invenio.bibindex_engine_stemmer import is_stemmer_available_for_language, stem
 from invenio.bibindex_engine_stopwords import is_stopword
 from invenio.bibindex_engine import beautify_range_list, \
     kill_sleepy_mysql_threads, create_range_list
 from invenio.bibtask import write_message, task_get_option, task_update_progress, \
-    task_update_status, task_sleep_now_if_required
+    task_update_status, task_sleep_now_if_required, task_count_records
 from invenio.intbitset import intbitset
+from invenio.bibrank_word_searcher import find_similar
+from invenio import bibrank_record_sorter
 from invenio.errorlib import register_exception
 from invenio.textutils import strip_accents
 
@@ -379,6 +381,7 @@ class WordTable:
                 flush_count = flush_count + i_high - i_low + 1
                 chunksize_count = chunksize_count + i_high - i_low + 1
                 records_done = records_done + just_processed
+                task_count_records(just_processed)
                 write_message("%s adding records #%d-#%d ended  " % \
                         (self.tablename, i_low, i_high))
                 if chunksize_count >= chunksize:
@@ -467,6 +470,8 @@ class WordTable:
                 write_message("... record %d was declared deleted, removing its word list" % recID, verbose=9)
             write_message("... record %d, termlist: %s" % (recID, wlist[recID]), verbose=9)
 
+        options["modified_records"].update(recIDs)
+
         # put words into reverse index table with FUTURE status:
         for recID in recIDs:
             run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % self.tablename[:-1],
@@ -541,6 +546,7 @@ class WordTable:
         recID_rows = run_sql(query)
         for recID_row in recID_rows:
             recID = recID_row[0]
+            options["modified_records"].add(recID)
             wlist = deserialize_via_marshal(recID_row[1])
             for word in wlist:
                 self.put(recID, word, (-1, 0))
@@ -760,6 +766,7 @@ def word_index(run):
             raise StandardError
         options["current_run"] = rank_method_code
         options["modified_words"] = {}
+        options["modified_records"] = intbitset()
         options["table"] = config.get(config.get("rank_method", "function"), "table")
         options["use_stemming"] = config.get(config.get("rank_method","function"),"stemming")
         options["remove_stopword"] = config.get(config.get("rank_method","function"),"stopword")
@@ -825,6 +832,14 @@ def word_index(run):
                 raise StandardError
             update_rnkWORD(options["table"], options["modified_words"])
             task_sleep_now_if_required(can_stop_too=True)
+            if config.has_option("find_similar", "nb_similar_records") and \
+                   int(config.get("find_similar", "nb_similar_records")) > 0:
+                if task_get_option("quick") == "no":
+                    recIDs = intbitset(run_sql("SELECT id_bibrec FROM %sR" % options["table"][:-1]))
+                else:
+                    recIDs = get_similar_records_to_update(options["table"], options["modified_records"])
+                update_similar_records(rank_method_code, options["table"],
+                                       int(config.get("find_similar", "nb_similar_records")), recIDs)
         except StandardError, e:
             register_exception(alert_admin=True)
             write_message("Exception caught: %s" % e, sys.stderr)
@@ -1144,6 +1159,65 @@ def update_rnkWORD(table, terms):
     write_message("Finished post-processing")
 
 
+def get_similar_records_to_update(table, recIDs):
+    """Returns the records whose precomputed similar records (see
+    update_similar_records()) are affected by the modification of the
+    records recIDs: recIDs themselves and the records having one of
+    them among their similar records.  Records that would newly become
+    similar to an unmodified record are only taken into account by the
+    next full run (bibrank --quick=no).
+    table - name of the forward index (e.g. rnkWORD01F)
+    recIDs - the modified records"""
+
+    recIDs = intbitset(recIDs)
+    to_update = intbitset(recIDs)
+    if not recIDs:
+        return to_update
+    for (recID, similarlist) in run_sql_iter("SELECT id_bibrec,similarlist FROM %sS" % table[:-1]):
+        if recID in to_update:
+            continue
+        for (similar_recID, dummy_relevance) in deserialize_via_marshal(similarlist):
+            if similar_recID in recIDs:
+                to_update.add(recID)
+                break
+    return to_update
+
+def update_similar_records(rank_method_code, table, nb_similar, recIDs):
+    """Precomputes the NB_SIMILAR most similar records of each record of
+    RECIDS and stores them in the similar records table of the method
+    (e.g. rnkWORD01S), from where find_similar() reads them instead of
+    ranking the whole collection at query time.  Each record costs one
+    find_similar() run, so incremental runs should only pass the records
+    returned by get_similar_records_to_update().
+    rank_method_code - the code of the method, from the name field in rnkMETHOD
+    table - name of the forward index (e.g. rnkWORD01F)
+    nb_similar - number of similar records to keep for each record
+    recIDs - records to update (e.g. the records modified in this run)"""
+
+    if not recIDs:
+        write_message("No similar records to update")
+        return
+    write_message("Updating similar records of %s records" % len(recIDs))
+    # rebuild the rank method cache, since the collection size changed
+    bibrank_record_sorter.create_rnkmethod_cache()
+    methods = bibrank_record_sorter.methods
+    collection = intbitset(run_sql("SELECT id_bibrec FROM %sR WHERE type='CURRENT'" % table[:-1]))
+    done = 0
+    for recID in recIDs:
+        ## find_similar() does not modify the collection, so that the
+        ## same bitmap serves for all the records
+        reclist = find_similar(rank_method_code, recID, collection, 0, 0, methods, precomputed=False)[0]
+        if reclist:
+            run_sql("REPLACE INTO %sS (id_bibrec,similarlist) VALUES (%%s,%%s)" % table[:-1],
+                    (recID, serialize_via_marshal(reclist[-nb_similar:])))
+        else:
+            run_sql("DELETE FROM %sS WHERE id_bibrec=%%s" % table[:-1], (recID,))
+        done += 1
+        if done % 100 == 0:
+            task_update_progress("%s similar records updated %d/%d" % (table[:-1], done, len(recIDs)))
+            task_sleep_now_if_required(can_stop_too=True)
+    write_message("Similar records of %s records updated" % done)
+
 def get_from_forward_index(terms, start, stop, table):
     terms_docs = ()
     for j in range(start, (stop < len(terms) and stop or len(terms))):
@@ -0,0 +1,61 @@
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the word similarity indexer."""
+
+__revision__ = "$Id$"
+
+import unittest
+
+from invenio import bibrank_word_indexer
+from invenio.bibrank_word_searcher import sort_record_relevance_findsimilar
+from invenio.dbquery import serialize_via_marshal
+from invenio.intbitset import intbitset
+from invenio.testutils import make_test_suite, run_test_suite
+
+class TestSimilarRecordsUpdate(unittest.TestCase):
+    """Test the incremental update of the precomputed similar records."""
+
+    def setUp(self):
+        self.old_run_sql_iter = bibrank_word_indexer.run_sql_iter
+        similar = {1: [(2, 50), (3, 80)], 2: [(1, 70)], 4: [(5, 90)], 5: [(4, 90)]}
+        bibrank_word_indexer.run_sql_iter = lambda sql: \
+            [(recid, serialize_via_marshal(reclist)) for (recid, reclist) in similar.items()]
+
+    def tearDown(self):
+        bibrank_word_indexer.run_sql_iter = self.old_run_sql_iter
+
+    def test_similar_records_to_update(self):
+        """bibrank word indexer - similar records affected by modified records"""
+        self.assertEqual([1, 3],
+                         list(bibrank_word_indexer.get_similar_records_to_update("rnkWORD01F", [3])))
+        self.assertEqual([1, 2],
+                         list(bibrank_word_indexer.get_similar_records_to_update("rnkWORD01F", [1])))
+        self.assertEqual([],
+                         list(bibrank_word_indexer.get_similar_records_to_update("rnkWORD01F", [])))
+
+    def test_collection_is_reused(self):
+        """bibrank word indexer - finding similar records leaves the collection untouched"""
+        collection = intbitset([1, 2, 3, 4])
+        reclist = sort_record_relevance_findsimilar({2: 3, 3: 5}, {2: 2, 3: 2}, collection, 0, 0)[0]
+        self.assertEqual([2, 3], [recid for (recid, relevance) in reclist])
+        self.assertEqual([1, 2, 3, 4], list(collection))
+
+TEST_SUITE = make_test_suite(TestSimilarRecordsUpdate,)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
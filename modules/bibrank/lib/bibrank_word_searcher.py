@@ -20,13 +20,15 @@ import string
 import time
 import math
 import re
+from operator import itemgetter
 
 from invenio.dbquery import run_sql, deserialize_via_marshal
 from invenio.bibindex_engine_stemmer import stem
 from invenio.bibindex_engine_stopwords import is_stopword
+from invenio.search_engine_utils import get_sorted_tail
 
 
-def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose, methods):
+def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose, methods, precomputed=True):
     """Finding terms to use for calculating similarity. Terms are taken from the recid given, returns a list of recids's and relevance,
     input:
     rank_method_code - the code of the method, from the name field in rnkMETHOD
@@ -34,6 +36,7 @@ def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose,
     hitset - a list of hits for the query found by search_engine
     rank_limit_relevance - show only records with a rank value above this
     verbose - verbose value
+    precomputed - if true, use the similar records precomputed by bibrank (see get_precomputed_similar)
     output:
     reclist - a list of sorted records: [[23,34], [344,24], [1,01]]
     prefix - what to show before the rank value
@@ -53,6 +56,15 @@ def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose,
     except Exception,e :
         return (None, "Warning: Error in record ID, please check that a number is given.", "", voutput)
 
+    if precomputed and methods[rank_method_code].get("nb_similar_records"):
+        reclist = get_precomputed_similar(methods[rank_method_code]["rnkWORD_table"], recID, hitset)
+        if reclist is not None:
+            if verbose > 0:
+                voutput += "Using precomputed similar records, time used: %s<br />" % (str(time.time() - startCreate))
+            if not reclist:
+                return (None, "Could not find similar documents for this query.", "", voutput)
+            return (reclist, methods[rank_method_code]["prefix"], methods[rank_method_code]["postfix"], voutput)
+
     rec_terms = run_sql("""SELECT termlist FROM %sR WHERE id_bibrec=%%s""" % methods[rank_method_code]["rnkWORD_table"][:-1],  (recID,))
     if not rec_terms:
         return (None, "Warning: Requested record does not seem to exist.", "", voutput)
@@ -101,6 +113,21 @@ def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose,
 
     return (reclist[:len(reclist)], methods[rank_method_code]["prefix"], methods[rank_method_code]["postfix"], voutput)
 
+def get_precomputed_similar(table, recID, hitset):
+    """Returns the similar records of recID precomputed by bibrank and
+    stored in the similar records table of the rank method (e.g. rnkWORD01S),
+    as a list of (recid, relevance) sorted by ascending relevance, keeping
+    only the records of hitset.  Returns None if nothing was precomputed
+    for this record.
+    table - name of the forward index of the method (e.g. rnkWORD01F)
+    recID - record to find similar records for
+    hitset - the records that are allowed in the output"""
+
+    res = run_sql("""SELECT similarlist FROM %sS WHERE id_bibrec=%%s""" % table[:-1], (recID,))
+    if not res:
+        return None
+    return [(j, w) for (j, w) in deserialize_via_marshal(res[0][0]) if j in hitset]
+
 def calculate_record_relevance_findsimilar(term, invidx, hitset, recdict, rec_termcount, verbose, quick=None):
     """Calculating the relevance of the documents based on the input, calculates only one word
     term - (term, query term factor) the term and its importance in the overall search
@@ -137,6 +164,8 @@ def calculate_record_relevance_findsimilar(term, invidx, hitset, recdict, rec_te
 
 def sort_record_relevance_findsimilar(recdict, rec_termcount, hitset, rank_limit_relevance, verbose):
     """Sorts the dictionary and returns records with a relevance higher than the given value.
+    Unlike sort_record_relevance(), leaves hitset untouched, so that
+    bibrank can reuse it for all the records (see update_similar_records()).
     recdict - {recid: value} unsorted
     rank_limit_relevance - a value > 0 usually
     verbose - verbose value"""
@@ -152,7 +181,6 @@ def sort_record_relevance_findsimilar(recdict, rec_termcount, hitset, rank_limit
         else:
             recdict[j] = 0
 
-    hitset -= recdict.keys()
     #gives each record a score between 0-100
     divideby = max(recdict.values())
     for (j, w) in recdict.iteritems():
@@ -161,14 +189,14 @@ def sort_record_relevance_findsimilar(recdict, rec_termcount, hitset, rank_limit
             reclist.append((j, w))
 
     #sort scores
-    reclist.sort(lambda x, y: cmp(x[1], y[1]))
+    reclist.sort(key=itemgetter(1))
 
     if verbose > 0:
         voutput += "Number of records sorted: %s<br />" % len(reclist)
         voutput += "Sort time: %s<br />" % (str(time.time() - startCreate))
     return (reclist, hitset)
 
-def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verbose, methods):
+def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verbose, methods, nb_records=None):
     """Ranking a records containing specified words and returns a sorted list.
     input:
     rank_method_code - the code of the method, from the name field in rnkMETHOD
@@ -176,6 +204,7 @@ def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verb
     hitset - a list of hits for the query found by search_engine
     rank_limit_relevance - show only records with a rank value above this
     verbose - verbose value
+    nb_records - if set, only the nb_records best records are sorted (see sort_reclist)
     output:
     reclist - a list of sorted records: [[23,34], [344,24], [1,01]]
     prefix - what to show before the rank value
@@ -215,7 +244,7 @@ def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verb
     if len(recdict) == 0 or (len(lwords) == 1 and lwords[0] == ""):
         return (None, "Records not ranked. The query is not detailed enough, or not enough records found, for ranking to be possible.", "", voutput)
     else: #sort if we got something to sort
-        (reclist, hitset) = sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance, verbose)
+        (reclist, hitset) = sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance, verbose, nb_records)
 
     #Add any documents not ranked to the end of the list
     if hitset:
@@ -252,14 +281,21 @@ def calculate_record_relevance(term, invidx, hitset, recdict, rec_termcount, ver
         return (recdict, rec_termcount)
 
     if not quick or (qtf >= 0 or (qtf < 0 and len(recdict) == 0)):
-        #Only accept records existing in the hitset received from the search engine
-        for (j, tf) in invidx.iteritems():
-            if j in hitset:#only include docs found by search_engine based on query
-                try: #calculates rank value
-                    recdict[j] = recdict.get(j, 0) + int(math.log(tf[0] * Gi * tf[1] * qtf))
-                except:
-                    return (recdict, rec_termcount)
-                rec_termcount[j] = rec_termcount.get(j, 0) + 1 #number of terms from query in document
+        #Only accept records existing in the hitset received from the search engine,
+        #walking the smaller of the hitset and the term hitlist
+        if len(hitset) < len(invidx):
+            hits = [(j, invidx[j]) for j in hitset if j in invidx]
+        else:
+            hits = [(j, tf) for (j, tf) in invidx.iteritems() if j in hitset]
+        log = math.log
+        recdict_get = recdict.get
+        rec_termcount_get = rec_termcount.get
+        for (j, tf) in hits:
+            try: #calculates rank value
+                recdict[j] = recdict_get(j, 0) + int(log(tf[0] * Gi * tf[1] * qtf))
+            except:
+                return (recdict, rec_termcount)
+            rec_termcount[j] = rec_termcount_get(j, 0) + 1 #number of terms from query in document
     elif quick: #much used term, do not include all records, only use already existing ones
         for (j, tf) in recdict.iteritems(): #i.e: if doc contains important term, also count unimportant
             if invidx.has_key(j):
@@ -269,11 +305,12 @@ def calculate_record_relevance(term, invidx, hitset, recdict, rec_termcount, ver
 
     return (recdict, rec_termcount)
 
-def sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance, verbose):
+def sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance, verbose, nb_records=None):
     """Sorts the dictionary and returns records with a relevance higher than the given value.
     recdict - {recid: value} unsorted
     rank_limit_relevance - a value > 0 usually
-    verbose - verbose value"""
+    verbose - verbose value
+    nb_records - if set, only the nb_records best records are sorted (see sort_reclist)"""
 
     startCreate = time.time()
     voutput = ""
@@ -283,20 +320,35 @@ def sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance,
     hitset -= recdict.keys()
 
     #gives each record a score between 0-100
-    divideby = max(recdict.values())
+    divideby = max(recdict.itervalues())
     for (j, w) in recdict.iteritems():
         w = int(w * 100 / divideby)
         if w >= rank_limit_relevance:
             reclist.append((j, w))
 
     #sort scores
-    reclist.sort(lambda x, y: cmp(x[1], y[1]))
+    reclist = sort_reclist(reclist, nb_records)
 
     if verbose > 0:
         voutput += "Number of records sorted: %s<br />" % len(reclist)
         voutput += "Sort time: %s<br />" % (str(time.time() - startCreate))
     return (reclist, hitset)
 
+def sort_reclist(reclist, nb_records=None):
+    """Sorts a list of ranked records by ascending rank value, so that the best records
+    come at the end of the list, where the search engine starts displaying them.
+    reclist - [(recid, value)] unsorted
+    nb_records - if set, only the nb_records best records are sorted and put at the end
+    of the list, the other records are kept before them in their original order, which
+    is enough to display the first nb_records records without sorting the whole list"""
+
+    if nb_records is None or nb_records <= 0 or nb_records >= len(reclist):
+        reclist.sort(key=itemgetter(1))
+        return reclist
+    best = get_sorted_tail(reclist, key=itemgetter(1), nb_items=nb_records)
+    best_recids = set([recid for (recid, value) in best])
+    return [(recid, value) for (recid, value) in reclist if recid not in best_recids] + best
+
 def rank_method_stat(rank_method_code, reclist, lwords):
     """Shows some statistics about the searchresult.
     rank_method_code - name field from rnkMETHOD
@@ -26,6 +26,7 @@ Note: Does not access the database, the input is MARCXML only."""
 
 ### IMPORT INTERESTING MODULES AND XML PARSERS
 
+import gc
 import re
 import sys
 from cStringIO import StringIO
@@ -66,6 +67,9 @@ try:
     from lxml import etree
     if 'lxml' in CFG_BIBRECORD_PARSERS_AVAILABLE:
         AVAILABLE_PARSERS.append('lxml')
+    if 'lxml_iterparse' in CFG_BIBRECORD_PARSERS_AVAILABLE and \
+           etree.LXML_VERSION >= (3, 0):
+        AVAILABLE_PARSERS.append('lxml_iterparse')
 except ImportError:
     pass
 
@@ -108,7 +112,29 @@ def create_records(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
     keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS):
     """Creates a list of records from the marcxml description. Returns a
     list of objects initiated by the function create_record(). Please
-    see that function's docstring."""
+    see that function's docstring.
+
+    With parser='lxml_iterparse' the whole document is parsed in a
+    single streaming pass instead of being split with a regular
+    expression and parsed record by record.  Should the document not be
+    well-formed, we fall back to the record by record parsing so that
+    the result stays the same as with the 'lxml' parser."""
+    if _select_parser(parser) == 'lxml_iterparse':
+        # The garbage collector would otherwise keep on scanning the
+        # millions of tuples we are allocating.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            try:
+                return list(_create_records_iterparse(marcxml,
+                    verbose=verbose, correct=correct,
+                    keep_singletons=keep_singletons))
+            except (InvenioBibRecordParserError, etree.LxmlError):
+                pass
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
     # Use the DOTALL flag to include newlines.
     regex = re.compile('<record.*?>.*?</record>', re.DOTALL)
     record_xmls = regex.findall(marcxml)
@@ -167,7 +193,7 @@ def create_record(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
         if parser == 'pyrxp':
             rec = _create_record_rxp(marcxml, verbose, correct,
                 keep_singletons=keep_singletons)
-        elif parser == 'lxml':
+        elif parser in ('lxml', 'lxml_iterparse'):
             rec = _create_record_lxml(marcxml, verbose, correct,
                 keep_singletons=keep_singletons)
         elif parser == '4suite':
@@ -889,6 +915,18 @@ def record_xml_output(rec, tags=None):
     """Generates the XML for record 'rec' and returns it as a string
     @rec: record
     @tags: list of tags to be printed"""
+    out = []
+    record_xml_write(out.append, rec, tags)
+    return ''.join(out)
+
+def record_xml_write(write, rec, tags=None):
+    """Writes the XML for record 'rec' piece by piece by means of the
+    'write' callable (e.g. req.write, file.write or list.append), so
+    that no intermediate string is built for the whole record.  The
+    output is the same as the one of record_xml_output().
+    @param write: callable taking a string
+    @param rec: record
+    @param tags: list of tags to be printed"""
     if tags is None:
         tags = []
     if isinstance(tags, str):
@@ -897,20 +935,47 @@ def record_xml_output(rec, tags=None):
         # Add the missing controlfield.
         tags.append('001')
 
-    marcxml = ['<record>']
-
-    # Add the tag 'tag' to each field in rec[tag]
-    fields = []
+    write('<record>')
     if rec is not None:
+        # Add the tag 'tag' to each field in rec[tag]
+        fields = []
         for tag in rec:
             if not tags or tag in tags:
                 for field in rec[tag]:
-                    fields.append((tag, field))
-        record_order_fields(fields)
-        for field in fields:
-            marcxml.append(field_xml_output(field[1], field[0]))
-    marcxml.append('</record>')
-    return '\n'.join(marcxml)
+                    fields.append((field[4], tag, field))
+        # The sort is stable: fields sharing a position keep their order.
+        fields.sort(key=_get_position_key)
+        for dummy_position, tag, field in fields:
+            _field_xml_write(write, field, tag)
+    write('\n</record>')
+
+def records_xml_output(recs, tags=None, write=None,
+                       xmlns="http://www.loc.gov/MARC21/slim"):
+    """Generates the XML <collection> of the records 'recs'.
+
+    If 'write' is given, the XML is streamed piece by piece through it
+    (e.g. req.write or file.write) and nothing is returned; otherwise
+    the pieces are joined only once and the XML is returned as a
+    string.
+    @param recs: iterable of records
+    @param tags: list of tags to be printed
+    @param write: callable taking a string
+    @param xmlns: the namespace of the collection, if any
+    @return: the XML string, unless 'write' is given"""
+    out = None
+    if write is None:
+        out = []
+        write = out.append
+    if xmlns:
+        write('<collection xmlns="%s">' % xmlns)
+    else:
+        write('<collection>')
+    for rec in recs:
+        write('\n')
+        record_xml_write(write, rec, tags)
+    write('\n</collection>')
+    if out is not None:
+        return ''.join(out)
 
 def field_get_subfield_instances(field):
     """Returns the list of subfields associated with field 'field'"""
@@ -937,16 +1002,9 @@ def record_order_fields(rec, fun="_order_by_ord"):
 
 def field_xml_output(field, tag):
     """Generates the XML for field 'field' and returns it as a string."""
-    marcxml = []
-    if field[3]:
-        marcxml.append('  <controlfield tag="%s">%s</controlfield>' %
-            (tag, encode_for_xml(field[3])))
-    else:
-        marcxml.append('  <datafield tag="%s" ind1="%s" ind2="%s">' %
-            (tag, field[1], field[2]))
-        marcxml += [_subfield_xml_output(subfield) for subfield in field[0]]
-        marcxml.append('  </datafield>')
-    return '\n'.join(marcxml)
+    out = []
+    _field_xml_write(out.append, field, tag)
+    return ''.join(out)[1:]
 
 def record_extract_oai_id(record):
     """Returns the OAI ID of the record."""
@@ -986,14 +1044,17 @@ def print_recs(listofrec, format=1, tags=None):
     """
     if tags is None:
         tags = []
-    text = ""
 
     if type(listofrec).__name__ !='list':
         return ""
+    elif format != 1:
+        return "\n" * len(listofrec)
     else:
+        out = []
         for rec in listofrec:
-            text = "%s\n%s" % (text, print_rec(rec, format, tags))
-    return text
+            out.append('\n')
+            record_xml_write(out.append, rec, tags)
+        return ''.join(out)
 
 def concat(alist):
     """Concats a list of lists"""
@@ -1340,6 +1401,124 @@ def _create_record_lxml(marcxml,
 
     return record
 
+_MARC21_DTD_CACHE = {}
+
+def _get_marc21_dtd():
+    """Returns the MARC21 DTD as an lxml DTD object, loading it only
+    once per process."""
+    if 'dtd' not in _MARC21_DTD_CACHE:
+        _MARC21_DTD_CACHE['dtd'] = etree.DTD(CFG_MARC21_DTD)
+    return _MARC21_DTD_CACHE['dtd']
+
+def _create_records_iterparse(marcxml,
+                              verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
+                              correct=CFG_BIBRECORD_DEFAULT_CORRECT,
+                              keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS):
+    """Yields a tuple (record, status_code, list_of_errors) for every
+    record of the MARCXML document, as create_record() would, using a
+    single pass of the LXML iterparse interface.
+
+    Every <record> element is converted as soon as it has been parsed
+    and is then discarded, so that the memory used does not grow with
+    the size of the document.  The record structure (including the
+    global field positions, controlfields first) is identical to the
+    one built by _create_record_lxml().
+
+    If correct == 1, then every record is validated against the MARC21
+    DTD; with verbose > 3 invalid records are returned as
+    (None, 0, error) like the other parsers do.
+
+    The document has to be well-formed: an InvenioBibRecordParserError
+    is raised otherwise."""
+    if isinstance(marcxml, unicode):
+        marcxml = marcxml.encode('utf-8')
+    dtd = None
+    if correct:
+        dtd = _get_marc21_dtd()
+
+    # Let libxml2 skip everything but the records, whatever their
+    # namespace.
+    iterator = etree.iterparse(StringIO(marcxml), events=('end',),
+                               tag='{*}record')
+    try:
+        for dummy_event, element in iterator:
+            if dtd is not None and not dtd.validate(element) \
+                   and verbose > 3:
+                yield (None, 0, str(dtd.error_log))
+            else:
+                rec = _create_record_from_lxml_element(element,
+                    keep_singletons=keep_singletons)
+                errs = []
+                if correct:
+                    errs = _correct_record(rec)
+                yield (rec, int(not errs), errs)
+
+            # Free the memory used by the records already converted.
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    except etree.XMLSyntaxError, ex1:
+        raise InvenioBibRecordParserError(str(ex1))
+
+def _lxml_value_to_str(value):
+    """Returns the attribute value or text given by lxml as an UTF-8
+    encoded string (lxml gives back unicode for non-ASCII values)."""
+    if value.__class__ is unicode:
+        return value.encode("UTF-8")
+    return value
+
+def _create_record_from_lxml_element(record_element,
+                    keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS):
+    """Creates a record object from the <record> lxml element, walking
+    its fields only once."""
+    namespace = ''
+    if record_element.tag[0] == '{':
+        namespace = record_element.tag[:record_element.tag.index('}') + 1]
+    controlfield_tag = namespace + 'controlfield'
+    subfield_tag = namespace + 'subfield'
+
+    controlfields = []
+    datafields = []
+    for element in record_element.iter(controlfield_tag,
+                                       namespace + 'datafield'):
+        get = element.get
+        if element.tag == controlfield_tag:
+            text = element.text
+            if text is None:
+                text = ''
+            elif text.__class__ is unicode:
+                text = text.encode("UTF-8")
+            if text or keep_singletons:
+                controlfields.append((_lxml_value_to_str(get('tag', '!')),
+                                      [], ' ', ' ', text))
+        else:
+            subfields = []
+            for subfield in element.iter(subfield_tag):
+                text = subfield.text
+                if text is None:
+                    text = ''
+                elif text.__class__ is unicode:
+                    text = text.encode("UTF-8")
+                if text or keep_singletons:
+                    subfields.append(
+                        (_lxml_value_to_str(subfield.get('code', '!')), text))
+            if subfields or keep_singletons:
+                ind1 = _lxml_value_to_str(get('ind1', '!'))
+                ind2 = _lxml_value_to_str(get('ind2', '!'))
+                if ind1 in ('', '_'): ind1 = ' '
+                if ind2 in ('', '_'): ind2 = ' '
+                datafields.append((_lxml_value_to_str(get('tag', '!')),
+                                   subfields, ind1, ind2, ''))
+
+    # As in _create_record_lxml(), the controlfields come first.
+    record = {}
+    field_position_global = 0
+    for tag, subfields, ind1, ind2, text in controlfields + datafields:
+        field_position_global += 1
+        record.setdefault(tag, []).append((subfields, ind1, ind2, text,
+                                           field_position_global))
+    return record
+
 def _create_record_rxp(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
     correct=CFG_BIBRECORD_DEFAULT_CORRECT,
     keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS):
@@ -1509,6 +1688,29 @@ def _subfield_xml_output(subfield):
     return '    <subfield code="%s">%s</subfield>' % (subfield[0],
         encode_for_xml(subfield[1]))
 
+def _field_xml_write(write, field, tag):
+    """Writes the XML for field 'field', preceded by a newline, by means
+    of the 'write' callable."""
+    if field[3]:
+        value = field[3]
+        if '&' in value or '<' in value:
+            value = encode_for_xml(value)
+        write('\n  <controlfield tag="%s">%s</controlfield>' % (tag, value))
+    else:
+        write('\n  <datafield tag="%s" ind1="%s" ind2="%s">' %
+              (tag, field[1], field[2]))
+        for code, value in field[0]:
+            # Most values need no escaping at all: spare the copies.
+            if '&' in value or '<' in value:
+                value = encode_for_xml(value)
+            write('\n    <subfield code="%s">%s</subfield>' % (code, value))
+        write('\n  </datafield>')
+
+def _get_position_key(field_item):
+    """Returns the global field position of a (position, tag, field)
+    item, used as the sort key of record_xml_write()."""
+    return field_item[0]
+
 def _order_by_ord(field1, field2):
     """Function used to order the fields according to their ord value"""
     return cmp(field1[1][4], field2[1][4])
@@ -1665,3 +1867,64 @@ def _compare_lists(list1, list2, custom_cmp):
         if not custom_cmp(element1, element2):
             return False
     return True
+
+def bibrecord_profile(marcxml_filename=None, nb_records=100000,
+                      parsers=None):
+    """
+    Runs a benchmark of create_records() with the various parsers.
+
+    @param marcxml_filename: the MARCXML dump to parse; if None, a
+        collection of nb_records copies of a sample record is used
+    @param nb_records: the number of records of the sample collection
+    @param parsers: the list of parsers to benchmark (defaults to all
+        the available ones)
+    @return: a list of tuples (parser, number of records, seconds)
+    """
+    import time
+    if marcxml_filename:
+        marcxml = open(marcxml_filename).read()
+    else:
+        sample_record = """<record>
+  <controlfield tag="001">%d</controlfield>
+  <controlfield tag="005">20120101000000.0</controlfield>
+  <datafield tag="037" ind1=" " ind2=" ">
+    <subfield code="a">CERN-TH-2012-%d</subfield>
+  </datafield>
+  <datafield tag="100" ind1=" " ind2=" ">
+    <subfield code="a">Doe, J</subfield>
+    <subfield code="u">CERN</subfield>
+  </datafield>
+  <datafield tag="245" ind1=" " ind2=" ">
+    <subfield code="a">On the parsing of &lt;MARCXML&gt; &amp; friends</subfield>
+  </datafield>
+  <datafield tag="700" ind1=" " ind2=" ">
+    <subfield code="a">Smith, J</subfield>
+  </datafield>
+  <datafield tag="980" ind1=" " ind2=" ">
+    <subfield code="a">PREPRINT</subfield>
+  </datafield>
+</record>"""
+        marcxml = '<collection>\n%s\n</collection>' % \
+            '\n'.join([sample_record % (recid, recid)
+                       for recid in xrange(1, nb_records + 1)])
+    if parsers is None:
+        parsers = AVAILABLE_PARSERS
+
+    results = []
+    for parser in parsers:
+        if parser not in AVAILABLE_PARSERS:
+            continue
+        start = time.time()
+        records = create_records(marcxml, parser=parser)
+        elapsed = time.time() - start
+        results.append((parser, len(records), elapsed))
+        print "%-15s %8d records %8.2f s %10.1f records/s" % \
+              (parser, len(records), elapsed,
+               elapsed and len(records) / elapsed or 0)
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        bibrecord_profile(sys.argv[1])
+    else:
+        bibrecord_profile()
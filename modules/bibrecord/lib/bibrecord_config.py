@@ -49,7 +49,10 @@ CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL = 0
 CFG_BIBRECORD_DEFAULT_CORRECT = 0
 
 # XML parsers available:
-CFG_BIBRECORD_PARSERS_AVAILABLE = ['pyrxp', 'lxml', '4suite', 'minidom']
+# ('lxml_iterparse' is the single-pass streaming flavour of 'lxml' used
+# by create_records(); it has to be asked for explicitly.)
+CFG_BIBRECORD_PARSERS_AVAILABLE = ['pyrxp', 'lxml', 'lxml_iterparse',
+                                   '4suite', 'minidom']
 
 # Exceptions
 class InvenioBibRecordParserError(Exception):
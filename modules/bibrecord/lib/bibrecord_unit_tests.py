@@ -66,6 +66,16 @@ class BibRecordSuccessTest(unittest.TestCase):
         """ bibrecord - demo file how many records are created """
         self.assertEqual(113, len(self.recs))
 
+    if parser_lxml_available:
+        def test_records_created_iterparse(self):
+            """ bibrecord - demo file parsed with lxml and lxml_iterparse """
+            f = open(CFG_TMPDIR + '/demobibdata.xml', 'r')
+            xmltext = f.read()
+            f.close()
+            self.assertEqual(
+                bibrecord.create_records(xmltext, parser='lxml'),
+                bibrecord.create_records(xmltext, parser='lxml_iterparse'))
+
     def test_tags_created(self):
         """ bibrecord - demo file which tags are created """
         ## check if the tags are correct
@@ -161,6 +171,12 @@ class BibRecordParsersTest(unittest.TestCase):
             record = bibrecord._create_record_lxml(self.xmltext)
             self.assertEqual(record, self.expected_record)
 
+        def test_lxml_iterparse(self):
+            """ bibrecord - create_records() with lxml_iterparse"""
+            records = bibrecord.create_records(self.xmltext,
+                                               parser='lxml_iterparse')
+            self.assertEqual(records, [(self.expected_record, 1, [])])
+
     if parser_4suite_available:
         def test_4suite(self):
             """ bibrecord - create_record() with 4suite """
@@ -1323,6 +1339,43 @@ class BibRecordPrintingTest(unittest.TestCase):
         self.assertEqual(bibrecord.create_record(bibrecord.record_xml_output(rec, tags=["001", "037"]), 1, 1)[0], rec_short)
         self.assertEqual(bibrecord.create_record(bibrecord.record_xml_output(rec, tags=["037"]), 1, 1)[0], rec_short)
 
+    def test_record_xml_write(self):
+        """bibrecord - streamed xml output"""
+        rec = bibrecord.create_record(self.xml_example_record, 1, 1)[0]
+        rec['245'][0][0].append(('b', 'Tom & Jerry <3'))
+        out = []
+        bibrecord.record_xml_write(out.append, rec)
+        self.assertEqual(''.join(out), bibrecord.record_xml_output(rec))
+        self.assertEqual(bibrecord.record_xml_output(rec), """<record>
+  <controlfield tag="001">81</controlfield>
+  <datafield tag="037" ind1=" " ind2=" ">
+    <subfield code="a">TEST-ARTICLE-2006-001</subfield>
+  </datafield>
+  <datafield tag="037" ind1=" " ind2=" ">
+    <subfield code="a">ARTICLE-2006-001</subfield>
+  </datafield>
+  <datafield tag="245" ind1=" " ind2=" ">
+    <subfield code="a">Test ti</subfield>
+    <subfield code="b">Tom &amp; Jerry &lt;3</subfield>
+  </datafield>
+</record>""")
+
+    def test_records_xml_output(self):
+        """bibrecord - xml output of a collection"""
+        recs = [rec[0] for rec in
+                bibrecord.create_records(self.xml_example_multi_records, 1, 1)]
+        recs_short = [rec[0] for rec in
+                bibrecord.create_records(self.xml_example_multi_records_short, 1, 1)]
+        xml = bibrecord.records_xml_output(recs, tags=["001", "037"])
+        self.assertEqual(xml, '<collection xmlns="http://www.loc.gov/MARC21/slim">%s\n</collection>' %
+                         bibrecord.print_recs(recs, tags=["001", "037"]))
+        self.assertEqual([rec[0] for rec in bibrecord.create_records(xml, 1, 1)],
+                         recs_short)
+        out = []
+        bibrecord.records_xml_output(recs, write=out.append, xmlns='')
+        self.assertEqual(''.join(out), '<collection>%s\n</collection>' %
+                         bibrecord.print_recs(recs))
+
 class BibRecordCreateFieldTest(unittest.TestCase):
     """ bibrecord - testing for creating field """
 
@@ -1487,6 +1540,13 @@ class BibRecordSingletonTest(unittest.TestCase):
                                            keep_singletons=False)[0][0]
             self.assertEqual(rec, self.rec_expected)
 
+        def test_singleton_removal_lxml_iterparse(self):
+            """bibrecord - enforcing singleton removal with lxml_iterparse"""
+            rec = bibrecord.create_records(self.xml, verbose=1,
+                                           correct=1, parser='lxml_iterparse',
+                                           keep_singletons=False)[0][0]
+            self.assertEqual(rec, self.rec_expected)
+
 class BibRecordNumCharRefTest(unittest.TestCase):
     """ bibrecord - testing numerical character reference expansion"""
 
@@ -1544,6 +1604,12 @@ class BibRecordNumCharRefTest(unittest.TestCase):
                                            correct=1, parser='lxml')[0][0]
             self.assertEqual(rec, self.rec_expected)
 
+        def test_numcharref_expansion_lxml_iterparse(self):
+            """bibrecord - numcharref expansion with lxml_iterparse"""
+            rec = bibrecord.create_records(self.xml, verbose=1, correct=1,
+                                           parser='lxml_iterparse')[0][0]
+            self.assertEqual(rec, self.rec_expected)
+
 TEST_SUITE = make_test_suite(
     BibRecordSuccessTest,
     BibRecordParsersTest,
@@ -28,6 +28,10 @@ import time
 import re
 import marshal
 import getopt
+import errno
+import fcntl
+import select
+import stat
 from itertools import chain
 from socket import gethostname
 from subprocess import Popen
@@ -36,7 +40,11 @@ import signal
 from invenio.bibtask_config import \
     CFG_BIBTASK_VALID_TASKS, \
     CFG_BIBTASK_MONOTASKS, \
-    CFG_BIBTASK_FIXEDTIMETASKS
+    CFG_BIBTASK_FIXEDTIMETASKS, \
+    CFG_BIBSCHED_NOTIFICATION_FIFO, \
+    CFG_BIBSCHED_METRICS_FILE, \
+    CFG_BIBTASK_RESOURCES, \
+    CFG_BIBTASK_DEFAULT_RESOURCES
 
 from invenio.config import \
      CFG_PREFIX, \
@@ -51,6 +59,9 @@ from invenio.config import \
      CFG_BIBSCHED_MAX_NUMBER_CONCURRENT_TASKS, \
      CFG_SITE_URL, \
      CFG_BIBSCHED_NODE_TASKS, \
+     CFG_BIBSCHED_NODE_RESOURCES, \
+     CFG_BIBSCHED_DB_CAPACITY, \
+     CFG_BIBSCHED_TASK_RESOURCES, \
      CFG_BIBSCHED_MAX_ARCHIVED_ROWS_DISPLAY
 from invenio.dbquery import run_sql, real_escape_string
 from invenio.textutils import wrap_text_in_a_box
@@ -214,6 +225,14 @@ def gc_tasks(verbose=False, statuses=None, since=None, tasks=None):
             write_message('Archived %s %s tasks (created before %s) with %s' \
                                             % (res, task, date, status_query))
 
+    ## The metrics of the archived tasks are kept along with them, the
+    ## ones of the deleted tasks go away.
+    res = run_sql("""DELETE hstTASKMETRICS FROM hstTASKMETRICS
+                     LEFT JOIN schTASK ON schTASK.id=hstTASKMETRICS.id_task
+                     LEFT JOIN hstTASK ON hstTASK.id=hstTASKMETRICS.id_task
+                     WHERE schTASK.id IS NULL AND hstTASK.id IS NULL""")
+    write_message('Deleted %s task metrics of deleted tasks' % res)
+
 
 def spawn_task(command, wait=False):
     """
@@ -251,11 +270,29 @@ def bibsched_get_status(task_id):
 def bibsched_set_status(task_id, status, when_status_is=None):
     """Update the status of task_id."""
     if when_status_is is None:
-        return run_sql("UPDATE schTASK SET status=%s WHERE id=%s",
-                       (status, task_id))
+        ret = run_sql("UPDATE schTASK SET status=%s WHERE id=%s",
+                      (status, task_id))
     else:
-        return run_sql("UPDATE schTASK SET status=%s WHERE id=%s AND status=%s",
-                       (status, task_id, when_status_is))
+        ret = run_sql("UPDATE schTASK SET status=%s WHERE id=%s AND status=%s",
+                      (status, task_id, when_status_is))
+    if ret:
+        if status in ('ABOUT TO SLEEP', 'ABOUT TO STOP'):
+            bibsched_signal_status_change(task_id)
+        bibsched_notify()
+    return ret
+
+
+def bibsched_signal_status_change(task_id):
+    """Tell task_id, if it runs on this node, that its status has changed,
+    so that it reads it again at its next task_sleep_now_if_required()
+    instead of waiting for CFG_BIBSCHED_STATUS_CHECK_INTERVAL."""
+    if bibsched_get_host(task_id) == gethostname():
+        pid = get_task_pid(None, task_id, True)
+        if pid:
+            try:
+                os.kill(pid, signal.SIGUSR1)
+            except OSError:
+                pass
 
 
 def bibsched_set_progress(task_id, progress):
@@ -265,7 +302,42 @@ def bibsched_set_progress(task_id, progress):
 
 def bibsched_set_priority(task_id, priority):
     """Update the priority of task_id."""
-    return run_sql("UPDATE schTASK SET priority=%s WHERE id=%s", (priority, task_id))
+    ret = run_sql("UPDATE schTASK SET priority=%s WHERE id=%s", (priority, task_id))
+    if ret:
+        bibsched_notify()
+    return ret
+
+
+## PID of the BibSched daemon, when running inside it: the daemon must
+## not wake itself up with the status changes it makes, otherwise it
+## would skip the CFG_BIBSCHED_REFRESHTIME grace period it leaves to
+## the tasks it has just signalled.
+_BIBSCHED_DAEMON_PID = None
+
+def bibsched_notify():
+    """
+    Wake up the BibSched daemon running on this node, if any, so that
+    it takes into account a task submission or a status change without
+    waiting for its next periodic queue refresh.
+
+    @return: True if a BibSched daemon was listening.
+    """
+    if os.getpid() == _BIBSCHED_DAEMON_PID:
+        return False
+    try:
+        fd = os.open(CFG_BIBSCHED_NOTIFICATION_FIFO, os.O_WRONLY | os.O_NONBLOCK)
+    except OSError:
+        ## No BibSched daemon is listening
+        return False
+    try:
+        try:
+            os.write(fd, '.')
+        except OSError:
+            ## The pipe is full: BibSched will be woken up anyway
+            pass
+    finally:
+        os.close(fd)
+    return True
 
 
 def bibsched_send_signal(proc, task_id, sig):
@@ -282,6 +354,35 @@ def bibsched_send_signal(proc, task_id, sig):
     return False
 
 
+def get_task_resources(proc):
+    """Return the resources used by a task, as a dictionary."""
+    procname = proc.split(':')[0]
+    if procname in CFG_BIBSCHED_TASK_RESOURCES:
+        return CFG_BIBSCHED_TASK_RESOURCES[procname]
+    return CFG_BIBTASK_RESOURCES.get(procname, CFG_BIBTASK_DEFAULT_RESOURCES)
+
+
+def are_resources_available(proc, node_procs, all_procs, node_resources):
+    """
+    Return True when the resources left by the tasks running on the node
+    (node_procs) and on all the nodes (all_procs) are enough to run proc,
+    given the capacities of the node (node_resources) and of the database
+    (CFG_BIBSCHED_DB_CAPACITY).  A task is always allowed to run on its
+    own, even if it needs more than the capacities.
+    """
+    needed = get_task_resources(proc)
+    if node_procs:
+        for resource, capacity in node_resources.iteritems():
+            used = sum([get_task_resources(other_proc).get(resource, 0) for other_proc in node_procs])
+            if used + needed.get(resource, 0) > capacity:
+                return False
+    if CFG_BIBSCHED_DB_CAPACITY and all_procs:
+        used = sum([get_task_resources(other_proc).get('db', 0) for other_proc in all_procs])
+        if used + needed.get('db', 0) > CFG_BIBSCHED_DB_CAPACITY:
+            return False
+    return True
+
+
 class Manager(object):
     def __init__(self, old_stdout):
         import curses
@@ -483,6 +584,12 @@ class Manager(object):
         else:
             msg += 'executable : %s\n\n' % arguments[0]
             msg += ' arguments : %s\n\n' % ' '.join(arguments[1:])
+        metrics = get_task_metrics(self.currentrow[0])
+        if metrics:
+            msg += '  last run : %s\n' % metrics[0]['started']
+            for phase_metrics in metrics:
+                msg += '             %s\n' % format_task_metrics(phase_metrics)
+            msg += '\n'
         msg += '\n\nPress q to quit this panel...'
         msg = wrap_text_in_a_box(msg, style='no_border')
         rows = msg.split('\n')
@@ -976,6 +1083,101 @@ class BibSched(object):
         self.allowed_task_types = CFG_BIBSCHED_NODE_TASKS.get(self.hostname, CFG_BIBTASK_VALID_TASKS)
         os.environ['BIBSCHED_MODE'] = 'automatic'
 
+        ## Read end of the notification pipe (see bibsched_notify())
+        self.notification_fd = None
+        ## Since when the tasks found in the queue may have been waiting
+        ## for BibSched, i.e. since the last wake-up on a notification,
+        ## or since the beginning of the last wait that timed out
+        self.queue_changed_at = time.time()
+        self.metrics = {
+            'queue_scans': 0,
+            'queue_scan_time': 0.0,
+            'queue_scan_max_time': 0.0,
+            'notifications': 0,
+            'dispatched_tasks': 0,
+            'dispatch_latency': 0.0,
+            'dispatch_max_latency': 0.0,
+        }
+        self.metrics_dumped = 0
+
+    def open_notification_fifo(self):
+        """Create the named pipe through which BibSched is woken up by
+        task submissions and status changes (see bibsched_notify())."""
+        try:
+            if not stat.S_ISFIFO(os.stat(CFG_BIBSCHED_NOTIFICATION_FIFO).st_mode):
+                os.remove(CFG_BIBSCHED_NOTIFICATION_FIFO)
+        except OSError:
+            pass
+        try:
+            os.mkfifo(CFG_BIBSCHED_NOTIFICATION_FIFO)
+        except OSError, err:
+            if err.errno != errno.EEXIST:
+                Log("Cannot create %s (%s): falling back to polling" % (CFG_BIBSCHED_NOTIFICATION_FIFO, err))
+                return
+        ## Opened for writing too, so that the pipe never reaches EOF
+        ## when notifying processes close it.
+        self.notification_fd = os.open(CFG_BIBSCHED_NOTIFICATION_FIFO, os.O_RDWR | os.O_NONBLOCK)
+        ## Not to be inherited by the spawned tasks
+        fcntl.fcntl(self.notification_fd, fcntl.F_SETFD,
+                    fcntl.fcntl(self.notification_fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        global _BIBSCHED_DAEMON_PID
+        _BIBSCHED_DAEMON_PID = os.getpid()
+
+    def wait_for_notification(self, timeout):
+        """Sleep until some task is submitted or changes status, or at
+        most timeout seconds.
+        @return: True if BibSched was notified."""
+        wait_started = time.time()
+        if self.notification_fd is None:
+            time.sleep(timeout)
+            self.queue_changed_at = wait_started
+            return False
+        try:
+            ready = select.select([self.notification_fd], [], [], timeout)[0]
+        except select.error:
+            ## Interrupted by a signal
+            self.queue_changed_at = wait_started
+            return False
+        if not ready:
+            self.queue_changed_at = wait_started
+            return False
+        self.queue_changed_at = time.time()
+        try:
+            while os.read(self.notification_fd, 4096):
+                pass
+        except OSError, err:
+            if err.errno != errno.EAGAIN:
+                raise
+        self.metrics['notifications'] += 1
+        return True
+
+    def record_dispatch(self, runtime):
+        """Account for a task started by BibSched, given its runtime.
+        The latency is counted from the moment the task could be run,
+        i.e. its runtime or the last change of the queue, whichever is
+        later, so that the time spent waiting for free resources or for
+        other tasks is not included."""
+        runnable_since = max(time.mktime(runtime.timetuple()),
+                             self.queue_changed_at)
+        latency = max(0.0, time.time() - runnable_since)
+        self.metrics['dispatched_tasks'] += 1
+        self.metrics['dispatch_latency'] += latency
+        self.metrics['dispatch_max_latency'] = max(self.metrics['dispatch_max_latency'], latency)
+
+    def dump_metrics(self):
+        """Expose the scheduling metrics to 'bibsched status', at most
+        every CFG_BIBSCHED_REFRESHTIME seconds."""
+        if time.time() - self.metrics_dumped < CFG_BIBSCHED_REFRESHTIME:
+            return
+        self.metrics_dumped = time.time()
+        try:
+            metrics_file = open(CFG_BIBSCHED_METRICS_FILE + '.tmp', 'w')
+            marshal.dump(self.metrics, metrics_file)
+            metrics_file.close()
+            os.rename(CFG_BIBSCHED_METRICS_FILE + '.tmp', CFG_BIBSCHED_METRICS_FILE)
+        except (IOError, OSError):
+            register_exception()
+
     def tie_task_to_host(self, task_id):
         """Sets the hostname of a task to the machine executing this script
         @return: True if the scheduling was successful, False otherwise,
@@ -1013,6 +1215,18 @@ class BibSched(object):
         """Return True when the two tasks can run concurrently."""
         return proc1 != proc2  # and not proc1.startswith('bibupload') and not proc2.startswith('bibupload')
 
+    def are_resources_available(self, task_id, proc):
+        """Return True when the active tasks leave enough resources to
+        run the given task on this node."""
+        node_procs = [other_proc for other_task_id, other_proc, dummy_runtime, dummy_status, dummy_priority, other_host, dummy_sequenceid
+                      in self.node_relevant_active_tasks
+                      if other_host == self.hostname and other_task_id != task_id]
+        all_procs = [other_proc for other_task_id, other_proc, dummy_runtime, dummy_status, dummy_priority, dummy_host, dummy_sequenceid
+                     in self.active_tasks_all_nodes
+                     if other_task_id != task_id]
+        return are_resources_available(proc, node_procs, all_procs,
+                                       CFG_BIBSCHED_NODE_RESOURCES.get(self.hostname, {}))
+
     def get_tasks_to_sleep_and_stop(self, proc, task_set):
         """Among the task_set, return the list of tasks to stop and the list
         of tasks to sleep.
@@ -1175,6 +1389,11 @@ class BibSched(object):
                         Log("Cannot run because all resources (%s) are used (%s), active: %s" % (CFG_BIBSCHED_MAX_NUMBER_CONCURRENT_TASKS, len(self.node_relevant_active_tasks), self.node_relevant_active_tasks))
                     return False
 
+                if not self.are_resources_available(task_id, proc):
+                    if debug:
+                        Log("Cannot run because the active tasks do not leave enough resources (%s needs %s), active: %s" % (proc, get_task_resources(proc), self.node_relevant_active_tasks))
+                    return False
+
                 if status in ("SLEEPING", "ABOUT TO SLEEP"):
                     if host == self.hostname:
                         ## We can only wake up tasks that are running on our own host
@@ -1196,17 +1415,21 @@ class BibSched(object):
                     if self.tie_task_to_host(task_id):
                         Log("Task #%d (%s) started" % (task_id, proc))
                         ### Relief the lock for the BibTask, it is safe now to do so
+                        self.record_dispatch(runtime)
                         spawn_task(command, wait=proc in CFG_BIBTASK_MONOTASKS)
-                        count = 10
+                        deadline = time.time() + 10 * CFG_BIBSCHED_REFRESHTIME
                         while run_sql("""SELECT status FROM schTASK
                                          WHERE id=%s AND status='SCHEDULED'""",
                                       (task_id, )):
                             ## Polling to wait for the task to really start,
-                            ## in order to avoid race conditions.
-                            if count <= 0:
+                            ## in order to avoid race conditions. Other
+                            ## notifications may wake us up meanwhile, so
+                            ## the wait is bounded in time, not in number
+                            ## of wake-ups.
+                            timeout = deadline - time.time()
+                            if timeout <= 0:
                                 raise StandardError("Process %s (task_id: %s) was launched but seems not to be able to reach RUNNING status." % (proc, task_id))
-                            time.sleep(CFG_BIBSCHED_REFRESHTIME)
-                            count -= 1
+                            self.wait_for_notification(min(timeout, CFG_BIBSCHED_REFRESHTIME))
                     return True
                 else:
                     raise StandardError("%s is not in the allowed modules" % procname)
@@ -1220,43 +1443,54 @@ class BibSched(object):
                 for (other_task_id, other_proc, other_priority, other_status, other_sequenceid) in tasks_to_sleep:
                     Log("Send SLEEP signal to #%d (%s) which was in status %s" % (other_task_id, other_proc, other_status))
                     bibsched_set_status(other_task_id, 'ABOUT TO SLEEP', other_status)
-                time.sleep(CFG_BIBSCHED_REFRESHTIME)
+                self.wait_for_notification(CFG_BIBSCHED_REFRESHTIME)
                 return True
 
     def watch_loop(self):
-        def check_errors():
-            sql = "SELECT count(id) FROM schTASK WHERE status='ERROR'" \
-                  " OR status='DONE WITH ERRORS' OR STATUS='CERROR'"
-            if run_sql(sql)[0][0] > 0:
-                errors = run_sql("""SELECT id,proc,status FROM schTASK
-                                    WHERE status = 'ERROR'
-                                    OR status = 'DONE WITH ERRORS'
-                                    OR status = 'CERROR'""")
-                msg_errors = ["    #%s %s -> %s" % row for row in errors]
+        def check_errors(error_tasks):
+            if error_tasks:
+                msg_errors = ["    #%s %s -> %s" % row for row in error_tasks]
                 msg = 'BibTask with ERRORS:\n%s' % "\n".join(msg_errors)
-                err_types = set(e[2] for e in errors if e[2])
+                err_types = set(e[2] for e in error_tasks if e[2])
                 if 'ERROR' in err_types or 'DONE WITH ERRORS' in err_types:
                     raise StandardError(msg)
                 else:
                     raise RecoverableError(msg)
 
+        def get_queue():
+            """Return all the tasks of the queue that bibsched may have
+            to consider, with a flag telling whether their runtime is
+            reached, sorted by priority."""
+            return run_sql(
+                """SELECT id, proc, runtime, status, priority, host, sequenceid,
+                          runtime <= NOW()
+                   FROM schTASK WHERE status IN ('WAITING', 'SLEEPING',
+                                                 'RUNNING', 'CONTINUING',
+                                                 'SCHEDULED', 'ABOUT TO STOP',
+                                                 'ABOUT TO SLEEP', 'ERROR',
+                                                 'DONE WITH ERRORS', 'CERROR')
+                   ORDER BY priority DESC, runtime ASC, id ASC""")
+
         def calculate_rows():
-            """Return all the node_relevant_active_tasks to work on."""
+            """Return all the node_relevant_active_tasks to work on.
+
+            The whole queue is read with a single query and split here
+            into the bibupload, waiting, sleeping and active tasks."""
+            t0 = time.time()
+            queue = get_queue()
+
             try:
-                check_errors()
+                check_errors([(row[0], row[1], row[3]) for row in queue
+                              if row[3] in ('ERROR', 'DONE WITH ERRORS', 'CERROR')])
             except RecoverableError, msg:
                 register_emergency('Light emergency from %s: BibTask failed: %s' % (CFG_SITE_URL, msg))
                 run_sql("UPDATE schTASK SET status='ERRORS REPORTED' WHERE status='CERROR'")
 
-            max_bibupload_priority = run_sql(
-                        """SELECT MAX(priority)
-                           FROM schTASK
-                           WHERE status IN ('WAITING', 'RUNNING', 'SLEEPING',
-                                    'ABOUT TO STOP', 'ABOUT TO SLEEP',
-                                    'SCHEDULED', 'CONTINUING')
-                           AND proc = 'bibupload'
-                           AND runtime <= NOW()""")
-            if max_bibupload_priority:
+            bibupload_priorities = [row[4] for row in queue
+                                    if row[1] == 'bibupload' and row[7] and
+                                    row[3] not in ('ERROR', 'DONE WITH ERRORS', 'CERROR')]
+            if bibupload_priorities and min(bibupload_priorities) < max(bibupload_priorities):
+                max_bibupload_priority = max(bibupload_priorities)
                 run_sql(
                 """UPDATE schTASK SET priority = %s
                    WHERE status IN ('WAITING', 'RUNNING', 'SLEEPING',
@@ -1264,34 +1498,38 @@ class BibSched(object):
                                     'SCHEDULED', 'CONTINUING')
                    AND proc = 'bibupload'
                    AND runtime <= NOW()
-                   AND priority < %s""", (max_bibupload_priority[0][0],
-                                          max_bibupload_priority[0][0]))
+                   AND priority < %s""", (max_bibupload_priority,
+                                          max_bibupload_priority))
+                queue = get_queue()
+
             ## The bibupload tasks are sorted by id, which means by the order they were scheduled
-            self.node_relevant_bibupload_tasks = run_sql(
-                """SELECT id, proc, runtime, status, priority, host, sequenceid
-                   FROM schTASK WHERE status IN ('WAITING', 'SLEEPING')
-                   AND proc = 'bibupload'
-                   AND runtime <= NOW()
-                   ORDER BY id ASC LIMIT 1""", n=1)
+            bibupload_tasks = [row[:7] for row in queue
+                               if row[1] == 'bibupload' and row[7] and
+                               row[3] in ('WAITING', 'SLEEPING')]
+            bibupload_tasks.sort()
+            self.node_relevant_bibupload_tasks = tuple(bibupload_tasks[:1])
             ## The other tasks are sorted by priority
-            self.node_relevant_waiting_tasks = run_sql(
-                """SELECT id, proc, runtime, status, priority, host, sequenceid
-                   FROM schTASK WHERE (status='WAITING' AND runtime <= NOW())
-                   OR status = 'SLEEPING'
-                   ORDER BY priority DESC, runtime ASC, id ASC""")
-            self.node_relevant_sleeping_tasks = run_sql(
-                """SELECT id, proc, runtime, status, priority, host, sequenceid
-                   FROM schTASK WHERE status = 'SLEEPING'
-                   ORDER BY priority DESC, runtime ASC, id ASC""")
-            self.node_relevant_active_tasks = run_sql(
-                """SELECT id, proc, runtime, status, priority, host,sequenceid
-                   FROM schTASK WHERE status IN ('RUNNING', 'CONTINUING',
-                                                 'SCHEDULED', 'ABOUT TO STOP',
-                                                 'ABOUT TO SLEEP')""")
+            self.node_relevant_waiting_tasks = tuple([row[:7] for row in queue
+                                                      if (row[3] == 'WAITING' and row[7]) or
+                                                      row[3] == 'SLEEPING'])
+            self.node_relevant_sleeping_tasks = tuple([row[:7] for row in queue
+                                                       if row[3] == 'SLEEPING'])
+            self.node_relevant_active_tasks = tuple([row[:7] for row in queue
+                                                     if row[3] in ('RUNNING', 'CONTINUING',
+                                                                   'SCHEDULED', 'ABOUT TO STOP',
+                                                                   'ABOUT TO SLEEP')])
             self.active_tasks_all_nodes = tuple(self.node_relevant_active_tasks)
             ## Remove tasks that can not be executed on this host
             self.filter_for_allowed_tasks()
 
+            scan_time = time.time() - t0
+            self.metrics['queue_scans'] += 1
+            self.metrics['queue_scan_time'] += scan_time
+            self.metrics['queue_scan_max_time'] = max(self.metrics['queue_scan_max_time'], scan_time)
+            self.dump_metrics()
+
+        self.open_notification_fifo()
+
         ## Cleaning up scheduled task not run because of bibsched being
         ## interrupted in the middle.
         run_sql("UPDATE schTASK SET status='WAITING' WHERE status='SCHEDULED'")
@@ -1317,7 +1555,12 @@ class BibSched(object):
                             ## Something has changed
                             break
                     else:
-                        time.sleep(CFG_BIBSCHED_REFRESHTIME)
+                        ## Nothing to do until some task is submitted
+                        ## or changes status, but let's anyway refresh
+                        ## the queue periodically, e.g. for the tasks
+                        ## whose runtime is reached or which were
+                        ## submitted from other nodes.
+                        self.wait_for_notification(CFG_BIBSCHED_REFRESHTIME)
         except Exception, err:
             register_exception(alert_admin=True)
             try:
@@ -1378,7 +1621,7 @@ def usage(exitcode=1, msg=""):
         sys.stderr.write("Error: %s.\n" % msg)
 
     sys.stderr.write("""\
-Usage: %s [options] [start|stop|restart|monitor|status]
+Usage: %s [options] [start|stop|restart|monitor|status|purge|simulate]
 
 The following commands are available for bibsched:
 
@@ -1389,6 +1632,9 @@ The following commands are available for bibsched:
    monitor    enter the interactive monitor
    status     get report about current status of the queue
    purge      purge the scheduler queue from old tasks
+   simulate   replay the tasks logged in bibsched.log with the current
+              concurrency and resource settings and report the makespan
+              and queue wait times
 
 General options:
   -h, --help       \t Print this help.
@@ -1591,6 +1837,8 @@ def report_queue_status(verbose=True, status=None, since=None, tasks=None):
     write_message("BibSched queue status report for %s:" % gethostname())
     mode = server_pid() and "AUTOMATIC" or "MANUAL"
     write_message("BibSched queue running mode: %s" % mode)
+    if mode == "AUTOMATIC":
+        report_scheduling_metrics()
     if status is None:
         report_about_processes('Running', since, tasks)
         report_about_processes('Waiting', since, tasks)
@@ -1600,6 +1848,210 @@ def report_queue_status(verbose=True, status=None, since=None, tasks=None):
     write_message("Done.")
 
 
+def report_scheduling_metrics():
+    """
+    Report about the scheduling metrics exposed by the BibSched daemon.
+    """
+    try:
+        metrics = marshal.load(open(CFG_BIBSCHED_METRICS_FILE))
+    except (IOError, EOFError, ValueError, TypeError):
+        return
+    write_message("BibSched queue scans: %d (average %.3fs, max %.3fs), notifications received: %d" % (
+        metrics['queue_scans'],
+        metrics['queue_scan_time'] / max(metrics['queue_scans'], 1),
+        metrics['queue_scan_max_time'],
+        metrics['notifications']))
+    write_message("BibSched dispatched tasks: %d (average latency %.1fs, max %.1fs)" % (
+        metrics['dispatched_tasks'],
+        metrics['dispatch_latency'] / max(metrics['dispatched_tasks'], 1),
+        metrics['dispatch_max_latency']))
+
+
+def get_task_metrics(task_id):
+    """
+    Return the performance metrics of the last run of task_id, as a list
+    of dictionaries: the totals of the run first, then its named phases.
+    """
+    return run_sql("""SELECT phase, started, wall_time, cpu_time, max_rss,
+                             sql_count, sql_time, records
+                      FROM hstTASKMETRICS
+                      WHERE id_task=%s AND started=(
+                          SELECT MAX(started) FROM hstTASKMETRICS
+                          WHERE id_task=%s)
+                      ORDER BY id""", (task_id, task_id), with_dict=True)
+
+
+def get_task_metrics_history(proc=None, limit=10):
+    """
+    Return the total performance metrics of the last runs of all the
+    tasks, or only of the tasks named proc, most recent first, as a list
+    of dictionaries.
+    """
+    query = """SELECT id_task, proc, phase, started, wall_time, cpu_time,
+                      max_rss, sql_count, sql_time, records
+               FROM hstTASKMETRICS WHERE phase=''"""
+    params = ()
+    if proc:
+        query += " AND proc=%s"
+        params = (proc, )
+    query += " ORDER BY started DESC, id DESC LIMIT %s" % int(limit)
+    return run_sql(query, params, with_dict=True)
+
+
+def format_task_metrics(metrics):
+    """
+    Return the performance metrics of a task run or phase (a dictionary
+    as returned by get_task_metrics) as a one-line summary.
+    """
+    out = "%.1fs wall, %.1fs CPU, %.1f MB max RSS, %d queries in %.1fs" % (
+        metrics['wall_time'], metrics['cpu_time'], metrics['max_rss'] / 1024.0,
+        metrics['sql_count'], metrics['sql_time'])
+    if metrics['records']:
+        out += ", %d records (%.1f/s)" % (metrics['records'],
+            metrics['records'] / max(metrics['wall_time'], 0.001))
+    if metrics['phase']:
+        out = "%s: %s" % (metrics['phase'], out)
+    return out
+
+
+def simulate_schedule(tasks, node_resources=None,
+                      max_concurrent=CFG_BIBSCHED_MAX_NUMBER_CONCURRENT_TASKS):
+    """
+    Simulate the scheduling of tasks on a single node, following the
+    same rules as BibSched: no two tasks with the same name at the same
+    time, monotasks run alone, at most max_concurrent tasks (apart from
+    fixed time tasks) and the resources of the node.  Waiting tasks are
+    considered by decreasing priority; tasks are never put to sleep.
+
+    @param tasks: list of (task_id, proc, arrival, duration, priority)
+        with times in seconds.
+    @return: dictionary {task_id: simulated start time}
+    """
+    if node_resources is None:
+        node_resources = {}
+    max_concurrent = max(max_concurrent, 1)
+    pending = sorted(tasks, key=lambda task: task[2])
+    waiting = []
+    running = []
+    starts = {}
+    if not pending:
+        return starts
+    now = pending[0][2]
+    i = 0
+    while True:
+        running = [(end, proc) for end, proc in running if end > now]
+        while i < len(pending) and pending[i][2] <= now:
+            waiting.append(pending[i])
+            i += 1
+        waiting.sort(key=lambda task: (-task[4], task[2], task[0]))
+        for task in list(waiting):
+            task_id, proc, dummy_arrival, duration, dummy_priority = task
+            running_procs = [other_proc for dummy_end, other_proc in running]
+            if proc in running_procs:
+                continue
+            if running_procs and (proc in CFG_BIBTASK_MONOTASKS or
+                                  [other_proc for other_proc in running_procs if other_proc in CFG_BIBTASK_MONOTASKS]):
+                continue
+            if proc not in CFG_BIBTASK_FIXEDTIMETASKS and len(running) >= max_concurrent:
+                continue
+            if not are_resources_available(proc, running_procs, running_procs, node_resources):
+                continue
+            starts[task_id] = now
+            running.append((now + duration, proc))
+            waiting.remove(task)
+        next_events = [end for end, dummy_proc in running]
+        if i < len(pending):
+            next_events.append(pending[i][2])
+        if not next_events:
+            return starts
+        now = min(next_events)
+
+
+def get_task_history(since=None, tasks=None):
+    """
+    Return the task runs logged in bibsched.log, as a list of
+    (task_id, proc, arrival, start, duration, priority) with times in
+    seconds.  The arrival is the runtime of the task when it is still
+    in schTASK or hstTASK and earlier than its start, otherwise the
+    start itself (e.g. for the previous runs of periodic tasks).
+    """
+    log_re = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) --> Task #(\d+) \((.*?)\) (started|exited)')
+    if since is not None:
+        if since.startswith('+') or since.startswith('-'):
+            since = since[1:]
+        since = time.mktime(time.strptime(get_datetime('-' + since), "%Y-%m-%d %H:%M:%S"))
+    runs = []
+    open_runs = {}
+    for line in open(os.path.join(CFG_LOGDIR, 'bibsched.log')):
+        match = log_re.match(line)
+        if not match:
+            continue
+        date, task_id, proc, event = match.groups()
+        when = time.mktime(time.strptime(date, "%Y-%m-%d %H:%M:%S"))
+        task_id = int(task_id)
+        if event == 'started':
+            open_runs[task_id] = [task_id, proc, when]
+        elif task_id in open_runs:
+            task_id, proc, start = open_runs.pop(task_id)
+            if since is not None and start < since:
+                continue
+            if tasks is not None and proc.split(':')[0] not in tasks:
+                continue
+            runs.append((task_id, proc, start, when - start))
+
+    task_ids = list(set([run[0] for run in runs]))
+    runtimes = {}
+    for table in ('hstTASK', 'schTASK'):
+        for i in xrange(0, len(task_ids), 1000):
+            chunk = task_ids[i:i + 1000]
+            for task_id, runtime, priority in run_sql("SELECT id, runtime, priority FROM %s WHERE id IN (%s)" % (table, ','.join(['%s'] * len(chunk))), tuple(chunk)):
+                runtimes[task_id] = (time.mktime(runtime.timetuple()), priority)
+
+    history = []
+    for task_id, proc, start, duration in runs:
+        runtime, priority = runtimes.get(task_id, (start, 0))
+        history.append((task_id, proc, min(runtime, start), start, duration, priority))
+    return history
+
+
+def simulate(verbose=True, dummy_status=None, since=None, tasks=None):
+    """
+    Replay the tasks logged in bibsched.log against the current
+    concurrency settings of this node and compare the resulting
+    makespan and queue wait times with the historical ones.
+    """
+    history = get_task_history(since, tasks)
+    if not history:
+        write_message("No task runs found in bibsched.log.")
+        return
+    node_resources = CFG_BIBSCHED_NODE_RESOURCES.get(gethostname(), {})
+    starts = simulate_schedule([(i, proc, arrival, duration, priority)
+                                for i, (dummy_task_id, proc, arrival, dummy_start, duration, priority)
+                                in enumerate(history)], node_resources)
+
+    def report(label, runs):
+        """Report the makespan and wait times of (proc, arrival, start, duration) runs."""
+        makespan = max([start + duration for dummy_proc, dummy_arrival, start, duration in runs]) - \
+                   min([arrival for dummy_proc, arrival, dummy_start, dummy_duration in runs])
+        waits = [start - arrival for dummy_proc, arrival, start, dummy_duration in runs]
+        write_message("%s: makespan %.0fs, average wait %.0fs, max wait %.0fs" % (
+            label, makespan, sum(waits) / len(waits), max(waits)))
+        if verbose:
+            procs = {}
+            for (proc, dummy_arrival, dummy_start, dummy_duration), wait in zip(runs, waits):
+                procs.setdefault(proc.split(':')[0], []).append(wait)
+            for proc, proc_waits in sorted(procs.items()):
+                write_message("    %s: %d runs, average wait %.0fs" % (proc, len(proc_waits), sum(proc_waits) / len(proc_waits)))
+
+    write_message("Replaying %d task runs with node resources %s and database capacity %s" % (
+        len(history), node_resources or 'unlimited', CFG_BIBSCHED_DB_CAPACITY or 'unlimited'))
+    report("Historical", [(proc, arrival, start, duration)
+                          for dummy_task_id, proc, arrival, start, duration, dummy_priority in history])
+    report("Simulated", [(proc, arrival, starts[i], duration)
+                         for i, (dummy_task_id, proc, arrival, dummy_start, duration, dummy_priority)
+                         in enumerate(history) if i in starts])
+
+
 def restart(verbose=True, debug=False):
     halt(verbose, soft=True, debug=debug)
     start(verbose, debug=debug)
@@ -1698,9 +2150,10 @@ def main():
         cmd = 'monitor'
 
     try:
-        if cmd in ('status', 'purge'):
+        if cmd in ('status', 'purge', 'simulate'):
             {'status' : report_queue_status,
               'purge' : gc_tasks,
+              'simulate' : simulate,
             }[cmd](verbose, status, since, tasks)
         else:
             {'start': start,
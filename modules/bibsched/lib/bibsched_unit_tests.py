@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for BibSched."""
+
+__revision__ = "$Id$"
+
+import os
+import unittest
+
+from invenio import bibsched
+from invenio.bibsched import simulate_schedule, are_resources_available, \
+    format_task_metrics
+from invenio.testutils import make_test_suite, run_test_suite
+
+class TestResourceAwareScheduling(unittest.TestCase):
+    """Test the scheduling of tasks according to their resources."""
+
+    def test_are_resources_available(self):
+        """bibsched - resources left by the running tasks"""
+        self.failIf(are_resources_available('bibindex', ['bibrank'], ['bibrank'], {'db': 4}))
+        self.failUnless(are_resources_available('webcoll', ['bibrank'], ['bibrank'], {'db': 4}))
+        ## A task can always run on its own
+        self.failUnless(are_resources_available('bibindex', [], [], {'db': 1}))
+
+    def test_simulate_schedule(self):
+        """bibsched - simulating the scheduling of tasks"""
+        tasks = [(1, 'bibindex', 0, 100, 0),
+                 (2, 'bibrank', 0, 50, 0),
+                 (3, 'webcoll', 10, 10, 0),
+                 (4, 'bibindex', 20, 30, 5)]
+        ## One task at a time, by priority
+        self.assertEqual({1: 0, 4: 100, 2: 130, 3: 180},
+                         simulate_schedule(tasks, max_concurrent=1))
+        ## Never twice the same task at the same time
+        self.assertEqual({1: 0, 2: 0, 3: 10, 4: 100},
+                         simulate_schedule(tasks, max_concurrent=3))
+        ## bibindex and bibrank do not fit together in the database
+        self.assertEqual({1: 0, 3: 10, 4: 100, 2: 130},
+                         simulate_schedule(tasks, {'db': 4}, max_concurrent=3))
+
+class TestTaskMetrics(unittest.TestCase):
+    """Test the display of the performance metrics of tasks."""
+
+    def test_format_task_metrics(self):
+        """bibsched - summary of the metrics of a task run"""
+        metrics = {'phase': '', 'wall_time': 20, 'cpu_time': 15.25,
+                   'max_rss': 2048, 'sql_count': 300, 'sql_time': 4.5,
+                   'records': 0}
+        self.assertEqual("20.0s wall, 15.2s CPU, 2.0 MB max RSS, 300 queries in 4.5s",
+                         format_task_metrics(metrics))
+        metrics['phase'] = 'indexing'
+        metrics['records'] = 1000
+        self.assertEqual("indexing: 20.0s wall, 15.2s CPU, 2.0 MB max RSS, 300 queries in 4.5s, 1000 records (50.0/s)",
+                         format_task_metrics(metrics))
+
+class TestNotification(unittest.TestCase):
+    """Test the wake-up notifications sent to BibSched."""
+
+    def setUp(self):
+        self.old_daemon_pid = bibsched._BIBSCHED_DAEMON_PID
+        self.old_run_sql = bibsched.run_sql
+        self.old_notify = bibsched.bibsched_notify
+        self.notifications = []
+        bibsched.bibsched_notify = lambda: self.notifications.append(1)
+
+    def tearDown(self):
+        bibsched._BIBSCHED_DAEMON_PID = self.old_daemon_pid
+        bibsched.run_sql = self.old_run_sql
+        bibsched.bibsched_notify = self.old_notify
+
+    def test_no_notification_without_change(self):
+        """bibsched - no notification when no task status changed"""
+        bibsched.run_sql = lambda *args, **kwargs: 0
+        bibsched.bibsched_set_status(1, 'DONE', 'RUNNING')
+        bibsched.bibsched_set_priority(1, 5)
+        self.assertEqual([], self.notifications)
+        bibsched.run_sql = lambda *args, **kwargs: 1
+        bibsched.bibsched_set_status(1, 'DONE', 'RUNNING')
+        self.assertEqual([1], self.notifications)
+
+    def test_daemon_does_not_notify_itself(self):
+        """bibsched - the daemon does not wake itself up"""
+        bibsched._BIBSCHED_DAEMON_PID = os.getpid()
+        self.failIf(self.old_notify())
+
+TEST_SUITE = make_test_suite(TestResourceAwareScheduling, TestTaskMetrics,
+                             TestNotification)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
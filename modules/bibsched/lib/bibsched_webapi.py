@@ -20,6 +20,7 @@
 
 from invenio.config import CFG_SITE_URL, CFG_BINDIR, CFG_PREFIX
 from invenio.dbquery import run_sql
+from invenio.bibsched import get_task_metrics_history
 
 import os
 import subprocess
@@ -91,6 +92,22 @@ def get_bibsched_tasks():
                            'ABOUT TO SLEEP', 'DONE WITH ERRORS')")
     return waiting_tasks + other_tasks
 
+def get_bibsched_tasks_metrics(limit=20):
+    """
+    Get the performance metrics of the last task runs
+    """
+    metrics = []
+    for row in get_task_metrics_history(limit=limit):
+        if row['records']:
+            throughput = "%.1f" % (row['records'] / max(row['wall_time'], 0.001))
+        else:
+            throughput = ''
+        metrics.append((row['id_task'], row['proc'], row['started'],
+                        "%.1f" % row['wall_time'], "%.1f" % row['cpu_time'],
+                        "%.1f" % (row['max_rss'] / 1024.0), row['sql_count'],
+                        "%.1f" % row['sql_time'], row['records'], throughput))
+    return metrics
+
 def get_bibsched_mode():
     """
     Gets bibsched running mode: AUTOMATIC or MANUAL
@@ -37,7 +37,8 @@ from invenio.webinterface_handler import WebInterfaceDirectory
 from invenio.bibrankadminlib import tupletotable
 from invenio.webpage import page
 from invenio.bibsched_webapi import get_javascript, get_bibsched_tasks, \
-                                    get_bibsched_mode, get_css, get_motd_msg
+                                    get_bibsched_mode, get_css, get_motd_msg, \
+                                    get_bibsched_tasks_metrics
 from invenio.webuser import page_not_authorized
 
 import time
@@ -86,6 +87,16 @@ class WebInterfaceBibSchedPages(WebInterfaceDirectory):
                     bibsched_error = True
             body_content += tupletotable(header=header, tuple=actions,
                                          alternate_row_colors_p=True)
+        tasks_metrics = get_bibsched_tasks_metrics()
+        if tasks_metrics:
+            body_content += '<br /><span class="bibsched_status">Last task runs</span><br />'
+            body_content += tupletotable(header=["ID", "Name", "Started",
+                                                 "Wall time (s)", "CPU time (s)",
+                                                 "Max RSS (MB)", "Queries",
+                                                 "Query time (s)", "Records",
+                                                 "Records/s"],
+                                         tuple=tasks_metrics,
+                                         alternate_row_colors_p=True)
         if bibsched_error:
             body_content += '<br /><img src="%s"><span class="bibsched_status"> The queue contains errors</span><br />' % ("/img/aid_reject.png")
         else:
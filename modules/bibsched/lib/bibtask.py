@@ -39,6 +39,10 @@ of the task (DONE, FAILED, DONE WITH ERRORS...) and it's progress
 
 It is possible to enqueue a BibTask via API call by means of
 task_low_level_submission.
+
+A BibTask working on a set of records can split it in chunks that BibSched
+runs in parallel as sub-tasks by means of task_run_in_chunks, provided
+task_init was given a task_map_chunk_fnc (and optionally a task_reduce_fnc).
 """
 
 __revision__ = "$Id$"
@@ -57,18 +61,26 @@ import traceback
 import logging
 import logging.handlers
 import random
+import resource
 
-from invenio.dbquery import run_sql, _db_login
+from invenio.dbquery import run_sql, _db_login, serialize_via_marshal, \
+    deserialize_via_marshal, get_run_sql_count, get_run_sql_time, \
+    is_sql_profiling_enabled, sql_profile_start, sql_profile_stop, \
+    format_sql_profile
 from invenio.access_control_engine import acc_authorize_action
 from invenio.config import CFG_PREFIX, CFG_BINDIR, CFG_LOGDIR, \
-    CFG_BIBSCHED_PROCESS_USER, CFG_TMPDIR, CFG_SITE_SUPPORT_EMAIL
+    CFG_BIBSCHED_PROCESS_USER, CFG_TMPDIR, CFG_SITE_SUPPORT_EMAIL, \
+    CFG_BIBSCHED_REFRESHTIME, CFG_BIBSCHED_STATUS_CHECK_INTERVAL
 from invenio.errorlib import register_exception
 
 from invenio.access_control_config import CFG_EXTERNAL_AUTH_USING_SSO, \
     CFG_EXTERNAL_AUTHENTICATION
 from invenio.webuser import get_user_preferences, get_email
 from invenio.bibtask_config import CFG_BIBTASK_VALID_TASKS, \
-    CFG_BIBTASK_DEFAULT_TASK_SETTINGS, CFG_BIBTASK_FIXEDTIMETASKS
+    CFG_BIBTASK_DEFAULT_TASK_SETTINGS, CFG_BIBTASK_FIXEDTIMETASKS, \
+    CFG_BIBTASK_CHUNK_SIZE, CFG_BIBTASK_CHUNK_MAX_ATTEMPTS
+from invenio.bibsched import bibsched_notify, format_task_metrics
+from invenio.intbitset import intbitset
 from invenio.dateutils import parse_runtime_limit
 from invenio.shellutils import escape_shell_arg
 from invenio.mailutils import send_email
@@ -77,6 +89,8 @@ from invenio.mailutils import send_email
 _TASK_PARAMS = {
         'version': '',
         'task_stop_helper_fnc': None,
+        'task_map_chunk_fnc': None,
+        'task_reduce_fnc': None,
         'task_name': os.path.basename(sys.argv[0]),
         'task_specific_name': '',
         'task_id': 0,
@@ -89,16 +103,31 @@ _TASK_PARAMS = {
         'priority': 0,
         'runtime_limit': None,
         'profile': [],
+        'profile-sql': False,
         'post-process': [],
         'sequence-id':None,
         'stop_queue_on_error': False,
         'fixed_time': False,
         'email_logs_to': [],
+        'chunk': None,
         }
 
 # Global _OPTIONS dictionary.
 _OPTIONS = {}
 
+# Whether the status of the task in schTASK may have changed since it was
+# last read, e.g. because BibSched signalled it.
+_TASK_STATUS_CHANGED = True
+# When the status was last read, and its value.
+_TASK_STATUS_LAST_READ = 0
+_TASK_STATUS_LAST_VALUE = None
+# How many times the status was checked, read and found changed.
+_TASK_STATUS_COUNTERS = {'checked': 0, 'read': 0, 'changed': 0}
+
+# Performance metrics of the current run of the task: its totals, its
+# current phase and its finished phases (see task_start_phase).
+_TASK_METRICS = {'total': None, 'phase': None, 'phases': []}
+
 # Which tasks don't need to ask the user for authorization?
 CFG_VALID_PROCESSES_NO_AUTH_NEEDED = ("bibupload", )
 CFG_TASK_IS_NOT_A_DEAMON = ("bibupload", )
@@ -276,6 +305,7 @@ def task_low_level_submission(name, user, *argv):
             runtime,sleeptime,status,progress,arguments,priority,sequenceid)
             VALUES (%s,%s,%s,%s,'WAITING',%s,%s,%s,%s)""",
             (name, user, runtime, sleeptime, verbose_argv, marshal.dumps(argv), priority, sequenceid))
+        bibsched_notify()
 
     except Exception:
         register_exception(alert_admin=True)
@@ -351,7 +381,9 @@ def task_init(
     task_stop_helper_fnc=None,
     task_submit_elaborate_specific_parameter_fnc=None,
     task_submit_check_options_fnc=None,
-    task_run_fnc=None):
+    task_run_fnc=None,
+    task_map_chunk_fnc=None,
+    task_reduce_fnc=None):
     """ Initialize a BibTask.
     @param authorization_action: is the name of the authorization action
     connected with this task;
@@ -369,11 +401,19 @@ def task_init(
     bibtask_get_option) once all the options where parsed;
     @param task_run_fnc: will be called as the main core function. Must return
     False in case of errors.
+    @param task_map_chunk_fnc: will be called with an intbitset of records
+    for every chunk of the records passed to task_run_in_chunks. Must return
+    a marshallable result, or False in case of errors.
+    @param task_reduce_fnc: will be called by task_run_in_chunks with the
+    list of the results of all the chunks. Must return False in case of
+    errors.
     """
     global _TASK_PARAMS, _OPTIONS
     _TASK_PARAMS = {
         "version" : version,
         "task_stop_helper_fnc" : task_stop_helper_fnc,
+        "task_map_chunk_fnc" : task_map_chunk_fnc,
+        "task_reduce_fnc" : task_reduce_fnc,
         "task_name" : os.path.basename(sys.argv[0]),
         "task_specific_name" : '',
         "user" : '',
@@ -383,10 +423,12 @@ def task_init(
         "priority" : 0,
         "runtime_limit" : None,
         "profile" : [],
+        "profile-sql": False,
         "post-process": [],
         "sequence-id": None,
         "stop_queue_on_error": False,
         "fixed_time": False,
+        "chunk": None,
     }
     to_be_submitted = True
     if len(sys.argv) == 2 and sys.argv[1].isdigit():
@@ -431,6 +473,9 @@ def task_init(
     if to_be_submitted:
         _task_submit(argv, authorization_action, authorization_msg)
     else:
+        if _TASK_PARAMS['chunk']:
+            ## This is a sub-task running a chunk on behalf of another task
+            task_run_fnc = _task_run_chunk
         try:
             try:
                 if task_get_task_param('profile'):
@@ -532,12 +577,14 @@ def _task_build_params(
                 "name=",
                 "limit=",
                 "profile=",
+                "profile-sql",
                 "post-process=",
                 "sequence-id=",
                 "stop-on-error",
                 "continue-on-error",
                 "fixed-time",
-                "email-logs-to="
+                "email-logs-to=",
+                "chunk="
             ] + long_params)
     except getopt.GetoptError, err:
         _usage(1, err, help_specific_usage=help_specific_usage, description=description)
@@ -566,6 +613,8 @@ def _task_build_params(
                 _TASK_PARAMS["runtime_limit"] = parse_runtime_limit(opt[1])
             elif opt[0] in ("--profile", ):
                 _TASK_PARAMS["profile"] += opt[1].split(',')
+            elif opt[0] in ("--profile-sql", ):
+                _TASK_PARAMS["profile-sql"] = True
             elif opt[0] in ("--post-process", ):
                 _TASK_PARAMS["post-process"] += [opt[1]];
             elif opt[0] in ("-I","--sequence-id"):
@@ -578,6 +627,9 @@ def _task_build_params(
                 _TASK_PARAMS["fixed_time"] = True
             elif opt[0] in ("--email-logs-to"):
                 _TASK_PARAMS["email_logs_to"] = opt[1].split(',')
+            elif opt[0] in ("--chunk", ):
+                parent_task_id, chunk = opt[1].split(':')
+                _TASK_PARAMS["chunk"] = (int(parent_task_id), int(chunk))
             elif not callable(task_submit_elaborate_specific_parameter_fnc) or \
                 not task_submit_elaborate_specific_parameter_fnc(opt[0],
                     opt[1], opts, args):
@@ -634,10 +686,88 @@ def task_update_progress(msg):
 
 def task_update_status(val):
     """Updates status information in the BibSched task table."""
+    global _TASK_STATUS_LAST_VALUE
     write_message("Updating task status to %s." % val, verbose=9)
+    _TASK_STATUS_LAST_VALUE = val
     if "task_id" in _TASK_PARAMS:
-        return run_sql("UPDATE schTASK SET status=%s where id=%s",
+        ret = run_sql("UPDATE schTASK SET status=%s where id=%s",
             (val, _TASK_PARAMS["task_id"]))
+        bibsched_notify()
+        return ret
+
+def task_start_phase(name):
+    """Start measuring a new named phase of the task, ending the current
+    one if any.  The metrics of the phases are stored along with the
+    metrics of the whole run when the task finishes."""
+    task_end_phase()
+    _TASK_METRICS['phase'] = _task_metrics_start(name)
+
+def task_end_phase():
+    """End the current phase of the task, if any."""
+    if _TASK_METRICS['phase'] is not None:
+        _TASK_METRICS['phases'].append(_task_metrics_end(_TASK_METRICS['phase']))
+        _TASK_METRICS['phase'] = None
+
+def task_count_records(count=1):
+    """Add count to the number of records processed by the task (and by
+    its current phase), in order to compute its throughput."""
+    for metrics in (_TASK_METRICS['total'], _TASK_METRICS['phase']):
+        if metrics is not None:
+            metrics['records'] += count
+
+def _task_get_usage():
+    """Return the resources used so far by the task process, as a tuple
+    (time, CPU time, max RSS in KiB, run_sql count, run_sql time)."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return (time.time(), usage.ru_utime + usage.ru_stime, usage.ru_maxrss,
+            get_run_sql_count(), get_run_sql_time())
+
+def _task_metrics_start(phase):
+    """Return the metrics of a run or phase starting now."""
+    return {'phase': phase,
+            'started': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'usage': _task_get_usage(),
+            'records': 0}
+
+def _task_metrics_end(metrics):
+    """Compute the metrics of a run or phase ending now, started with
+    _task_metrics_start, and return them."""
+    now, cpu_time, max_rss, sql_count, sql_time = _task_get_usage()
+    start = metrics.pop('usage')
+    metrics['wall_time'] = now - start[0]
+    metrics['cpu_time'] = cpu_time - start[1]
+    metrics['max_rss'] = max_rss
+    metrics['sql_count'] = sql_count - start[3]
+    metrics['sql_time'] = sql_time - start[4]
+    return metrics
+
+def _task_store_metrics():
+    """Log the metrics of the run of the task and of its phases and store
+    them in the hstTASKMETRICS table."""
+    task_end_phase()
+    if _TASK_METRICS['total'] is None:
+        return
+    all_metrics = [_task_metrics_end(_TASK_METRICS['total'])] + _TASK_METRICS['phases']
+    _TASK_METRICS['total'] = None
+    _TASK_METRICS['phases'] = []
+    proc = _TASK_PARAMS['task_name']
+    if _TASK_PARAMS['task_specific_name']:
+        proc += ':' + _TASK_PARAMS['task_specific_name']
+    try:
+        for metrics in all_metrics:
+            write_message("Metrics: %s" % format_task_metrics(metrics))
+            run_sql("""INSERT INTO hstTASKMETRICS (id_task, proc, phase,
+                           started, wall_time, cpu_time, max_rss, sql_count,
+                           sql_time, records)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                    (_TASK_PARAMS['task_id'], proc, metrics['phase'],
+                     metrics['started'], metrics['wall_time'],
+                     metrics['cpu_time'], metrics['max_rss'],
+                     metrics['sql_count'], metrics['sql_time'],
+                     metrics['records']))
+    except Exception:
+        ## Metrics must never make a task fail
+        register_exception()
 
 def task_read_status():
     """Read status information in the BibSched task table."""
@@ -694,11 +824,38 @@ def get_datetime(var, format_string="%Y-%m-%d %H:%M:%S", now=None):
     return date
 
 
+def _task_read_status_if_required():
+    """Return the status of the task, reading it from the BibSched task
+    table only if it may have changed, i.e. if the task was signalled or if
+    the last read is older than CFG_BIBSCHED_STATUS_CHECK_INTERVAL seconds.
+    Return None otherwise."""
+    global _TASK_STATUS_CHANGED, _TASK_STATUS_LAST_READ, _TASK_STATUS_LAST_VALUE
+    _TASK_STATUS_COUNTERS['checked'] += 1
+    now = time.time()
+    if not _TASK_STATUS_CHANGED and \
+            now - _TASK_STATUS_LAST_READ < CFG_BIBSCHED_STATUS_CHECK_INTERVAL:
+        return None
+    ## Reset before reading, so that a signal received meanwhile is not lost
+    _TASK_STATUS_CHANGED = False
+    _TASK_STATUS_LAST_READ = now
+    status = task_read_status()
+    _TASK_STATUS_COUNTERS['read'] += 1
+    if status != _TASK_STATUS_LAST_VALUE:
+        _TASK_STATUS_COUNTERS['changed'] += 1
+        _TASK_STATUS_LAST_VALUE = status
+    return status
+
+def task_get_status_counters():
+    """Return how many times task_sleep_now_if_required has checked the
+    status of the task, how many times it actually read it from the
+    database and how many times it found it changed, as a dictionary."""
+    return dict(_TASK_STATUS_COUNTERS)
+
 def task_sleep_now_if_required(can_stop_too=False):
     """This function should be called during safe state of BibTask,
     e.g. after flushing caches or outside of run_sql calls.
     """
-    status = task_read_status()
+    status = _task_read_status_if_required()
     write_message('Entering task_sleep_now_if_required with status=%s' % status, verbose=9)
     if status == 'ABOUT TO SLEEP':
         write_message("sleeping...")
@@ -742,6 +899,273 @@ def task_sleep_now_if_required(can_stop_too=False):
                 task_update_status("STOPPED")
                 sys.exit(0)
 
+## Statuses of a sub-task meaning that it will not run its chunk anymore.
+_CHUNK_TASK_FINAL_STATUSES = ('DONE', 'DONE WITH ERRORS', 'ERROR', 'CERROR',
+                              'ERRORS REPORTED', 'KILLED', 'STOPPED')
+
+## Generic options of the parent task that must not be passed to the
+## sub-tasks running its chunks (they are either reset or meaningless).
+_CHUNK_STRIPPED_SHORT_OPTIONS = ('-s', '-t', '-P', '-N', '-I')
+_CHUNK_STRIPPED_LONG_OPTIONS = ('--sleep', '--sleeptime', '--runtime',
+                                '--priority', '--name', '--sequence-id',
+                                '--post-process', '--email-logs-to', '--chunk')
+_CHUNK_STRIPPED_FLAGS = ('--fixed-time', '--stop-on-error',
+                         '--continue-on-error')
+
+def task_run_in_chunks(recids, chunk_size=CFG_BIBTASK_CHUNK_SIZE):
+    """Split recids in chunks of chunk_size records, call task_map_chunk_fnc
+    on each of them and then task_reduce_fnc on the list of their results.
+
+    When the task is run by BibSched, every chunk is submitted as a
+    sub-task, so that BibSched can run them in parallel on any node.
+    Meanwhile this task runs itself the chunks that have not been started
+    yet, and reports the overall progress.  A failed chunk is run again up
+    to CFG_BIBTASK_CHUNK_MAX_ATTEMPTS times.
+
+    @param recids: the records to process.
+    @type recids: intbitset or list of int
+    @param chunk_size: the number of records per chunk.
+    @type chunk_size: int
+    @return: the value returned by task_reduce_fnc (True if there is none),
+        or False in case of errors.
+    """
+    map_chunk_fnc = _TASK_PARAMS.get('task_map_chunk_fnc')
+    if not callable(map_chunk_fnc):
+        raise StandardError("task_run_in_chunks requires a task_map_chunk_fnc")
+    recids = list(intbitset(recids))
+    chunks = [intbitset(recids[i:i + chunk_size])
+              for i in xrange(0, len(recids), chunk_size)]
+    task_id = _TASK_PARAMS.get('task_id')
+
+    if len(chunks) <= 1 or not task_id:
+        ## Nothing worth parallelizing (or not run by BibSched).
+        results = []
+        for chunk_recids in chunks:
+            if task_id:
+                task_sleep_now_if_required(can_stop_too=False)
+            result = map_chunk_fnc(chunk_recids)
+            if result is False:
+                return False
+            task_count_records(len(chunk_recids))
+            results.append(result)
+        return _task_reduce(results)
+
+    ## Leftovers of a previous run of this (periodic) task.
+    run_sql("DELETE FROM schTASKCHUNK WHERE id_task=%s", (task_id, ))
+    for chunk, chunk_recids in enumerate(chunks):
+        run_sql("""INSERT INTO schTASKCHUNK (id_task, chunk, recids)
+                   VALUES (%s, %s, %s)""",
+                (task_id, chunk, chunk_recids.fastdump()))
+    for chunk in xrange(len(chunks)):
+        chunk_task_id = _task_submit_chunk(chunk)
+        run_sql("""UPDATE schTASKCHUNK SET id_chunk_task=%s, attempts=1
+                   WHERE id_task=%s AND chunk=%s""",
+                (chunk_task_id, task_id, chunk))
+    write_message("Split %s records in %s chunks of %s records." %
+                  (len(recids), len(chunks), chunk_size))
+
+    results = None
+    try:
+        if _task_wait_for_chunks(task_id, len(chunks)):
+            results = [deserialize_via_marshal(row[0]) for row in
+                       run_sql("""SELECT result FROM schTASKCHUNK
+                                  WHERE id_task=%s ORDER BY chunk""",
+                               (task_id, ))]
+    finally:
+        ## Whatever happened, the chunks not yet started are not needed
+        ## anymore, and neither are the sub-tasks this task took over
+        ## but did not finish (see _task_run_chunk_instead_of()).
+        chunk_task_ids = [row[0] for row in
+                          run_sql("""SELECT id_chunk_task FROM schTASKCHUNK
+                                     WHERE id_task=%s AND status<>'DONE'""",
+                                  (task_id, ))]
+        if chunk_task_ids:
+            run_sql("""DELETE FROM schTASK
+                       WHERE (status='WAITING'
+                              OR (host=%%s AND status IN ('RUNNING', 'STOPPED')))
+                         AND id IN (%s)""" %
+                    ','.join(['%s'] * len(chunk_task_ids)),
+                    ['task #%s' % task_id] + chunk_task_ids)
+        run_sql("DELETE FROM schTASKCHUNK WHERE id_task=%s", (task_id, ))
+    if results is None:
+        return False
+    return _task_reduce(results)
+
+def _task_reduce(results):
+    """Call task_reduce_fnc on the results of the chunks, if any."""
+    reduce_fnc = _TASK_PARAMS.get('task_reduce_fnc')
+    if callable(reduce_fnc):
+        return reduce_fnc(results)
+    return True
+
+def _task_wait_for_chunks(task_id, total_chunks):
+    """Follow the sub-tasks running the chunks of task_id until all of them
+    are done, running again the failed ones and running directly the ones
+    BibSched has not started yet.  Return False if a chunk failed too many
+    times."""
+    last_progress = None
+    while True:
+        pending = run_sql("""SELECT chunk, id_chunk_task, attempts
+                             FROM schTASKCHUNK
+                             WHERE id_task=%s AND status<>'DONE'
+                             ORDER BY chunk""", (task_id, ))
+        if not pending:
+            task_update_progress("Done %d out of %d chunks." %
+                                 (total_chunks, total_chunks))
+            return True
+        statuses = _task_get_statuses([row[1] for row in pending])
+        ## Read after the statuses: a sub-task stores its result before
+        ## updating its status, so a final status without a result really
+        ## means that the chunk failed.
+        done = intbitset(run_sql("""SELECT chunk FROM schTASKCHUNK
+                                    WHERE id_task=%s AND status='DONE'""",
+                                 (task_id, )))
+        progress = "Done %d out of %d chunks." % (len(done), total_chunks)
+        if progress != last_progress:
+            task_update_progress(progress)
+            last_progress = progress
+
+        waiting = []
+        for chunk, chunk_task_id, attempts in pending:
+            if chunk in done:
+                continue
+            status = statuses.get(chunk_task_id)
+            if status == 'WAITING':
+                waiting.append((chunk, chunk_task_id))
+            elif status is None or status in _CHUNK_TASK_FINAL_STATUSES:
+                if attempts >= CFG_BIBTASK_CHUNK_MAX_ATTEMPTS:
+                    write_message("Error: chunk %s failed %s times (last time in task #%s: %s). Giving up." %
+                                  (chunk, attempts, chunk_task_id, status), sys.stderr)
+                    return False
+                write_message("Chunk %s failed in task #%s (%s). Running it again." %
+                              (chunk, chunk_task_id, status), sys.stderr)
+                run_sql("""UPDATE schTASKCHUNK
+                           SET id_chunk_task=%s, attempts=attempts+1
+                           WHERE id_task=%s AND chunk=%s""",
+                        (_task_submit_chunk(chunk), task_id, chunk))
+
+        task_sleep_now_if_required(can_stop_too=False)
+        if waiting:
+            ## BibSched starts sub-tasks by increasing id, so let's take
+            ## the last one to avoid racing with it.
+            chunk, chunk_task_id = waiting[-1]
+            _task_run_chunk_instead_of(task_id, chunk, chunk_task_id)
+        else:
+            time.sleep(CFG_BIBSCHED_REFRESHTIME)
+
+def _task_get_statuses(task_ids):
+    """Return a dictionary with the status of the given tasks, either still
+    in the queue or already archived."""
+    statuses = {}
+    if task_ids:
+        format_strings = ','.join(['%s'] * len(task_ids))
+        for table in ('hstTASK', 'schTASK'):
+            statuses.update(dict(run_sql("SELECT id, status FROM %s WHERE id IN (%s)" %
+                                         (table, format_strings), task_ids)))
+    return statuses
+
+def _task_strip_chunk_options(argv):
+    """Return argv without the generic options that only concern the
+    parent task (see _CHUNK_STRIPPED_*)."""
+    ret = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+        elif arg in _CHUNK_STRIPPED_SHORT_OPTIONS or \
+                arg in _CHUNK_STRIPPED_LONG_OPTIONS:
+            ## The value is the next argument
+            skip_next = True
+        elif arg in _CHUNK_STRIPPED_FLAGS:
+            pass
+        elif arg.startswith('--') and \
+                arg.split('=', 1)[0] in _CHUNK_STRIPPED_LONG_OPTIONS:
+            pass
+        elif not arg.startswith('--') and \
+                arg[:2] in _CHUNK_STRIPPED_SHORT_OPTIONS:
+            pass
+        else:
+            ret.append(arg)
+    return ret
+
+def _task_submit_chunk(chunk):
+    """Submit a sub-task running the given chunk of the current task, with
+    the same arguments, user and priority.  Return its task id."""
+    task_id = _TASK_PARAMS['task_id']
+    user, priority, arguments = run_sql("""SELECT user, priority, arguments
+                                           FROM schTASK WHERE id=%s""",
+                                        (task_id, ))[0]
+    argv = _task_strip_chunk_options(marshal.loads(arguments)[1:])
+    return task_low_level_submission(_TASK_PARAMS['task_name'], user,
+        '-N', '%s.%s' % (task_id, chunk), '-P', str(priority),
+        '--chunk=%s:%s' % (task_id, chunk), *argv)
+
+def _task_map_chunk(task_id, chunk, recids):
+    """Call task_map_chunk_fnc on recids and store its result as the result
+    of the given chunk of task_id.  Return False in case of errors."""
+    result = _TASK_PARAMS['task_map_chunk_fnc'](recids)
+    if result is False:
+        return False
+    task_count_records(len(recids))
+    run_sql("""UPDATE schTASKCHUNK SET status='DONE', result=%s
+               WHERE id_task=%s AND chunk=%s""",
+            (serialize_via_marshal(result), task_id, chunk))
+    return True
+
+def _task_run_chunk():
+    """Run the chunk this sub-task has been submitted for.  This is called
+    instead of task_run_fnc in sub-tasks submitted by task_run_in_chunks."""
+    task_id, chunk = _TASK_PARAMS['chunk']
+    if not callable(_TASK_PARAMS['task_map_chunk_fnc']):
+        write_message("Error: %s does not support running in chunks." %
+                      _TASK_PARAMS['task_name'], sys.stderr)
+        return False
+    res = run_sql("SELECT recids FROM schTASKCHUNK WHERE id_task=%s AND chunk=%s",
+                  (task_id, chunk))
+    if not res:
+        write_message("Error: chunk %s of task #%s does not exist anymore." %
+                      (chunk, task_id), sys.stderr)
+        return False
+    recids = intbitset(res[0][0])
+    write_message("Running chunk %s of task #%s on %s records." %
+                  (chunk, task_id, len(recids)))
+    return _task_map_chunk(task_id, chunk, recids)
+
+def _task_run_chunk_instead_of(task_id, chunk, chunk_task_id):
+    """Take over the sub-task chunk_task_id, if BibSched has not started it
+    yet, and run its chunk within the current task."""
+    ## The host must not be the name of a BibSched node, otherwise BibSched
+    ## could believe it has scheduled the sub-task itself.
+    if not run_sql("""UPDATE schTASK SET status='RUNNING', host=%s, progress=%s
+                      WHERE id=%s AND host='' AND status='WAITING'""",
+                   ('task #%s' % task_id, 'Run by task #%s' % task_id,
+                    chunk_task_id)):
+        return
+    bibsched_notify()
+    recids = intbitset(run_sql("""SELECT recids FROM schTASKCHUNK
+                                  WHERE id_task=%s AND chunk=%s""",
+                               (task_id, chunk))[0][0])
+    write_message("Running chunk %s (task #%s) on %s records." %
+                  (chunk, chunk_task_id, len(recids)))
+    try:
+        if _task_map_chunk(task_id, chunk, recids):
+            status = 'DONE'
+        else:
+            status = 'DONE WITH ERRORS'
+    except Exception:
+        register_exception(alert_admin=True)
+        write_message(traceback.format_exc()[:-1], sys.stderr)
+        status = 'CERROR'
+    except:
+        ## E.g. SystemExit because the current task has been asked to
+        ## stop: the sub-task must not stay RUNNING forever.
+        run_sql("UPDATE schTASK SET status='STOPPED' WHERE id=%s",
+                (chunk_task_id, ))
+        bibsched_notify()
+        raise
+    run_sql("UPDATE schTASK SET status=%s WHERE id=%s", (status, chunk_task_id))
+    bibsched_notify()
+
 def authenticate(user, authorization_action, authorization_msg=""):
     """Authenticate the user against the user database.
     Check for its password, if it exists.
@@ -838,6 +1262,7 @@ def _task_submit(argv, authorization_action, authorization_msg):
                                          VALUES (%s,%s,%s,%s,'WAITING',%s,%s,%s,%s)""",
         (task_name, _TASK_PARAMS['user'], _TASK_PARAMS["runtime"],
          _TASK_PARAMS["sleeptime"], verbose_argv, marshal.dumps(argv), _TASK_PARAMS['priority'], _TASK_PARAMS['sequence-id']))
+    bibsched_notify()
 
     ## update task number:
     write_message("Task #%d submitted." % _TASK_PARAMS['task_id'])
@@ -945,6 +1370,8 @@ def _task_run(task_run_fnc):
 
     ## initialize signal handler:
     signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, _task_sig_status_changed)
+    signal.siginterrupt(signal.SIGUSR1, False)
     signal.signal(signal.SIGTSTP, _task_sig_sleep)
     signal.signal(signal.SIGTERM, _task_sig_stop)
     signal.signal(signal.SIGQUIT, _task_sig_stop)
@@ -952,6 +1379,9 @@ def _task_run(task_run_fnc):
     signal.signal(signal.SIGINT, _task_sig_stop)
     ## we can run the task now:
     write_message("Task #%d started." % _TASK_PARAMS['task_id'])
+    _TASK_METRICS['total'] = _task_metrics_start('')
+    if task_get_task_param('profile-sql') or is_sql_profiling_enabled():
+        sql_profile_start()
     task_update_status("RUNNING")
     ## run the task:
     _TASK_PARAMS['task_starting_time'] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
@@ -1007,6 +1437,11 @@ def _task_run(task_run_fnc):
         else:
             ## we are done:
             write_message("Task #%d finished. [%s]" % (_TASK_PARAMS['task_id'], task_status))
+        write_message("Task status checked %(checked)d times, read %(read)d times, found changed %(changed)d times." % _TASK_STATUS_COUNTERS)
+        _task_store_metrics()
+        sql_profile = sql_profile_stop()
+        if sql_profile:
+            write_message("SQL profile: %s" % format_sql_profile(sql_profile))
         ## Removing the pid
         os.remove(pidfile_name)
 
@@ -1053,6 +1488,7 @@ def _usage(exitcode=1, msg="", help_specific_usage="", description=""):
     sys.stderr.write("  -v, --verbose=LEVEL\tVerbose level (0=min,"
         " 1=default, 9=max).\n")
     sys.stderr.write("  --profile=STATS\tPrint profile information. STATS is a comma-separated\n\t\t\tlist of desired output stats (calls, cumulative,\n\t\t\tfile, line, module, name, nfl, pcalls, stdname, time).\n")
+    sys.stderr.write("  --profile-sql\t\tLog the number and time of the SQL queries run,\n\t\t\tby statement, at the end of the task.\n")
     sys.stderr.write("  --stop-on-error\tIn case of unrecoverable error stop the bibsched queue.\n")
     sys.stderr.write("  --continue-on-error\tIn case of unrecoverable error don't stop the bibsched queue.\n")
     sys.stderr.write("  --post-process=BIB_TASKLET_NAME[parameters]\tPostprocesses the specified\n\t\t\tbibtasklet with the given parameters between square\n\t\t\tbrackets.\n")
@@ -1062,6 +1498,11 @@ def _usage(exitcode=1, msg="", help_specific_usage="", description=""):
         sys.stderr.write(description)
     sys.exit(exitcode)
 
+def _task_sig_status_changed(sig, frame):
+    """Signal handler for the 'status changed' signal sent by BibSched."""
+    global _TASK_STATUS_CHANGED
+    _TASK_STATUS_CHANGED = True
+
 def _task_sig_sleep(sig, frame):
     """Signal handler for the 'sleep' signal sent by BibSched."""
     signal.signal(signal.SIGTSTP, signal.SIG_IGN)
@@ -1070,6 +1511,7 @@ def _task_sig_sleep(sig, frame):
     write_message("sleeping as soon as possible...")
     _db_login(relogin=1)
     task_update_status("ABOUT TO SLEEP")
+    _task_sig_status_changed(sig, frame)
 
 def _task_sig_stop(sig, frame):
     """Signal handler for the 'stop' signal sent by BibSched."""
@@ -1078,6 +1520,7 @@ def _task_sig_stop(sig, frame):
     write_message("stopping as soon as possible...")
     _db_login(relogin=1) # To avoid concurrency with an interrupted run_sql call
     task_update_status("ABOUT TO STOP")
+    _task_sig_status_changed(sig, frame)
 
 def _task_sig_suicide(sig, frame):
     """Signal handler for the 'suicide' signal sent by BibSched."""
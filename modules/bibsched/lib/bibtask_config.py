@@ -22,7 +22,7 @@
 __revision__ = "$Id$"
 
 import os
-from invenio.config import CFG_LOGDIR, CFG_PYLIBDIR
+from invenio.config import CFG_LOGDIR, CFG_PYLIBDIR, CFG_PREFIX
 
 # Which tasks are recognized as valid?
 CFG_BIBTASK_VALID_TASKS = ("bibindex", "bibupload", "bibreformat",
@@ -42,6 +42,31 @@ CFG_BIBTASK_FIXEDTIMETASKS = ("oaiharvest", )
 # Task that should not be reinstatiated
 CFG_BIBTASK_NON_REPETITIVE_TASK = ('bibupload', )
 
+# Resources (CPU, database and disk I/O) used by each task type, in
+# arbitrary units, compared by BibSched to CFG_BIBSCHED_NODE_RESOURCES
+# and CFG_BIBSCHED_DB_CAPACITY before running tasks concurrently.
+# Task types not listed use CFG_BIBTASK_DEFAULT_RESOURCES.
+CFG_BIBTASK_RESOURCES = {
+    'bibindex': {'cpu': 1, 'db': 3, 'io': 2},
+    'bibrank': {'cpu': 1, 'db': 3, 'io': 1},
+    'bibreformat': {'cpu': 1, 'db': 2, 'io': 1},
+    'bibupload': {'cpu': 1, 'db': 2, 'io': 2},
+    'bibsort': {'cpu': 1, 'db': 2, 'io': 1},
+    'webcoll': {'cpu': 1, 'db': 1, 'io': 0},
+    'refextract': {'cpu': 2, 'db': 0, 'io': 1},
+    'bibclassify': {'cpu': 2, 'db': 0, 'io': 1},
+    'bibencode': {'cpu': 4, 'db': 0, 'io': 2},
+    'dbdump': {'cpu': 1, 'db': 3, 'io': 3},
+}
+CFG_BIBTASK_DEFAULT_RESOURCES = {'cpu': 1, 'db': 1, 'io': 1}
+
+# Default number of records per chunk when a task splits its work in
+# sub-tasks via task_run_in_chunks()
+CFG_BIBTASK_CHUNK_SIZE = 10000
+
+# How many times a failed chunk is run again before giving up
+CFG_BIBTASK_CHUNK_MAX_ATTEMPTS = 3
+
 ## Default options for each bibtasks
 # for each bibtask name are specified those settings that the bibtask expects
 # to find initialized. Webcoll is empty because current webcoll algorithms
@@ -120,3 +145,10 @@ CFG_BIBTASK_DEFAULT_TASK_SETTINGS = {
 }
 
 CFG_BIBTASK_TASKLETS_PATH = os.path.join(CFG_PYLIBDIR, 'invenio', 'bibsched_tasklets')
+
+# Named pipe through which task submissions and status changes wake up
+# the BibSched daemon running on the same node
+CFG_BIBSCHED_NOTIFICATION_FIFO = os.path.join(CFG_PREFIX, 'var', 'run', 'bibsched.fifo')
+
+# File where the BibSched daemon exposes its scheduling metrics
+CFG_BIBSCHED_METRICS_FILE = os.path.join(CFG_PREFIX, 'var', 'run', 'bibsched_metrics.dat')
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for BibTask."""
+
+__revision__ = "$Id$"
+
+import unittest
+
+from invenio import bibtask
+from invenio.testutils import make_test_suite, run_test_suite
+
+class TestRunInChunks(unittest.TestCase):
+    """Test the splitting of a task in chunks."""
+
+    def setUp(self):
+        self.old_params = bibtask._TASK_PARAMS.copy()
+
+    def tearDown(self):
+        bibtask._TASK_PARAMS.clear()
+        bibtask._TASK_PARAMS.update(self.old_params)
+
+    def test_strip_chunk_options(self):
+        """bibtask - options of the parent not passed to the chunks"""
+        self.assertEqual(['-a', '-u', 'admin', '--recids=1-10', '-v', '3'],
+            bibtask._task_strip_chunk_options(['-a', '-s', '1d', '-u', 'admin',
+                '--recids=1-10', '-P5', '--sleep=1h', '-N', 'foo', '-v', '3',
+                '--post-process', 'bst_foo[]', '--fixed-time']))
+
+    def test_run_in_chunks_outside_bibsched(self):
+        """bibtask - running chunks within the task outside BibSched"""
+        chunks = []
+        def map_chunk(recids):
+            chunks.append(list(recids))
+            return len(recids)
+        bibtask._TASK_PARAMS['task_id'] = 0
+        bibtask._TASK_PARAMS['task_map_chunk_fnc'] = map_chunk
+        bibtask._TASK_PARAMS['task_reduce_fnc'] = sum
+        self.assertEqual(7, bibtask.task_run_in_chunks([5, 1, 3, 2, 9, 8, 7], 3))
+        self.assertEqual([[1, 2, 3], [5, 7, 8], [9]], chunks)
+
+    def test_run_in_chunks_failure(self):
+        """bibtask - a failed chunk makes the task fail"""
+        bibtask._TASK_PARAMS['task_id'] = 0
+        bibtask._TASK_PARAMS['task_map_chunk_fnc'] = lambda recids: 9 not in recids
+        bibtask._TASK_PARAMS['task_reduce_fnc'] = None
+        self.failIf(bibtask.task_run_in_chunks(range(1, 20), 5))
+        self.failUnless(bibtask.task_run_in_chunks(range(10, 20), 5))
+
+class TestStatusChecks(unittest.TestCase):
+    """Test the checks of the task status in task_sleep_now_if_required."""
+
+    def setUp(self):
+        self.reads = []
+        self.old_task_read_status = bibtask.task_read_status
+        self.old_interval = bibtask.CFG_BIBSCHED_STATUS_CHECK_INTERVAL
+        def task_read_status():
+            self.reads.append(1)
+            return 'RUNNING'
+        bibtask.task_read_status = task_read_status
+        bibtask.CFG_BIBSCHED_STATUS_CHECK_INTERVAL = 3600
+        bibtask._TASK_STATUS_CHANGED = True
+
+    def tearDown(self):
+        bibtask.task_read_status = self.old_task_read_status
+        bibtask.CFG_BIBSCHED_STATUS_CHECK_INTERVAL = self.old_interval
+
+    def test_status_read_only_when_signalled(self):
+        """bibtask - status read again only when signalled"""
+        counters = bibtask.task_get_status_counters()
+        for dummy in range(10):
+            bibtask.task_sleep_now_if_required()
+        self.assertEqual(1, len(self.reads))
+        bibtask._task_sig_status_changed(None, None)
+        bibtask.task_sleep_now_if_required()
+        self.assertEqual(2, len(self.reads))
+        new_counters = bibtask.task_get_status_counters()
+        self.assertEqual(11, new_counters['checked'] - counters['checked'])
+        self.assertEqual(2, new_counters['read'] - counters['read'])
+
+    def test_status_read_after_interval(self):
+        """bibtask - status read again after the minimum interval"""
+        bibtask.CFG_BIBSCHED_STATUS_CHECK_INTERVAL = 0
+        for dummy in range(3):
+            bibtask.task_sleep_now_if_required()
+        self.assertEqual(3, len(self.reads))
+
+class TestMetrics(unittest.TestCase):
+    """Test the performance metrics of tasks."""
+
+    def setUp(self):
+        bibtask._TASK_METRICS['total'] = bibtask._task_metrics_start('')
+
+    def tearDown(self):
+        bibtask._TASK_METRICS.update({'total': None, 'phase': None, 'phases': []})
+
+    def test_phases(self):
+        """bibtask - metrics of the phases of a task"""
+        bibtask.task_count_records(2)
+        bibtask.task_start_phase('first')
+        bibtask.task_count_records(3)
+        bibtask.task_start_phase('second')
+        bibtask.task_count_records()
+        bibtask.task_end_phase()
+        bibtask.task_count_records()
+        phases = bibtask._TASK_METRICS['phases']
+        self.assertEqual(['first', 'second'], [phase['phase'] for phase in phases])
+        self.assertEqual([3, 1], [phase['records'] for phase in phases])
+        total = bibtask._task_metrics_end(bibtask._TASK_METRICS['total'])
+        self.assertEqual(7, total['records'])
+        for key in ('wall_time', 'cpu_time', 'max_rss', 'sql_count', 'sql_time'):
+            self.failUnless(total[key] >= 0)
+
+TEST_SUITE = make_test_suite(TestRunInChunks, TestStatusChecks, TestMetrics)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
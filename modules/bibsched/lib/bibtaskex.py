@@ -29,7 +29,8 @@ import sys
 import time
 from invenio.bibtask import task_init, write_message, task_set_option, \
         task_get_option, task_update_progress, task_has_option, \
-        task_get_task_param, task_sleep_now_if_required
+        task_get_task_param, task_sleep_now_if_required, task_run_in_chunks, \
+        task_start_phase, task_count_records
 
 def fib(n):
     """Returns Fibonacci number for 'n'."""
@@ -55,6 +56,9 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):
     elif key in ('-e', '--error'):
         task_set_option('error', True)
         return True
+    elif key in ('-c', '--chunk-size'):
+        task_set_option('chunk_size', int(value))
+        return True
     return False
 
 def task_run_core():
@@ -64,6 +68,10 @@ def task_run_core():
     messages on stderr.
     Return 1 in case of success and 0 in case of failure."""
     n = int(task_get_option('number'))
+    if task_get_option('chunk_size'):
+        write_message("Computing %d Fibonacci numbers in chunks of %d." %
+                      (n, task_get_option('chunk_size')), verbose=9)
+        return task_run_in_chunks(range(n), task_get_option('chunk_size'))
     write_message("Printing %d Fibonacci numbers." % n, verbose=9)
     for i in range(0, n):
         if i > 0 and i % 4 == 0:
@@ -73,12 +81,31 @@ def task_run_core():
             if task_get_option('error'):
                 1 / 0
         write_message("fib(%d)=%d" % (i, fib(i)))
+        task_count_records()
         task_update_progress("Done %d out of %d." % (i, n))
         task_sleep_now_if_required(can_stop_too=True)
         time.sleep(1)
     task_update_progress("Done %d out of %d." % (n, n))
     return 1
 
+def task_map_chunk(numbers):
+    """Computes the Fibonacci numbers for the given chunk of numbers.
+    This is run in parallel, as a sub-task, for every chunk."""
+    results = []
+    for i in numbers:
+        results.append((i, fib(i)))
+        task_update_progress("Done %d out of %d." % (len(results), len(numbers)))
+        task_sleep_now_if_required(can_stop_too=True)
+    return results
+
+def task_reduce(results):
+    """Prints the Fibonacci numbers computed by all the chunks."""
+    task_start_phase('printing')
+    for chunk_results in results:
+        for i, fib_i in chunk_results:
+            write_message("fib(%d)=%d" % (i, fib_i))
+    return 1
+
 def main():
     """Main that construct all the bibtask."""
     task_init(authorization_action='runbibtaskex',
@@ -86,12 +113,15 @@ def main():
             help_specific_usage="""\
 -n,  --number         Print Fibonacci numbers for up to NUM. [default=30]
 -e,  --error          Raise an error from time to time
+-c,  --chunk-size     Compute the numbers in parallel sub-tasks of SIZE numbers
 """,
             version=__revision__,
-            specific_params=("n:e",
-                ["number=", "error"]),
+            specific_params=("n:ec:",
+                ["number=", "error", "chunk-size="]),
             task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
-            task_run_fnc=task_run_core)
+            task_run_fnc=task_run_core,
+            task_map_chunk_fnc=task_map_chunk,
+            task_reduce_fnc=task_reduce)
 
 ### okay, here we go:
 if __name__ == '__main__':
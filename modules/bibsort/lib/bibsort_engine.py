@@ -22,7 +22,7 @@
 import sys
 import time
 from invenio.dbquery import deserialize_via_marshal, \
-serialize_via_marshal, run_sql, Error
+serialize_via_marshal, run_sql, run_sql_iter, Error
 from invenio.search_engine import get_field_tags, search_pattern
 from invenio.intbitset import intbitset
 from invenio.bibtask import write_message, task_update_progress, \
@@ -79,10 +79,11 @@ def get_bibsort_methods_details(method_list = None):
 
 def get_all_recids(including_deleted=True):#6.68s on cdsdev
     """Returns a list of all records available in the system"""
-    res = run_sql("SELECT id FROM bibrec")
-    if not res:
-        return intbitset([])
-    all_recs = intbitset(res)
+    all_recs = intbitset()
+    for res in run_sql_iter("SELECT id FROM bibrec", batches=True):
+        all_recs |= intbitset(res)
+    if not all_recs:
+        return all_recs
     if not including_deleted: # we want to exclude deleted records
         if CFG_CERN_SITE:
             deleted = search_pattern(p='980__:"DELETED" OR 980__:"DUMMY"')
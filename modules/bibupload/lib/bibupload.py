@@ -53,7 +53,7 @@ from invenio.config import CFG_OAI_ID_FIELD, \
 from invenio.jsonutils import json, CFG_JSON_AVAILABLE
 from invenio.bibupload_config import CFG_BIBUPLOAD_CONTROLFIELD_TAGS, \
     CFG_BIBUPLOAD_SPECIAL_TAGS
-from invenio.dbquery import run_sql, \
+from invenio.dbquery import run_sql, run_sql_in, \
                             Error
 from invenio.bibrecord import create_records, \
                               record_add_field, \
@@ -77,7 +77,8 @@ from invenio.urlutils import make_user_agent_string
 from invenio.config import CFG_BIBDOCFILE_FILEDIR
 from invenio.bibtask import task_init, write_message, \
     task_set_option, task_get_option, task_get_task_param, task_update_status, \
-    task_update_progress, task_sleep_now_if_required, fix_argv_paths
+    task_update_progress, task_sleep_now_if_required, fix_argv_paths, \
+    task_count_records
 from invenio.bibdocfile import BibRecDocs, file_strip_ext, normalize_format, \
     get_docname_from_url, check_valid_url, download_url, \
     KEEP_OLD_VALUE, decompose_bibdocfile_url, InvenioBibDocFileError, \
@@ -980,20 +981,54 @@ def insert_bibfmt(id_bibrec, marc, bibformat, modification_date='1970-01-01 00:0
             % error, verbose=1, stream=sys.stderr)
     return None
 
-def insert_record_bibxxx(tag, value, pretend=False):
-    """Insert the record into bibxxx"""
+def get_bibxxx_ids(tags_values):
+    """Return the ids of the given (tag, value) combinations that already
+    exist in the bibxxx tables, as a dictionary {(tag, value): id}.  The
+    values are looked up with a few queries per bibxxx table instead of
+    one query per combination.
+    """
+    values_by_table = {}
+    for tag, value in tags_values:
+        values_by_table.setdefault('bib' + tag[0:2] + 'x', {})[value] = True
+    out = {}
+    for table_name, values in values_by_table.items():
+        # values can be long (abstracts...), so keep the chunks small
+        res = run_sql_in("""SELECT value, tag, id FROM %s
+                            WHERE value IN (%%(ids)s)""" % table_name,
+                         values.keys(), chunk_size=100)
+        # Note: as in insert_record_bibxxx(), the values found are
+        # matched in Python, so that they are compared as binary
+        # strings whatever the collation of the column.
+        for value, rows in res.iteritems():
+            for tag, row_id in rows:
+                if not out.has_key((tag, value)):
+                    out[(tag, value)] = row_id
+    return out
+
+def insert_record_bibxxx(tag, value, pretend=False, bibxxx_ids=None):
+    """Insert the record into bibxxx.  BIBXXX_IDS, if given, holds the
+    ids of the (tag, value) combinations already in the bibxxx tables,
+    as returned by get_bibxxx_ids() for all the combinations of the
+    record, so that they do not have to be looked up one by one; it is
+    updated with the combinations inserted.
+    """
     # determine into which table one should insert the record
     table_name = 'bib'+tag[0:2]+'x'
 
-    # check if the tag, value combination exists in the table
-    query = """SELECT id,value FROM %s """ % table_name
-    query += """ WHERE tag=%s AND value=%s"""
-    params = (tag, value)
-    try:
-        res = run_sql(query, params)
-    except Error, error:
-        write_message("   Error during the insert_record_bibxxx function : %s "
-            % error, verbose=1, stream=sys.stderr)
+    if bibxxx_ids is not None:
+        if bibxxx_ids.has_key((tag, value)):
+            return (table_name, bibxxx_ids[(tag, value)])
+        res = ()
+    else:
+        # check if the tag, value combination exists in the table
+        query = """SELECT id,value FROM %s """ % table_name
+        query += """ WHERE tag=%s AND value=%s"""
+        params = (tag, value)
+        try:
+            res = run_sql(query, params)
+        except Error, error:
+            write_message("   Error during the insert_record_bibxxx function : %s "
+                % error, verbose=1, stream=sys.stderr)
 
     # Note: compare now the found values one by one and look for
     # string binary equality (e.g. to respect lowercase/uppercase
@@ -1023,6 +1058,8 @@ def insert_record_bibxxx(tag, value, pretend=False):
     except Error, error:
         write_message("   Error during the insert_record_bibxxx function : %s "
             % error, verbose=1, stream=sys.stderr)
+    if bibxxx_ids is not None:
+        bibxxx_ids[(tag, value)] = row_id
     return (table_name, row_id)
 
 def insert_record_bibrec_bibxxx(table_name, id_bibxxx,
@@ -2113,6 +2150,8 @@ def archive_marcxml_for_history(recID, pretend=False):
 
 def update_database_with_metadata(record, rec_id, oai_rec_id = "oai", pretend=False):
     """Update the database tables with the record and the record id given in parameter"""
+    # list of (full tag, value, field number) to insert
+    fields = []
     for tag in record.keys():
         # check if tag is not a special one:
         if tag not in CFG_BIBUPLOAD_SPECIAL_TAGS:
@@ -2144,18 +2183,7 @@ def update_database_with_metadata(record, rec_id, oai_rec_id = "oai", pretend=Fa
                     value = single_tuple[3]
                     # get the full tag
                     full_tag = ''.join(tag_list)
-
-                    # update the tables
-                    write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
-                    # insert the tag and value into into bibxxx
-                    (table_name, bibxxx_row_id) = insert_record_bibxxx(full_tag, value, pretend=pretend)
-                    #print 'tname, bibrow', table_name, bibxxx_row_id;
-                    if table_name is None or bibxxx_row_id is None:
-                        write_message("   Failed : during insert_record_bibxxx", verbose=1, stream=sys.stderr)
-                    # connect bibxxx and bibrec with the table bibrec_bibxxx
-                    res = insert_record_bibrec_bibxxx(table_name, bibxxx_row_id, datafield_number, rec_id, pretend=pretend)
-                    if res is None:
-                        write_message("   Failed : during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
+                    fields.append((full_tag, value, datafield_number))
                 else:
                     # get the tag and value from the content of each subfield
                     for subfield in subfield_list:
@@ -2164,21 +2192,27 @@ def update_database_with_metadata(record, rec_id, oai_rec_id = "oai", pretend=Fa
                         tag_list.append(subtag)
                         # get the full tag
                         full_tag = ''.join(tag_list)
-                        # update the tables
-                        write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
-                        # insert the tag and value into into bibxxx
-                        (table_name, bibxxx_row_id) = insert_record_bibxxx(full_tag, value, pretend=pretend)
-                        if table_name is None or bibxxx_row_id is None:
-                            write_message("   Failed : during insert_record_bibxxx", verbose=1, stream=sys.stderr)
-                        # connect bibxxx and bibrec with the table bibrec_bibxxx
-                        res = insert_record_bibrec_bibxxx(table_name, bibxxx_row_id, datafield_number, rec_id, pretend=pretend)
-                        if res is None:
-                            write_message("   Failed : during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
+                        fields.append((full_tag, value, datafield_number))
                         # remove the subtag from the list
                         tag_list.pop()
                 tag_list.pop()
                 tag_list.pop()
             tag_list.pop()
+
+    # look up the existing bibxxx values of the whole record at once
+    bibxxx_ids = get_bibxxx_ids([(full_tag, value) for \
+                                 (full_tag, value, dummy) in fields])
+    for full_tag, value, datafield_number in fields:
+        # update the tables
+        write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
+        # insert the tag and value into into bibxxx
+        (table_name, bibxxx_row_id) = insert_record_bibxxx(full_tag, value, pretend=pretend, bibxxx_ids=bibxxx_ids)
+        if table_name is None or bibxxx_row_id is None:
+            write_message("   Failed : during insert_record_bibxxx", verbose=1, stream=sys.stderr)
+        # connect bibxxx and bibrec with the table bibrec_bibxxx
+        res = insert_record_bibrec_bibxxx(table_name, bibxxx_row_id, datafield_number, rec_id, pretend=pretend)
+        if res is None:
+            write_message("   Failed : during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
     write_message("   -Update the database with metadata : DONE", verbose=2)
 
     log_record_uploading(oai_rec_id, task_get_task_param('task_id', 0), rec_id, 'P', pretend=pretend)
@@ -2647,6 +2681,7 @@ def bibupload_records(records, opt_mode = None, opt_tag = None,
             else:
                 if callback_url:
                     results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
+            task_count_records()
             # stat us a global variable
             task_update_progress("Done %d out of %d." % \
                                      (stat['nb_records_inserted'] + \
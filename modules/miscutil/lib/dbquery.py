@@ -22,6 +22,9 @@ The main API functions are:
     - run_sql()
     - run_sql_many()
     - run_sql_with_limit()
+    - run_sql_prepared()
+    - run_sql_iter()
+    - run_sql_in()
 but see the others as well.
 """
 
@@ -33,24 +36,37 @@ from MySQLdb import Warning, Error, InterfaceError, DataError, \
                     DatabaseError, OperationalError, IntegrityError, \
                     InternalError, NotSupportedError, \
                     ProgrammingError
+from MySQLdb.cursors import SSCursor
 import gc
 import os
+import sys
+import traceback
 import string
 import time
 import marshal
 import re
 import atexit
+import random
 from zlib import compress, decompress
-from thread import get_ident
+from thread import get_ident, allocate_lock
 from invenio.config import CFG_ACCESS_CONTROL_LEVEL_SITE, \
     CFG_MISCUTIL_SQL_USE_SQLALCHEMY, \
-    CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT
+    CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, \
+    CFG_MISCUTIL_SQL_POOL_SIZE, \
+    CFG_MISCUTIL_SQL_PING_INTERVAL, \
+    CFG_MISCUTIL_SQL_PROFILE, \
+    CFG_MISCUTIL_SQL_SLOW_QUERY_THRESHOLD, \
+    CFG_MISCUTIL_SQL_SLAVE_ROUTING, \
+    CFG_MISCUTIL_SQL_SLAVE_MAX_LAG, \
+    CFG_MISCUTIL_SQL_SLAVE_ROUTING_MASTER_TABLES, \
+    CFG_TMPSHAREDDIR
 
 if CFG_MISCUTIL_SQL_USE_SQLALCHEMY:
     try:
         import sqlalchemy.pool as pool
         import MySQLdb as mysqldb
-        mysqldb = pool.manage(mysqldb, use_threadlocal=True)
+        mysqldb = pool.manage(mysqldb, use_threadlocal=True,
+                              pool_size=CFG_MISCUTIL_SQL_POOL_SIZE)
         connect = mysqldb.connect
     except ImportError:
         CFG_MISCUTIL_SQL_USE_SQLALCHEMY = False
@@ -75,7 +91,97 @@ CFG_DATABASE_SLAVE = ''
 
 _DB_CONN = {}
 _DB_CONN[CFG_DATABASE_HOST] = {}
-_DB_CONN[CFG_DATABASE_SLAVE] = {}
+
+## Read replicas.  CFG_DATABASE_SLAVE can name several slaves, separated
+## by commas.  The queries run with run_on_slave go to one of the slaves
+## lagging at most CFG_MISCUTIL_SQL_SLAVE_MAX_LAG seconds behind the
+## master, or to the master if there is none.  Web requests can also
+## route their read-only queries to the slaves automatically (see
+## sql_routing_start()).
+_DB_SLAVES = [_dbhost.strip() for _dbhost in CFG_DATABASE_SLAVE.split(',')
+              if _dbhost.strip()]
+for _dbhost in _DB_SLAVES:
+    _DB_CONN[_dbhost] = {}
+# Replication lag of the slaves, by host: (time checked, lag in seconds,
+# or None if unknown, or sys.maxint if the slave cannot be used)
+_DB_SLAVE_LAG = {}
+_DB_SLAVE_LAG_CHECK_INTERVAL = 10
+# Seconds to wait for a slave to accept a connection, so that a slave
+# being down does not block the requests until the TCP timeout
+_DB_SLAVE_CONNECT_TIMEOUT = 5
+# Routing of the web requests being served, by (pid, thread): the slave
+# chosen for the request and whether it is pinned to the master
+_SQL_ROUTING = {}
+# Whether queries are read-only, i.e. can be routed to a slave
+_SQL_READ_ONLY = {}
+_RE_SQL_NOT_READ_ONLY = re.compile(r"FOR\s+UPDATE|LOCK\s+IN\s+SHARE\s+MODE|"
+                                   r"GET_LOCK|RELEASE_LOCK|IS_FREE_LOCK|"
+                                   r"IS_USED_LOCK|LAST_INSERT_ID|@|"
+                                   r"INTO\s+(?:OUT|DUMP)FILE", re.I)
+# Tables that must be read on the master, whose rows must be up to date
+# even in the request following the one that wrote them
+_RE_SQL_MASTER_TABLES = None
+if CFG_MISCUTIL_SQL_SLAVE_ROUTING_MASTER_TABLES.strip():
+    _RE_SQL_MASTER_TABLES = re.compile(r"\b(?:%s)\b" % '|'.join(
+        [re.escape(table.strip()) for table in
+         CFG_MISCUTIL_SQL_SLAVE_ROUTING_MASTER_TABLES.split(',')
+         if table.strip()]), re.I)
+
+## Connection pool.  Every thread uses its own connection, stored in
+## _DB_CONN[dbhost][(pid, thread)], that it takes from the idle
+## connections of its process when there are some.  _db_logout() gives
+## the connection back to the idle ones, of which at most
+## CFG_MISCUTIL_SQL_POOL_SIZE are kept per host and process (the
+## process id is part of the key so that forked children never share
+## the connections of their parent).
+_DB_CONN_IDLE = {}
+_DB_CONN_IDLE_LOCK = allocate_lock()
+# Time each connection was last used, to ping the ones idle for long
+_DB_CONN_LAST_USED = {}
+# Cursor reused by every query run on a connection
+_DB_CURSORS = {}
+# Names of the statements prepared on a connection, by SQL query
+_DB_PREPARED = {}
+_DB_PREPARED_MAX = 100
+
+## Query instrumentation.  A thread can collect the profile of the
+## queries it runs (see sql_profile_start()), and queries slower than
+## the threshold are logged with the Python stack that ran them.
+# Profiles being collected, by (pid, thread)
+_SQL_PROFILES = {}
+# Whether web requests and tasks should collect a profile
+_SQL_PROFILING = bool(CFG_MISCUTIL_SQL_PROFILE)
+# Queries slower than this (in seconds) are logged, 0 to log none
+_SQL_SLOW_QUERY_TIME = CFG_MISCUTIL_SQL_SLOW_QUERY_THRESHOLD / 1000.0
+# File enabling the profiling in the running web processes (see
+# check_sql_profiling_flag()), and its modification time when last
+# checked (None if it did not exist)
+_SQL_PROFILING_FLAG_FILE = CFG_TMPSHAREDDIR + '/dbquery-profile.flag'
+_SQL_PROFILING_FLAG_MTIME = None
+# How many slow queries to keep in a profile
+_SQL_PROFILE_SLOW_MAX = 20
+# Regexps normalizing queries, so that the ones differing only by
+# their literal values are profiled together
+_RE_SQL_NORMALIZE = ((re.compile(r"'(?:[^'\\]|\\.)*'"), "?"),
+                     (re.compile(r'"(?:[^"\\]|\\.)*"'), "?"),
+                     (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+                     (re.compile(r"%s"), "?"),
+                     (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+                     (re.compile(r"\s+"), " "))
+
+# Statement type (SELECT, INSERT...) of the queries seen by run_sql()
+_SQL_STATEMENT_TYPES = {}
+_SQL_STATEMENT_TYPES_MAX = 10000
+
+# Number of queries run by run_sql() in this process (see get_run_sql_count())
+_RUN_SQL_COUNT = 0
+# Number of queries run by run_sql() by each thread, by (pid, thread)
+# (see get_thread_run_sql_count()).  Entries are dropped by
+# release_connections(), as thread IDs are recycled.
+_RUN_SQL_THREAD_COUNT = {}
+# Time spent by run_sql() executing queries in this process, in seconds
+# (see get_run_sql_time())
+_RUN_SQL_TIME = 0.0
 
 def unlock_all():
     for dbhost in _DB_CONN.keys():
@@ -94,8 +200,8 @@ class InvenioDbQueryWildcardLimitError(Exception):
         """Initialization."""
         self.res = res
 
-def _db_login(dbhost=CFG_DATABASE_HOST, relogin=0):
-    """Login to the database."""
+def _db_connect(dbhost):
+    """Open a new connection to DBHOST."""
 
     ## Note: we are using "use_unicode=False", because we want to
     ## receive strings from MySQL as Python UTF-8 binary string
@@ -108,41 +214,140 @@ def _db_login(dbhost=CFG_DATABASE_HOST, relogin=0):
     ## older MySQLdb versions here, since we are recommending to
     ## upgrade to more recent versions anyway.
 
+    connection = connect(**_db_connect_args(dbhost))
+    connection.autocommit(True)
+    return connection
+
+def _db_connect_args(dbhost):
+    """Return the keyword arguments to connect to DBHOST."""
+    args = {'host': dbhost, 'port': int(CFG_DATABASE_PORT),
+            'db': CFG_DATABASE_NAME, 'user': CFG_DATABASE_USER,
+            'passwd': CFG_DATABASE_PASS,
+            'use_unicode': False, 'charset': 'utf8'}
+    if dbhost != CFG_DATABASE_HOST:
+        args['connect_timeout'] = _DB_SLAVE_CONNECT_TIMEOUT
+    return args
+
+def _db_is_alive(connection):
+    """Return True if CONNECTION still answers to a ping."""
+    try:
+        connection.ping()
+        return True
+    except (OperationalError, InterfaceError):
+        return False
+
+def _db_forget(connection):
+    """Forget everything known about CONNECTION (cursor, prepared
+    statements, last use), e.g. because it is going to be closed.
+    """
+    for cache in (_DB_CONN_LAST_USED, _DB_CURSORS, _DB_PREPARED):
+        try:
+            del cache[connection]
+        except KeyError:
+            pass
+
+def _db_close(connection):
+    """Close CONNECTION, ignoring errors if it is already dead."""
+    _db_forget(connection)
+    try:
+        connection.close()
+    except (OperationalError, InterfaceError, ProgrammingError):
+        pass
+
+def _db_checkout(dbhost):
+    """Return a connection to DBHOST for the current thread: an idle
+    one of the pool when there is one still alive, a new one otherwise.
+    """
+    pool_key = (dbhost, os.getpid())
+    _DB_CONN_IDLE_LOCK.acquire()
+    try:
+        idle_connections = _DB_CONN_IDLE.get(pool_key, [])
+        if idle_connections:
+            connection = idle_connections.pop()
+        else:
+            connection = None
+    finally:
+        _DB_CONN_IDLE_LOCK.release()
+    if connection is not None:
+        if time.time() - _DB_CONN_LAST_USED.get(connection, 0) > CFG_MISCUTIL_SQL_PING_INTERVAL \
+               and not _db_is_alive(connection):
+            _db_close(connection)
+            connection = None
+    if connection is None:
+        connection = _db_connect(dbhost)
+    return connection
+
+def _db_login(dbhost=CFG_DATABASE_HOST, relogin=0):
+    """Login to the database: return the connection of the current
+    thread to DBHOST, taking it from the pool if the thread does not
+    have one yet.  A connection left unused for more than
+    CFG_MISCUTIL_SQL_PING_INTERVAL seconds is pinged first and replaced
+    if the server went away.  With RELOGIN, the thread gets a new
+    connection in any case.
+    """
     if CFG_MISCUTIL_SQL_USE_SQLALCHEMY:
-        return connect(host=dbhost, port=int(CFG_DATABASE_PORT),
-                       db=CFG_DATABASE_NAME, user=CFG_DATABASE_USER,
-                       passwd=CFG_DATABASE_PASS,
-                       use_unicode=False, charset='utf8')
-    else:
-        thread_ident = (os.getpid(), get_ident())
-    if relogin:
-        connection = _DB_CONN[dbhost][thread_ident] = connect(host=dbhost,
-                                         port=int(CFG_DATABASE_PORT),
-                                         db=CFG_DATABASE_NAME,
-                                         user=CFG_DATABASE_USER,
-                                         passwd=CFG_DATABASE_PASS,
-                                         use_unicode=False, charset='utf8')
-        connection.autocommit(True)
+        connection = connect(**_db_connect_args(dbhost))
         return connection
-    else:
-        if _DB_CONN[dbhost].has_key(thread_ident):
-            return _DB_CONN[dbhost][thread_ident]
-        else:
-            connection = _DB_CONN[dbhost][thread_ident] = connect(host=dbhost,
-                                             port=int(CFG_DATABASE_PORT),
-                                             db=CFG_DATABASE_NAME,
-                                             user=CFG_DATABASE_USER,
-                                             passwd=CFG_DATABASE_PASS,
-                                             use_unicode=False, charset='utf8')
-            connection.autocommit(True)
-            return connection
+
+    thread_ident = (os.getpid(), get_ident())
+    connections = _DB_CONN.setdefault(dbhost, {})
+    connection = connections.get(thread_ident)
+    now = time.time()
+    if relogin:
+        if connection is not None:
+            ## Do not close it: a query interrupted by a signal handler
+            ## may still be running on it.
+            _db_forget(connection)
+        connection = connections[thread_ident] = _db_connect(dbhost)
+    elif connection is None:
+        connection = connections[thread_ident] = _db_checkout(dbhost)
+    elif now - _DB_CONN_LAST_USED.get(connection, now) > CFG_MISCUTIL_SQL_PING_INTERVAL \
+             and not _db_is_alive(connection):
+        _db_close(connection)
+        connection = connections[thread_ident] = _db_connect(dbhost)
+    _DB_CONN_LAST_USED[connection] = now
+    return connection
 
 def _db_logout(dbhost=CFG_DATABASE_HOST):
-    """Close a connection."""
+    """Release the connection of the current thread to DBHOST: give it
+    back to the pool, or close it if the pool is already full.  Should
+    be called when a thread is done with the database for a while (e.g.
+    at the end of a web request) so that other threads can reuse it.
+    """
     try:
-        del _DB_CONN[dbhost][(os.getpid(), get_ident())]
+        connection = _DB_CONN[dbhost].pop((os.getpid(), get_ident()))
     except KeyError:
-        pass
+        return
+    if CFG_MISCUTIL_SQL_USE_SQLALCHEMY:
+        return
+    _db_checkin(dbhost, connection)
+
+def _db_checkin(dbhost, connection):
+    """Give CONNECTION to DBHOST back to the pool, or close it if the
+    pool is already full.
+    """
+    pool_key = (dbhost, os.getpid())
+    _DB_CONN_IDLE_LOCK.acquire()
+    try:
+        idle_connections = _DB_CONN_IDLE.setdefault(pool_key, [])
+        if len(idle_connections) < CFG_MISCUTIL_SQL_POOL_SIZE:
+            _DB_CONN_LAST_USED[connection] = time.time()
+            idle_connections.append(connection)
+            connection = None
+    finally:
+        _DB_CONN_IDLE_LOCK.release()
+    if connection is not None:
+        _db_close(connection)
+
+def release_connections():
+    """Give the connections of the current thread to all the database
+    hosts back to the pool.  To be called when the thread is done with
+    the database, e.g. at the end of each web request.  Also resets
+    the count of queries of the thread (see get_thread_run_sql_count()).
+    """
+    for dbhost in _DB_CONN.keys():
+        _db_logout(dbhost)
+    _RUN_SQL_THREAD_COUNT.pop((os.getpid(), get_ident()), None)
 
 def close_connection(dbhost=CFG_DATABASE_HOST):
     """
@@ -150,11 +355,198 @@ def close_connection(dbhost=CFG_DATABASE_HOST):
     Highly relevant in multi-processing and multi-threaded modules
     """
     try:
-        _DB_CONN[dbhost][(os.getpid(), get_ident())].close()
+        _db_close(_DB_CONN[dbhost][(os.getpid(), get_ident())])
         del(_DB_CONN[dbhost][(os.getpid(), get_ident())])
     except KeyError:
         pass
 
+def _db_cursor(connection):
+    """Return the cursor to use to run queries on CONNECTION.  The
+    cursor is created once and then reused by all the queries of the
+    connection.
+    """
+    if CFG_MISCUTIL_SQL_USE_SQLALCHEMY:
+        ## pooled connections are proxies that change at each checkout
+        return connection.cursor()
+    try:
+        return _DB_CURSORS[connection]
+    except KeyError:
+        cursor = _DB_CURSORS[connection] = connection.cursor()
+        return cursor
+
+def _db_forget_cursor(connection):
+    """Drop the reused cursor of CONNECTION, e.g. because it still holds
+    the unread part of a large result.  The next query creates a new one.
+    """
+    try:
+        del _DB_CURSORS[connection]
+    except KeyError:
+        pass
+
+def _db_execute(dbhost, execute):
+    """Call EXECUTE(connection, cursor) with the connection of the
+    current thread to DBHOST and its cursor, and return the tuple
+    (connection, cursor, result of EXECUTE).  If the call fails because
+    the connection turns out to be dead (server gone away, timeout...),
+    reconnect and try once more; if the connection is alive, the error
+    came from the query itself and is raised as is.
+    """
+    db = _db_login(dbhost)
+    cur = _db_cursor(db)
+    try:
+        gc.disable()
+        try:
+            return db, cur, execute(db, cur)
+        finally:
+            gc.enable()
+    except (OperationalError, InterfaceError): # unexpected disconnect, bad malloc error, etc
+        if _db_is_alive(db):
+            raise
+        db = _db_login(dbhost, relogin=1)
+        cur = _db_cursor(db)
+        gc.disable()
+        try:
+            return db, cur, execute(db, cur)
+        finally:
+            gc.enable()
+
+def _db_slave_lag(dbhost):
+    """Return how many seconds the slave DBHOST lags behind the master,
+    sys.maxint if it cannot be reached or its replication is stopped,
+    or None if its lag cannot be read (e.g. SHOW SLAVE STATUS needs the
+    REPLICATION CLIENT privilege).  Checked at most every
+    _DB_SLAVE_LAG_CHECK_INTERVAL seconds.
+    """
+    now = time.time()
+    try:
+        checked, lag = _DB_SLAVE_LAG[dbhost]
+        if now - checked < _DB_SLAVE_LAG_CHECK_INTERVAL:
+            return lag
+    except KeyError:
+        pass
+    lag = None
+    try:
+        _db_login(dbhost)
+    except Error:
+        lag = sys.maxint
+    else:
+        try:
+            dummy_db, cur, dummy = _db_execute(dbhost,
+                lambda db, cur: cur.execute("SHOW SLAVE STATUS"))
+            res = cur.fetchall()
+            if res:
+                columns = [column[0] for column in cur.description]
+                lag = res[0][columns.index('Seconds_Behind_Master')]
+                if lag is None:
+                    ## the replication threads are not running
+                    lag = sys.maxint
+        except (Error, ValueError):
+            lag = None
+    _DB_SLAVE_LAG[dbhost] = (now, lag)
+    return lag
+
+def _db_get_slave():
+    """Return one of the slaves that are not known to lag more than
+    CFG_MISCUTIL_SQL_SLAVE_MAX_LAG seconds behind the master, or the
+    master itself if there is none.  A slave whose lag cannot be read
+    is used anyway, as when the lag was not checked at all.
+    """
+    slaves = []
+    for dbhost in _DB_SLAVES:
+        lag = _db_slave_lag(dbhost)
+        if lag is None or lag <= CFG_MISCUTIL_SQL_SLAVE_MAX_LAG:
+            slaves.append(dbhost)
+    if slaves:
+        return random.choice(slaves)
+    return CFG_DATABASE_HOST
+
+def _db_choose_host(sql, run_on_slave=False):
+    """Return the database host to run SQL on: the master, unless
+    RUN_ON_SLAVE or the current thread routes its queries (see
+    sql_routing_start()) and SQL is read-only, in which case a slave
+    that is not lagging too much.  A web request sticks to the slave it
+    chose, and to the master after its first write.
+    """
+    if not _DB_SLAVES:
+        return CFG_DATABASE_HOST
+    routing = _SQL_ROUTING and _SQL_ROUTING.get((os.getpid(), get_ident()))
+    if routing:
+        if routing['pinned']:
+            return CFG_DATABASE_HOST
+        if not _is_sql_read_only(sql):
+            ## read your writes: no more slaves for this request
+            routing['pinned'] = True
+            return CFG_DATABASE_HOST
+        if _RE_SQL_MASTER_TABLES is not None and \
+               _RE_SQL_MASTER_TABLES.search(sql):
+            return CFG_DATABASE_HOST
+        if routing['slave'] is None:
+            routing['slave'] = _db_get_slave()
+        return routing['slave']
+    if run_on_slave:
+        return _db_get_slave()
+    return CFG_DATABASE_HOST
+
+def sql_routing_start():
+    """Route the read-only queries of the current thread (e.g. serving a
+    web request) to the slaves, until sql_routing_stop(), if
+    CFG_MISCUTIL_SQL_SLAVE_ROUTING is set and there are slaves.  After
+    the first query that is not read-only, all the queries go to the
+    master, so that the thread reads its own writes.  To be called by
+    the web handlers whose pages can be a few seconds out of date, such
+    as search results and collection pages.
+    """
+    if CFG_MISCUTIL_SQL_SLAVE_ROUTING and _DB_SLAVES:
+        _SQL_ROUTING.setdefault((os.getpid(), get_ident()),
+                                {'slave': None, 'pinned': False})
+
+def sql_routing_pin():
+    """Run all the further queries of the current thread on the master,
+    until sql_routing_stop().  Useful before reading data that must be
+    up to date, e.g. written by a previous request.
+    """
+    routing = _SQL_ROUTING.get((os.getpid(), get_ident()))
+    if routing:
+        routing['pinned'] = True
+
+def sql_routing_stop():
+    """Stop routing the read-only queries of the current thread to the
+    slaves (see sql_routing_start()).
+    """
+    try:
+        del _SQL_ROUTING[(os.getpid(), get_ident())]
+    except KeyError:
+        pass
+
+def _is_sql_read_only(sql):
+    """Return True if SQL only reads data and can run on a slave (no
+    locking read, no user variables...).  Cached by query.
+    """
+    try:
+        return _SQL_READ_ONLY[sql]
+    except KeyError:
+        if len(_SQL_READ_ONLY) >= _SQL_STATEMENT_TYPES_MAX:
+            _SQL_READ_ONLY.clear()
+        read_only = _SQL_READ_ONLY[sql] = \
+                    _get_sql_statement_type(sql) in ("SELECT", "SHOW",
+                                                     "DESC", "DESCRIBE") \
+                    and not _RE_SQL_NOT_READ_ONLY.search(sql)
+        return read_only
+
+def _get_sql_statement_type(sql):
+    """Return the type of the SQL statement, i.e. its first word in
+    upper case (SELECT, INSERT...).  Cached by query, since the same
+    queries are run over and over.
+    """
+    try:
+        return _SQL_STATEMENT_TYPES[sql]
+    except KeyError:
+        if len(_SQL_STATEMENT_TYPES) >= _SQL_STATEMENT_TYPES_MAX:
+            _SQL_STATEMENT_TYPES.clear()
+        statement_type = _SQL_STATEMENT_TYPES[sql] = \
+                         string.upper(string.split(sql, None, 1)[0])
+        return statement_type
+
 def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave=False):
     """Run SQL on the server with PARAM and return result.
     @param param: tuple of string params to insert in the query (see
@@ -187,34 +579,34 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
         # do not connect to the database as the site is closed for maintenance:
         return []
 
+    global _RUN_SQL_COUNT, _RUN_SQL_TIME
+    _RUN_SQL_COUNT += 1
+    thread_ident = (os.getpid(), get_ident())
+    _RUN_SQL_THREAD_COUNT[thread_ident] = _RUN_SQL_THREAD_COUNT.get(thread_ident, 0) + 1
+
     if param:
         param = tuple(param)
 
-    dbhost = CFG_DATABASE_HOST
-    if run_on_slave and CFG_DATABASE_SLAVE:
-        dbhost = CFG_DATABASE_SLAVE
+    dbhost = _db_choose_host(sql, run_on_slave)
 
     ### log_sql_query(dbhost, sql, param) ### UNCOMMENT ONLY IF you REALLY want to log all queries
+    start_time = time.time()
     try:
-        db = _db_login(dbhost)
-        cur = db.cursor()
-        gc.disable()
-        rc = cur.execute(sql, param)
-        gc.enable()
-    except (OperationalError, InterfaceError): # unexpected disconnect, bad malloc error, etc
-        # FIXME: now reconnect is always forced, we may perhaps want to ping() first?
-        try:
-            db = _db_login(dbhost, relogin=1)
-            cur = db.cursor()
-            gc.disable()
-            rc = cur.execute(sql, param)
-            gc.enable()
-        except (OperationalError, InterfaceError): # unexpected disconnect, bad malloc error, etc
-            raise
+        db, cur, rc = _db_execute(dbhost,
+                                  lambda db, cur: cur.execute(sql, param))
+    finally:
+        elapsed = time.time() - start_time
+        _RUN_SQL_TIME += elapsed
+        if _SQL_PROFILES or _SQL_SLOW_QUERY_TIME:
+            _sql_trace(dbhost, sql, param, elapsed)
 
-    if string.upper(string.split(sql)[0]) in ("SELECT", "SHOW", "DESC", "DESCRIBE"):
+    statement_type = _get_sql_statement_type(sql)
+    if statement_type in ("SELECT", "SHOW", "DESC", "DESCRIBE"):
         if n:
             recset = cur.fetchmany(n)
+            ## do not keep the rest of the result around in the
+            ## reused cursor
+            _db_forget_cursor(db)
         else:
             recset = cur.fetchall()
 
@@ -234,10 +626,375 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
             else:
                 return recset
     else:
-        if string.upper(string.split(sql)[0]) == "INSERT":
+        if statement_type == "INSERT":
             rc = cur.lastrowid
         return rc
 
+def get_run_sql_count():
+    """Return the number of queries run by run_sql() so far in this
+    process.  Useful to measure how many queries a piece of code
+    triggers, by comparing the value before and after running it.
+    """
+    return _RUN_SQL_COUNT
+
+def get_thread_run_sql_count():
+    """Return the number of queries run by run_sql() so far by the
+    current thread.  Unlike get_run_sql_count(), not affected by the
+    queries that the other threads (e.g. serving other web requests)
+    run in the meantime.
+    """
+    return _RUN_SQL_THREAD_COUNT.get((os.getpid(), get_ident()), 0)
+
+def get_run_sql_time():
+    """Return the time, in seconds, spent by run_sql() executing queries
+    so far in this process (the results are fetched by the execution).
+    """
+    return _RUN_SQL_TIME
+
+def run_sql_iter(sql, param=None, batch_size=CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT,
+                 batches=False, run_on_slave=False):
+    """Run the SELECT query SQL with PARAM like run_sql() does, but
+    return an iterator over the resulting tuples instead of fetching
+    all of them in memory first.  Rows are read from the server on an
+    unbuffered cursor (SSCursor), BATCH_SIZE at a time.  With BATCHES,
+    iterate over the lists of (at most BATCH_SIZE) tuples instead, which
+    is handy to feed e.g. intbitset() a batch at a time.
+
+    Meant for queries returning huge results (e.g. all the records or
+    all the values of a bibXXx table) that can be processed one row at
+    a time.  The query runs on its own connection, so that the caller
+    can run other queries while iterating; the connection goes back to
+    the pool once the iteration is complete.  The query is run when the
+    iteration starts.
+
+    @note: until the iteration is complete, the server keeps the query
+    open, and MyISAM keeps the tables it reads locked for writing: do
+    not modify them while iterating (collect what to change first).
+    """
+    if CFG_ACCESS_CONTROL_LEVEL_SITE == 3:
+        # do not connect to the database as the site is closed for maintenance:
+        return
+
+    global _RUN_SQL_COUNT, _RUN_SQL_TIME
+    _RUN_SQL_COUNT += 1
+    thread_ident = (os.getpid(), get_ident())
+    _RUN_SQL_THREAD_COUNT[thread_ident] = _RUN_SQL_THREAD_COUNT.get(thread_ident, 0) + 1
+
+    if param:
+        param = tuple(param)
+
+    dbhost = _db_choose_host(sql, run_on_slave)
+
+    if CFG_MISCUTIL_SQL_USE_SQLALCHEMY:
+        ## the pool gives the same connection to the whole thread, so
+        ## it cannot be left with an unbuffered query running on it
+        _RUN_SQL_COUNT -= 1
+        _RUN_SQL_THREAD_COUNT[thread_ident] -= 1
+        rows = run_sql(sql, param, run_on_slave=run_on_slave)
+        for i in range(0, len(rows), batch_size):
+            if batches:
+                yield rows[i:i + batch_size]
+            else:
+                for row in rows[i:i + batch_size]:
+                    yield row
+        return
+
+    ### log_sql_query(dbhost, sql, param) ### UNCOMMENT ONLY IF you REALLY want to log all queries
+    db = _db_checkout(dbhost)
+    ## keep no reference to it, so that it is closed if the iteration
+    ## is abandoned
+    _db_forget(db)
+    cur = db.cursor(SSCursor)
+    start_time = time.time()
+    try:
+        try:
+            cur.execute(sql, param)
+        finally:
+            elapsed = time.time() - start_time
+            _RUN_SQL_TIME += elapsed
+            if _SQL_PROFILES or _SQL_SLOW_QUERY_TIME:
+                _sql_trace(dbhost, sql, param, elapsed)
+    except Error:
+        _db_close(db)
+        raise
+
+    ## Note: no try/finally here, in order to keep this generator
+    ## compatible with Python 2.4.  An iteration stopped early leaves
+    ## the connection to the garbage collector, which closes it.
+    try:
+        rows = cur.fetchmany(batch_size)
+        while rows:
+            if batches:
+                yield rows
+            else:
+                for row in rows:
+                    yield row
+            rows = cur.fetchmany(batch_size)
+        cur.close()
+    except (OperationalError, InterfaceError):
+        _db_close(db)
+        raise
+    _db_checkin(dbhost, db)
+
+def run_sql_in(sql, ids, param=None, chunk_size=1000, run_on_slave=False):
+    """Run the query SQL for all the given IDS with a few IN (...)
+    queries instead of one query per id, and return a dictionary
+    {id: [rows]}, where rows are the tuples returned for the id without
+    their first column.  Ids without any row are not in the dictionary.
+
+    SQL must return the id as its first column and contain the marker
+    %(ids)s where the list of ids goes, e.g.:
+
+        run_sql_in("SELECT id_bibrec, id_bibdoc FROM bibrec_bibdoc "
+                   "WHERE id_bibrec IN (%(ids)s) AND type=%s",
+                   recids, ('Main',))
+
+    PARAM holds the other parameters of SQL, in their order in SQL.
+    The ids are sent CHUNK_SIZE at a time, to keep the queries below
+    max_allowed_packet; rows of an id keep the order of SQL.
+    """
+    before, after = sql.split('%(ids)s')
+    nb_param_before = len(re.findall(r'(?<!%)%s', before))
+    if param:
+        param = tuple(param)
+    else:
+        param = ()
+    ids = list(ids)
+    out = {}
+    for i in xrange(0, len(ids), chunk_size):
+        chunk = tuple(ids[i:i + chunk_size])
+        query = before + ','.join(['%s'] * len(chunk)) + after
+        query_param = param[:nb_param_before] + chunk + param[nb_param_before:]
+        for row in run_sql(query, query_param, run_on_slave=run_on_slave):
+            out.setdefault(row[0], []).append(row[1:])
+    return out
+
+def _sql_to_prepared_statement(sql):
+    """Return SQL with the run_sql() style placeholders (%s) replaced by
+    the ones of prepared statements (?), and %% unescaped.
+    """
+    return re.sub(r'%(%|s)',
+                  lambda match: match.group(1) == 's' and '?' or '%', sql)
+
+def _db_execute_prepared(db, cur, sql, param):
+    """Execute the prepared statement of SQL with PARAM on connection DB
+    using cursor CUR, preparing it first if it is not yet prepared on
+    this connection.
+    """
+    statements = _DB_PREPARED.setdefault(db, {})
+    name = statements.get(sql)
+    if name is None:
+        if len(statements) >= _DB_PREPARED_MAX:
+            for old_name in statements.values():
+                cur.execute("DEALLOCATE PREPARE %s" % old_name)
+            statements.clear()
+        name = 'invenio_stmt_%d' % len(statements)
+        cur.execute("PREPARE %s FROM %%s" % name,
+                    (_sql_to_prepared_statement(sql),))
+        statements[sql] = name
+    if param:
+        variables = ["@invenio_param_%d" % i for i in range(len(param))]
+        cur.execute("SET " + ", ".join(["%s=%%s" % variable
+                                        for variable in variables]), param)
+        return cur.execute("EXECUTE %s USING %s" % (name,
+                                                    ", ".join(variables)))
+    return cur.execute("EXECUTE %s" % name)
+
+def run_sql_prepared(sql, param=None, n=0, run_on_slave=False):
+    """Run the SELECT query SQL with PARAM like run_sql() does, but as a
+    server-side prepared statement: MySQL parses and plans the query
+    only once per connection, and then only executes it.  Return the
+    tuples of data.
+
+    MySQLdb does not support the binary protocol, so the statement is
+    prepared with PREPARE and the parameters are passed through user
+    variables, which costs one more round-trip per call.  This is
+    therefore only worth it for complex queries that are run very often
+    with different parameters; use run_sql() for all the other ones.
+    At most _DB_PREPARED_MAX statements are kept per connection.
+    """
+    if CFG_ACCESS_CONTROL_LEVEL_SITE == 3:
+        # do not connect to the database as the site is closed for maintenance:
+        return []
+
+    global _RUN_SQL_COUNT, _RUN_SQL_TIME
+    _RUN_SQL_COUNT += 1
+    thread_ident = (os.getpid(), get_ident())
+    _RUN_SQL_THREAD_COUNT[thread_ident] = _RUN_SQL_THREAD_COUNT.get(thread_ident, 0) + 1
+
+    if param:
+        param = tuple(param)
+
+    dbhost = _db_choose_host(sql, run_on_slave)
+
+    start_time = time.time()
+    try:
+        db, cur, dummy = _db_execute(dbhost,
+            lambda db, cur: _db_execute_prepared(db, cur, sql, param))
+    finally:
+        elapsed = time.time() - start_time
+        _RUN_SQL_TIME += elapsed
+        if _SQL_PROFILES or _SQL_SLOW_QUERY_TIME:
+            _sql_trace(dbhost, sql, param, elapsed)
+
+    if n:
+        recset = cur.fetchmany(n)
+        _db_forget_cursor(db)
+    else:
+        recset = cur.fetchall()
+    return recset
+
+def set_sql_profiling(enabled=True):
+    """Enable or disable, in this process, the collection of the query
+    profiles of web requests and tasks (defaults to
+    CFG_MISCUTIL_SQL_PROFILE).
+    """
+    global _SQL_PROFILING
+    _SQL_PROFILING = bool(enabled)
+
+def is_sql_profiling_enabled():
+    """Return True if web requests and tasks should collect the profile
+    of their queries (see set_sql_profiling()).
+    """
+    return _SQL_PROFILING
+
+def set_sql_slow_query_threshold(milliseconds):
+    """Log, in this process, the queries that take more than MILLISECONDS
+    (defaults to CFG_MISCUTIL_SQL_SLOW_QUERY_THRESHOLD, 0 to log none).
+    """
+    global _SQL_SLOW_QUERY_TIME
+    _SQL_SLOW_QUERY_TIME = milliseconds / 1000.0
+
+def check_sql_profiling_flag():
+    """Enable or disable the query profiling of this process depending
+    on the flag file prefix/var/tmp-shared/dbquery-profile.flag, so
+    that it can be switched on without restarting the web processes.
+    While the file exists, the profiles of the web requests are logged;
+    if it contains a number, the queries slower than this number of
+    milliseconds are logged too.  Once the file is removed,
+    CFG_MISCUTIL_SQL_PROFILE and CFG_MISCUTIL_SQL_SLOW_QUERY_THRESHOLD
+    apply again.  Costs a stat() only, so that it can be called at the
+    beginning of every web request.
+    """
+    global _SQL_PROFILING_FLAG_MTIME
+    try:
+        mtime = os.stat(_SQL_PROFILING_FLAG_FILE).st_mtime
+    except OSError:
+        mtime = None
+    if mtime == _SQL_PROFILING_FLAG_MTIME:
+        return
+    _SQL_PROFILING_FLAG_MTIME = mtime
+    if mtime is None:
+        set_sql_profiling(CFG_MISCUTIL_SQL_PROFILE)
+        set_sql_slow_query_threshold(CFG_MISCUTIL_SQL_SLOW_QUERY_THRESHOLD)
+        return
+    set_sql_profiling(True)
+    try:
+        threshold = open(_SQL_PROFILING_FLAG_FILE).read().strip()
+    except IOError:
+        threshold = ''
+    if threshold.isdigit():
+        set_sql_slow_query_threshold(int(threshold))
+    else:
+        set_sql_slow_query_threshold(CFG_MISCUTIL_SQL_SLOW_QUERY_THRESHOLD)
+
+def sql_profile_start():
+    """Start collecting the profile of the queries run by the current
+    thread: number of queries, time spent, and for each normalized
+    statement its count, time and the place of the first call, so that
+    a statement run over and over (N+1 queries) stands out.  Any profile
+    already being collected by the thread is discarded.
+    """
+    _SQL_PROFILES[(os.getpid(), get_ident())] = {'count': 0,
+                                                 'time': 0.0,
+                                                 'statements': {},
+                                                 'slow': []}
+
+def sql_profile_stop():
+    """Stop collecting the profile of the queries of the current thread
+    and return it (see sql_profile_start()), or None if none was being
+    collected.
+    """
+    return _SQL_PROFILES.pop((os.getpid(), get_ident()), None)
+
+def normalize_sql(sql):
+    """Return SQL with its literal values and parameters replaced by ?
+    and its whitespace collapsed, so that the queries differing only by
+    their values compare equal.
+    """
+    for regexp, replacement in _RE_SQL_NORMALIZE:
+        sql = regexp.sub(replacement, sql)
+    return sql.strip()
+
+def _sql_call_site():
+    """Return the file:line (function) of the code that called dbquery."""
+    frame = sys._getframe(1)
+    while frame is not None and \
+              os.path.basename(frame.f_code.co_filename).startswith('dbquery'):
+        frame = frame.f_back
+    if frame is None:
+        return '?'
+    return '%s:%d (%s)' % (frame.f_code.co_filename, frame.f_lineno,
+                           frame.f_code.co_name)
+
+def _sql_trace(dbhost, sql, param, elapsed):
+    """Account for the query SQL with PARAM that took ELAPSED seconds in
+    the profile of the current thread, and log it if it is slow.
+    """
+    slow = _SQL_SLOW_QUERY_TIME and elapsed >= _SQL_SLOW_QUERY_TIME
+    if slow:
+        stack = ''.join(traceback.format_stack(sys._getframe(2)))
+        log_sql_query(dbhost, sql, param, elapsed=elapsed, stack=stack,
+                      log_name='dbquery-slow.log')
+    profile = _SQL_PROFILES.get((os.getpid(), get_ident()))
+    if profile is None:
+        return
+    profile['count'] += 1
+    profile['time'] += elapsed
+    statement = normalize_sql(sql)
+    try:
+        stats = profile['statements'][statement]
+        stats[0] += 1
+        stats[1] += elapsed
+    except KeyError:
+        profile['statements'][statement] = [1, elapsed, _sql_call_site()]
+    if slow and len(profile['slow']) < _SQL_PROFILE_SLOW_MAX:
+        profile['slow'].append((elapsed, sql, param, _sql_call_site()))
+
+def format_sql_profile(profile, limit=10):
+    """Return a human readable summary of the query PROFILE (see
+    sql_profile_stop()): totals, the LIMIT statements that took the
+    most time and the slow queries.
+    """
+    out = ["%d queries in %.3f s, %d distinct statements" % \
+           (profile['count'], profile['time'], len(profile['statements']))]
+    statements = [(stats[1], stats[0], statement, stats[2]) for \
+                  statement, stats in profile['statements'].items()]
+    statements.sort()
+    statements.reverse()
+    for elapsed, count, statement, call_site in statements[:limit]:
+        out.append("  %6d x %8.3f s  %s\n                     first from %s" % \
+                   (count, elapsed, statement[:200], call_site))
+    for elapsed, sql, param, call_site in profile['slow']:
+        out.append("  slow query: %.3f s  %s %r\n                     from %s" % \
+                   (elapsed, normalize_sql(sql)[:200], param, call_site))
+    return '\n'.join(out)
+
+def log_sql_profile(profile, title=''):
+    """Append the summary of the query PROFILE (see format_sql_profile())
+    to prefix/var/log/dbquery-profile.log, preceded by TITLE (e.g. the
+    URL of the web request).
+    """
+    from invenio.config import CFG_LOGDIR
+    message = "%s %s\n%s\n\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), title,
+                                  format_sql_profile(profile))
+    try:
+        log_file = open(CFG_LOGDIR + '/dbquery-profile.log', 'a')
+        log_file.write(message)
+        log_file.close()
+    except IOError:
+        pass
+
 def run_sql_many(query, params, limit=CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, run_on_slave=False):
     """Run SQL on the server with PARAM.
     This method does executemany and is therefore more efficient than execute
@@ -252,28 +1009,18 @@ def run_sql_many(query, params, limit=CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, run_o
 
     @return: SQL result as provided by database
     """
-    dbhost = CFG_DATABASE_HOST
-    if run_on_slave and CFG_DATABASE_SLAVE:
-        dbhost = CFG_DATABASE_SLAVE
+    dbhost = _db_choose_host(query, run_on_slave)
     i = 0
     r = None
     while i < len(params):
         ## make partial query safely (mimicking procedure from run_sql())
+        start_time = time.time()
         try:
-            db = _db_login(dbhost)
-            cur = db.cursor()
-            gc.disable()
-            rc = cur.executemany(query, params[i:i + limit])
-            gc.enable()
-        except (OperationalError, InterfaceError):
-            try:
-                db = _db_login(dbhost, relogin=1)
-                cur = db.cursor()
-                gc.disable()
-                rc = cur.executemany(query, params[i:i + limit])
-                gc.enable()
-            except (OperationalError, InterfaceError):
-                raise
+            dummy_db, dummy_cur, rc = _db_execute(dbhost,
+                lambda db, cur: cur.executemany(query, params[i:i + limit]))
+        finally:
+            if _SQL_PROFILES or _SQL_SLOW_QUERY_TIME:
+                _sql_trace(dbhost, query, params[i], time.time() - start_time)
         ## collect its result:
         if r is None:
             r = rc
@@ -315,20 +1062,28 @@ def blob_to_string(ablob):
     else:
         return ablob
 
-def log_sql_query(dbhost, sql, param=None):
+def log_sql_query(dbhost, sql, param=None, elapsed=None, stack=None,
+                  log_name='dbquery.log'):
     """Log SQL query into prefix/var/log/dbquery.log log file.  In order
        to enable logging of all SQL queries, please uncomment one line
        in run_sql() above. Useful for fine-level debugging only!
+       Slow queries are logged into dbquery-slow.log (see LOG_NAME)
+       together with their duration in seconds (ELAPSED) and the
+       Python STACK that ran them.
     """
     from invenio.config import CFG_LOGDIR
     from invenio.dateutils import convert_datestruct_to_datetext
     from invenio.textutils import indent_text
-    log_path = CFG_LOGDIR + '/dbquery.log'
+    log_path = CFG_LOGDIR + '/' + log_name
     date_of_log = convert_datestruct_to_datetext(time.localtime())
     message = date_of_log + '-->\n'
     message += indent_text('Host:\n' + indent_text(str(dbhost), 2, wrap=True), 2)
     message += indent_text('Query:\n' + indent_text(str(sql), 2, wrap=True), 2)
     message += indent_text('Params:\n' + indent_text(str(param), 2, wrap=True), 2)
+    if elapsed is not None:
+        message += indent_text('Time:\n' + indent_text('%.3f s' % elapsed, 2), 2)
+    if stack:
+        message += indent_text('Stack:\n' + indent_text(stack, 2), 2)
     message += '-----------------------------\n\n'
     try:
         log_file = open(log_path, 'a+')
@@ -434,8 +1189,8 @@ def real_escape_string(unescaped_string, run_on_slave=False):
     @rtype: str
     """
     dbhost = CFG_DATABASE_HOST
-    if run_on_slave and CFG_DATABASE_SLAVE:
-        dbhost = CFG_DATABASE_SLAVE
+    if run_on_slave:
+        dbhost = _db_get_slave()
     connection_object = _db_login(dbhost)
     escaped_string = connection_object.escape_string(unescaped_string)
     return escaped_string
@@ -21,6 +21,10 @@
 
 __revision__ = "$Id$"
 
+import os
+import sys
+import tempfile
+import threading
 import unittest
 
 from invenio import dbquery
@@ -102,8 +106,192 @@ class WashTableColumnNameTest(unittest.TestCase):
         self.assertEqual(dbquery.real_escape_string(testcase_ok), testcase_ok)
         self.assertNotEqual(dbquery.real_escape_string(testcase_injection), testcase_injection)
 
+class ConnectionPoolTest(unittest.TestCase):
+    """Test the reuse of connections, cursors and statements."""
 
-TEST_SUITE = make_test_suite(TableUpdateTimesTest, WashTableColumnNameTest)
+    def test_released_connection_is_reused(self):
+        """dbquery - released connection is reused by the next query"""
+        dbquery.run_sql("SELECT 1")
+        connection = dbquery._db_login()
+        dbquery.release_connections()
+        dbquery.run_sql("SELECT 1")
+        self.assertEqual(connection, dbquery._db_login())
+
+    def test_cursor_is_reused(self):
+        """dbquery - cursor is reused by the queries of a connection"""
+        connection = dbquery._db_login()
+        self.assertEqual(dbquery._db_cursor(connection),
+                         dbquery._db_cursor(connection))
+
+    def test_relogin_replaces_connection(self):
+        """dbquery - relogin gives a new working connection"""
+        connection = dbquery._db_login()
+        self.assertNotEqual(connection, dbquery._db_login(relogin=1))
+        self.assertEqual(dbquery.run_sql("SELECT 1"), ((1L,),))
+
+    def test_statement_type(self):
+        """dbquery - statement type detection"""
+        self.assertEqual(dbquery._get_sql_statement_type("select 1"), "SELECT")
+        self.assertEqual(dbquery._get_sql_statement_type(
+            "\n  INSERT INTO foo VALUES (1)"), "INSERT")
+
+    def test_prepared_statement_placeholders(self):
+        """dbquery - placeholders of prepared statements"""
+        self.assertEqual(dbquery._sql_to_prepared_statement(
+            "SELECT id FROM bib WHERE tag LIKE '10%%' AND value=%s"),
+            "SELECT id FROM bib WHERE tag LIKE '10%' AND value=?")
+
+    def test_run_sql_prepared(self):
+        """dbquery - prepared statement gives the same result as run_sql"""
+        query = "SELECT id, name FROM collection WHERE id>=%s ORDER BY id"
+        for param in ((1,), (2,), (1,)):
+            self.assertEqual(dbquery.run_sql_prepared(query, param),
+                             dbquery.run_sql(query, param))
+
+class RunSqlIterTest(unittest.TestCase):
+    """Test the streaming of query results."""
+
+    def test_run_sql_iter_rows(self):
+        """dbquery - streamed rows are the ones of run_sql"""
+        query = "SELECT id, name FROM collection WHERE id>=%s ORDER BY id"
+        self.assertEqual(tuple(dbquery.run_sql_iter(query, (1,), batch_size=2)),
+                         dbquery.run_sql(query, (1,)))
+
+    def test_run_sql_iter_batches(self):
+        """dbquery - streamed batches hold at most batch_size rows"""
+        query = "SELECT id FROM collection ORDER BY id"
+        batches = list(dbquery.run_sql_iter(query, batch_size=2, batches=True))
+        self.assertEqual([len(batch) for batch in batches if len(batch) > 2], [])
+        self.assertEqual(tuple([row for batch in batches for row in batch]),
+                         dbquery.run_sql(query))
+
+    def test_run_sql_while_iterating(self):
+        """dbquery - other queries can run while iterating"""
+        for (dummy_id,) in dbquery.run_sql_iter("SELECT id FROM collection"):
+            self.assertEqual(dbquery.run_sql("SELECT 1"), ((1L,),))
+
+class SqlProfileTest(unittest.TestCase):
+    """Test the instrumentation of queries."""
+
+    def test_normalize_sql(self):
+        """dbquery - normalization of statements"""
+        self.assertEqual(dbquery.normalize_sql("""SELECT id FROM bib10x
+                    WHERE tag='100__a' AND id IN (1, 2,3) AND value=%s"""),
+                    "SELECT id FROM bib10x WHERE tag=? AND id IN (...) AND value=?")
+
+    def test_sql_profile(self):
+        """dbquery - profile of the queries of a thread"""
+        self.assertEqual(dbquery.sql_profile_stop(), None)
+        dbquery.sql_profile_start()
+        for collid in (1, 2, 3):
+            dbquery.run_sql("SELECT name FROM collection WHERE id=%s", (collid,))
+        dbquery.run_sql("SELECT 1")
+        profile = dbquery.sql_profile_stop()
+        self.assertEqual(profile['count'], 4)
+        self.assertEqual(profile['statements']['SELECT name FROM collection WHERE id=?'][0], 3)
+        self.assert_(__file__.rstrip('c') in profile['statements']['SELECT ?'][2])
+        self.assert_('SELECT name FROM collection' in dbquery.format_sql_profile(profile))
+        self.assertEqual(dbquery.sql_profile_stop(), None)
+
+    def test_profiling_flag_file(self):
+        """dbquery - profiling switched on and off by the flag file"""
+        saved_flag_file = dbquery._SQL_PROFILING_FLAG_FILE
+        saved_profiling = dbquery.is_sql_profiling_enabled()
+        saved_slow_query_time = dbquery._SQL_SLOW_QUERY_TIME
+        fd, flag_file = tempfile.mkstemp()
+        os.write(fd, "250\n")
+        os.close(fd)
+        dbquery._SQL_PROFILING_FLAG_FILE = flag_file
+        try:
+            dbquery.check_sql_profiling_flag()
+            self.assert_(dbquery.is_sql_profiling_enabled())
+            self.assertEqual(dbquery._SQL_SLOW_QUERY_TIME, 0.25)
+            os.remove(flag_file)
+            dbquery.check_sql_profiling_flag()
+            self.assertEqual(dbquery.is_sql_profiling_enabled(),
+                             bool(dbquery.CFG_MISCUTIL_SQL_PROFILE))
+        finally:
+            dbquery._SQL_PROFILING_FLAG_FILE = saved_flag_file
+            dbquery._SQL_PROFILING_FLAG_MTIME = None
+            dbquery.set_sql_profiling(saved_profiling)
+            dbquery._SQL_SLOW_QUERY_TIME = saved_slow_query_time
+
+    def test_thread_run_sql_count(self):
+        """dbquery - number of queries run by the current thread"""
+        count = dbquery.get_thread_run_sql_count()
+        thread = threading.Thread(target=dbquery.run_sql, args=("SELECT 1",))
+        thread.start()
+        thread.join()
+        self.assertEqual(dbquery.get_thread_run_sql_count(), count)
+        dbquery.run_sql("SELECT 1")
+        self.assertEqual(dbquery.get_thread_run_sql_count(), count + 1)
+
+class RunSqlInTest(unittest.TestCase):
+    """Test the bulk IN (...) lookups."""
+
+    def test_run_sql_in(self):
+        """dbquery - bulk lookup gives the rows of every id"""
+        ids = [row[0] for row in dbquery.run_sql("SELECT id FROM collection")]
+        res = dbquery.run_sql_in("SELECT id, name FROM collection "
+                                 "WHERE id IN (%(ids)s) AND id>=%s ORDER BY id",
+                                 ids + [-1], (1,), chunk_size=2)
+        self.assertEqual(sorted(res.keys()), sorted(ids))
+        for colid in ids:
+            self.assertEqual(res[colid],
+                             [dbquery.run_sql("SELECT name FROM collection "
+                                              "WHERE id=%s", (colid,))[0]])
+
+    def test_run_sql_in_query_count(self):
+        """dbquery - bulk lookup runs one query per chunk"""
+        count = dbquery.get_run_sql_count()
+        dbquery.run_sql_in("SELECT id FROM collection WHERE id IN (%(ids)s)",
+                           range(1, 11), chunk_size=4)
+        self.assertEqual(dbquery.get_run_sql_count() - count, 3)
+        self.assertEqual(dbquery.run_sql_in("SELECT id FROM collection "
+                                            "WHERE id IN (%(ids)s)", []), {})
+
+class SqlRoutingTest(unittest.TestCase):
+    """Test the routing of queries to the DB slaves."""
+
+    def test_read_only_queries(self):
+        """dbquery - detection of the queries that can run on slaves"""
+        self.failUnless(dbquery._is_sql_read_only("SELECT id FROM bibrec WHERE id=%s"))
+        self.failUnless(dbquery._is_sql_read_only("show tables"))
+        self.failIf(dbquery._is_sql_read_only("INSERT INTO foo VALUES (1)"))
+        self.failIf(dbquery._is_sql_read_only("SELECT id FROM bibrec FOR UPDATE"))
+        self.failIf(dbquery._is_sql_read_only("SELECT GET_LOCK('bibupload', 5)"))
+        self.failIf(dbquery._is_sql_read_only("SELECT LAST_INSERT_ID()"))
+        self.failIf(dbquery._is_sql_read_only("SELECT @rank:=@rank+1 FROM bibrec"))
+
+    def test_no_routing_without_slaves(self):
+        """dbquery - queries stay on the master without slaves"""
+        if dbquery._DB_SLAVES:
+            return
+        dbquery.sql_routing_start()
+        try:
+            self.assertEqual(dbquery._db_choose_host("SELECT 1", True),
+                             dbquery.CFG_DATABASE_HOST)
+        finally:
+            dbquery.sql_routing_stop()
+
+    def test_slave_choice_by_lag(self):
+        """dbquery - slaves are skipped only when known to lag"""
+        old_slaves, old_slave_lag = dbquery._DB_SLAVES, dbquery._db_slave_lag
+        lags = {'slave1': None, 'slave2': sys.maxint}
+        dbquery._DB_SLAVES = ['slave1', 'slave2']
+        dbquery._db_slave_lag = lags.get
+        try:
+            ## the lag of slave1 cannot be read: use it anyway
+            self.assertEqual('slave1', dbquery._db_get_slave())
+            lags['slave1'] = dbquery.CFG_MISCUTIL_SQL_SLAVE_MAX_LAG + 1
+            self.assertEqual(dbquery.CFG_DATABASE_HOST, dbquery._db_get_slave())
+        finally:
+            dbquery._DB_SLAVES = old_slaves
+            dbquery._db_slave_lag = old_slave_lag
+
+TEST_SUITE = make_test_suite(TableUpdateTimesTest, WashTableColumnNameTest,
+                             ConnectionPoolTest, RunSqlIterTest, SqlProfileTest,
+                             RunSqlInTest, SqlRoutingTest)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
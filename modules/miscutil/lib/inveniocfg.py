@@ -48,6 +48,7 @@ Options to update config files in situ:
    --update-dbquery-py      update dbquery.py with DB credentials from invenio.conf
    --update-dbexec          update dbexec with DB credentials from invenio.conf
    --update-bibconvert-tpl  update bibconvert templates with CFG_SITE_URL from invenio.conf
+   --update-bibformat-cache preload format elements and save their import cost to the BibFormat cache
    --update-web-tests       update web test cases with CFG_SITE_URL from invenio.conf
 
 Options to update DB tables:
@@ -167,6 +168,8 @@ Please, update your invenio-local.conf file accordingly.""" % (option_name, new_
                        'CFG_WEBCOMMENT_ROUND_DATAFIELD',
                        'CFG_BIBUPLOAD_FFT_ALLOWED_EXTERNAL_URLS',
                        'CFG_BIBSCHED_NODE_TASKS',
+                       'CFG_BIBSCHED_NODE_RESOURCES',
+                       'CFG_BIBSCHED_TASK_RESOURCES',
                        'CFG_BIBEDIT_EXTEND_RECORD_WITH_COLLECTION_TEMPLATE',
                        'CFG_OAI_METADATA_FORMATS',
                        'CFG_BIBDOCFILE_DESIRED_CONVERSIONS',
@@ -420,6 +423,19 @@ def cli_cmd_update_bibconvert_tpl(conf):
             fdesc.close()
     print ">>> bibconvert templates updated successfully."
 
+def cli_cmd_update_bibformat_cache(conf):
+    """
+    Import all the format elements and load all the output formats and
+    format templates, save the attributes of the format elements to
+    the BibFormat cache file, and print how long it took.
+    """
+    from invenio.bibformat_engine import preload_caches, \
+         format_preload_report
+    print ">>> Going to update BibFormat cache..."
+    report = preload_caches(save_to_file=True, verbose=5)
+    print format_preload_report(report)
+    print ">>> BibFormat cache updated successfully."
+
 def cli_cmd_update_web_tests(conf):
     """
     Update web test cases lib/webtest/test_*.html looking for
@@ -1422,6 +1438,7 @@ def prepare_option_parser():
     config_options.add_option("", "--update-dbquery-py", dest='actions', const='update-dbquery-py', action="append_const", help="update dbquery.py with DB credentials from invenio.conf")
     config_options.add_option("", "--update-dbexec", dest='actions', const='update-dbexec', action="append_const", help="update dbexec with DB credentials from invenio.conf")
     config_options.add_option("", "--update-bibconvert-tpl", dest='actions', const='update-bibconvert-tpl', action="append_const", help="update bibconvert templates with CFG_SITE_URL from invenio.conf")
+    config_options.add_option("", "--update-bibformat-cache", dest='actions', const='update-bibformat-cache', action="append_const", help="preload format elements and save their attributes and import cost to the BibFormat cache")
     config_options.add_option("", "--update-web-tests", dest='actions', const='update-web-tests', action="append_const", help="update web test cases with CFG_SITE_URL from invenio.conf")
     parser.add_option_group(config_options)
 
@@ -1553,6 +1570,8 @@ def main(*cmd_args):
                 cli_cmd_update_dbexec(conf)
             elif action == 'update-bibconvert-tpl':
                 cli_cmd_update_bibconvert_tpl(conf)
+            elif action == 'update-bibformat-cache':
+                cli_cmd_update_bibformat_cache(conf)
             elif action == 'update-web-tests':
                 cli_cmd_update_web_tests(conf)
             elif action == 'reset-all':
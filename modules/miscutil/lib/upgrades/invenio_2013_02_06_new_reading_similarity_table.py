@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+from invenio.dbquery import run_sql
+
+depends_on = ['invenio_release_1_1_0']
+
+def info():
+    return "New reading similarity table, client host indexes on page views and downloads"
+
+def do_upgrade():
+    run_sql("""
+CREATE TABLE IF NOT EXISTS rnkREADINGSIMILARITY (
+  id_bibrec mediumint(8) unsigned NOT NULL,
+  type enum('pageviews','downloads') NOT NULL default 'pageviews',
+  cooccurrences longblob,
+  similarlist blob,
+  PRIMARY KEY  (id_bibrec,type)
+) ENGINE=MyISAM;
+""")
+    for table in ('rnkPAGEVIEWS', 'rnkDOWNLOADS'):
+        if not run_sql("SHOW INDEX FROM %s WHERE Key_name='client_host'" % table):
+            run_sql("ALTER TABLE %s ADD KEY client_host (client_host)" % table)
+
+def estimate():
+    """  Estimate running time of upgrade in seconds (optional). """
+    count = run_sql("SELECT COUNT(*) FROM rnkPAGEVIEWS")[0][0] + \
+            run_sql("SELECT COUNT(*) FROM rnkDOWNLOADS")[0][0]
+    return max(1, count / 100000)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2013 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+from invenio.dbquery import run_sql
+
+depends_on = ['invenio_release_1_1_0']
+
+def info():
+    return "New table to store the performance metrics of the tasks"
+
+def do_upgrade():
+    run_sql("""
+CREATE TABLE IF NOT EXISTS hstTASKMETRICS (
+  id int(15) unsigned NOT NULL auto_increment,
+  id_task int(15) unsigned NOT NULL,
+  proc varchar(255) NOT NULL,
+  phase varchar(255) NOT NULL default '',
+  started datetime NOT NULL,
+  wall_time double NOT NULL default '0',
+  cpu_time double NOT NULL default '0',
+  max_rss int(15) unsigned NOT NULL default '0',
+  sql_count int(15) unsigned NOT NULL default '0',
+  sql_time double NOT NULL default '0',
+  records int(15) unsigned NOT NULL default '0',
+  PRIMARY KEY (id),
+  KEY id_task (id_task),
+  KEY proc (proc, started),
+  KEY phase (phase, started)
+) ENGINE=MyISAM;
+""")
+
+def estimate():
+    """  Estimate running time of upgrade in seconds (optional). """
+    return 1
@@ -317,8 +317,11 @@ TRUNCATE rnkEXTENDEDAUTHORS;
 TRUNCATE rnkSELFCITES;
 TRUNCATE rnkDOWNLOADS;
 TRUNCATE rnkPAGEVIEWS;
+TRUNCATE rnkREADINGSIMILARITY;
 TRUNCATE rnkWORD01F;
 TRUNCATE rnkWORD01R;
+TRUNCATE rnkWORD01S;
+TRUNCATE oaiREPOSITORYSETCACHE;
 TRUNCATE bibdoc;
 TRUNCATE bibrec_bibdoc;
 TRUNCATE bibdoc_bibdoc;
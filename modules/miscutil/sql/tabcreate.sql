@@ -2626,6 +2626,12 @@ CREATE TABLE IF NOT EXISTS rnkWORD01R (
   PRIMARY KEY  (id_bibrec,type)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS rnkWORD01S (
+  id_bibrec mediumint(9) unsigned NOT NULL,
+  similarlist longblob,
+  PRIMARY KEY  (id_bibrec)
+) ENGINE=MyISAM;
+
 CREATE TABLE IF NOT EXISTS rnkAUTHORDATA (
   aterm varchar(50) default NULL,
   hitlist longblob,
@@ -2638,7 +2644,8 @@ CREATE TABLE IF NOT EXISTS rnkPAGEVIEWS (
   client_host int(10) unsigned default NULL,
   view_time datetime default '0000-00-00 00:00:00',
   KEY view_time (view_time),
-  KEY id_bibrec (id_bibrec)
+  KEY id_bibrec (id_bibrec),
+  KEY client_host (client_host)
 ) ENGINE=MyISAM;
 
 CREATE TABLE IF NOT EXISTS rnkDOWNLOADS (
@@ -2650,7 +2657,16 @@ CREATE TABLE IF NOT EXISTS rnkDOWNLOADS (
   file_version smallint(2) unsigned default NULL,
   file_format varchar(10) NULL default NULL,
   KEY download_time (download_time),
-  KEY id_bibrec (id_bibrec)
+  KEY id_bibrec (id_bibrec),
+  KEY client_host (client_host)
+) ENGINE=MyISAM;
+
+CREATE TABLE IF NOT EXISTS rnkREADINGSIMILARITY (
+  id_bibrec mediumint(8) unsigned NOT NULL,
+  type enum('pageviews','downloads') NOT NULL default 'pageviews',
+  cooccurrences longblob,
+  similarlist blob,
+  PRIMARY KEY  (id_bibrec,type)
 ) ENGINE=MyISAM;
 
 -- a table for citations. record-cites-record
@@ -2758,6 +2774,14 @@ CREATE TABLE IF NOT EXISTS oaiREPOSITORY (
   PRIMARY KEY (id)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS oaiREPOSITORYSETCACHE (
+  setSpec varchar(255) NOT NULL default '',
+  recids longblob,
+  dateindex longblob,
+  last_updated datetime NOT NULL default '0000-00-00',
+  PRIMARY KEY (setSpec)
+) ENGINE=MyISAM;
+
 CREATE TABLE IF NOT EXISTS oaiHARVEST (
   id mediumint(9) unsigned NOT NULL auto_increment,
   baseurl varchar(255) NOT NULL default '',
@@ -3632,6 +3656,36 @@ CREATE TABLE IF NOT EXISTS hstTASK (
   KEY sequenceid (sequenceid)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS hstTASKMETRICS (
+  id int(15) unsigned NOT NULL auto_increment,
+  id_task int(15) unsigned NOT NULL,
+  proc varchar(255) NOT NULL,
+  phase varchar(255) NOT NULL default '',
+  started datetime NOT NULL,
+  wall_time double NOT NULL default '0',
+  cpu_time double NOT NULL default '0',
+  max_rss int(15) unsigned NOT NULL default '0',
+  sql_count int(15) unsigned NOT NULL default '0',
+  sql_time double NOT NULL default '0',
+  records int(15) unsigned NOT NULL default '0',
+  PRIMARY KEY (id),
+  KEY id_task (id_task),
+  KEY proc (proc, started),
+  KEY phase (phase, started)
+) ENGINE=MyISAM;
+
+CREATE TABLE IF NOT EXISTS schTASKCHUNK (
+  id_task int(15) unsigned NOT NULL,
+  chunk int(15) unsigned NOT NULL,
+  id_chunk_task int(15) unsigned NOT NULL default '0',
+  attempts int(15) unsigned NOT NULL default '0',
+  status varchar(50) NOT NULL default 'WAITING',
+  recids longblob,
+  result longblob,
+  PRIMARY KEY (id_task, chunk),
+  KEY id_chunk_task (id_chunk_task)
+) ENGINE=MyISAM;
+
 -- Batch Upload History
 
 CREATE TABLE IF NOT EXISTS hstBATCHUPLOAD (
@@ -335,8 +335,10 @@ DROP TABLE IF EXISTS rnkMETHODNAME;
 DROP TABLE IF EXISTS rnkMETHODDATA;
 DROP TABLE IF EXISTS rnkWORD01F;
 DROP TABLE IF EXISTS rnkWORD01R;
+DROP TABLE IF EXISTS rnkWORD01S;
 DROP TABLE IF EXISTS rnkPAGEVIEWS;
 DROP TABLE IF EXISTS rnkDOWNLOADS;
+DROP TABLE IF EXISTS rnkREADINGSIMILARITY;
 DROP TABLE IF EXISTS rnkCITATIONDATA;
 DROP TABLE IF EXISTS rnkCITATIONDATAEXT;
 DROP TABLE IF EXISTS rnkCITATIONDATAERR;
@@ -348,6 +350,7 @@ DROP TABLE IF EXISTS collection_rnkMETHOD;
 DROP TABLE IF EXISTS collection;
 DROP TABLE IF EXISTS collectionname;
 DROP TABLE IF EXISTS oaiREPOSITORY;
+DROP TABLE IF EXISTS oaiREPOSITORYSETCACHE;
 DROP TABLE IF EXISTS oaiHARVEST;
 DROP TABLE IF EXISTS oaiHARVESTLOG;
 DROP TABLE IF EXISTS bibHOLDINGPEN;
@@ -412,6 +415,7 @@ DROP TABLE IF EXISTS sbmPUBLICATIONDATA;
 DROP TABLE IF EXISTS sbmREFEREES;
 DROP TABLE IF EXISTS sbmSUBMISSIONS;
 DROP TABLE IF EXISTS schTASK;
+DROP TABLE IF EXISTS schTASKCHUNK;
 DROP TABLE IF EXISTS bibdoc;
 DROP TABLE IF EXISTS bibdoc_bibdoc;
 DROP TABLE IF EXISTS bibdocmoreinfo;
@@ -442,6 +446,7 @@ DROP TABLE IF EXISTS jrnISSUE;
 DROP TABLE IF EXISTS hstRECORD;
 DROP TABLE IF EXISTS hstDOCUMENT;
 DROP TABLE IF EXISTS hstTASK;
+DROP TABLE IF EXISTS hstTASKMETRICS;
 DROP TABLE IF EXISTS hstBATCHUPLOAD;
 DROP TABLE IF EXISTS crcBORROWER;
 DROP TABLE IF EXISTS crcILLREQUEST;
@@ -26,3 +26,12 @@ CFG_OAI_REPOSITORY_MARCXML_SIZE = 100
 ## Makefile.am and tabcreate.sql defaults for setSpec column in
 ## oaiREPOSITORY MySQL table.
 CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC = "GLOBAL_SET"
+
+## Maximum number of sorted recid lists kept in memory by each process
+## to serve resumed ListRecords/ListIdentifiers requests
+CFG_OAI_REPOSITORY_RECID_LIST_CACHE_SIZE = 10
+
+## Maximum number of records modified since the OAI set memberships
+## were precomputed by oairepositoryupdater that are checked one by
+## one; beyond this the sets are computed again from the metadata
+CFG_OAI_REPOSITORY_SET_CACHE_MAX_DELTA = 10000
@@ -32,7 +32,7 @@ from invenio.config import CFG_SITE_URL, \
      CFG_OAI_LOAD, \
      CFG_OAI_ID_FIELD
 from invenio.intbitset import intbitset
-from invenio import oai_repository_server, search_engine
+from invenio import oai_repository_server, oai_repository_updater, search_engine
 from invenio.testutils import make_test_suite, run_test_suite, \
                               test_web_page_content, merge_error_messages
 
@@ -141,6 +141,19 @@ class TestSelectiveHarvesting(unittest.TestCase):
 
         self.assert_('badResumptionToken' in req.getvalue())
 
+class TestSetCache(unittest.TestCase):
+    """Test the set memberships precomputed by oairepositoryupdater."""
+
+    def test_set_cache(self):
+        """oairepository - precomputed set memberships match the metadata"""
+        oai_repository_updater.update_oai_set_cache()
+        for set_spec in ("", "cern:experiment", "cern:theory"):
+            set_cache = oai_repository_server.get_oai_set_cache(set_spec)
+            self.assertNotEqual(None, set_cache)
+            for fromdate, untildate in (("", ""), ("2000-01-01", ""), ("", "2000-01-01"), ("2000-01-01", "2037-12-31")):
+                self.assertEqual(oai_repository_server.filter_out_based_on_date_range(oai_repository_server.oai_compute_set_recids(set_spec), fromdate, untildate),
+                                 oai_repository_server.oai_get_recid_list_from_set_cache(set_cache, set_spec, fromdate, untildate))
+
 class TestPerformance(unittest.TestCase):
     """Test performance of the repository """
 
@@ -180,6 +193,7 @@ Limit: %s seconds""" % (t, self.number_of_records * allowed_seconds_per_record_m
 
 TEST_SUITE = make_test_suite(OAIRepositoryWebPagesAvailabilityTest,
                              TestSelectiveHarvesting,
+                             TestSetCache,
                              TestPerformance)
 
 if __name__ == "__main__":
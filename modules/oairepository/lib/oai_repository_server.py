@@ -19,17 +19,14 @@
 
 __revision__ = "$Id$"
 
-import cPickle
-import os
 import re
 import time
 import datetime
-import tempfile
-import sys
-if sys.hexversion < 0x2050000:
-    from glob import glob as iglob
-else:
-    from glob import iglob
+import base64
+import cgi
+import urllib
+from array import array
+from bisect import bisect_left, bisect_right
 
 from invenio.config import \
      CFG_OAI_DELETED_POLICY, \
@@ -40,7 +37,6 @@ from invenio.config import \
      CFG_OAI_SET_FIELD, \
      CFG_OAI_PREVIOUS_SET_FIELD, \
      CFG_OAI_METADATA_FORMATS, \
-     CFG_CACHEDIR, \
      CFG_SITE_NAME, \
      CFG_SITE_SUPPORT_EMAIL, \
      CFG_SITE_URL, \
@@ -59,12 +55,15 @@ from invenio.config import \
 
 from invenio.intbitset import intbitset
 from invenio.htmlutils import X, EscapedXMLString
-from invenio.dbquery import run_sql, wash_table_column_name
+from invenio.dbquery import run_sql, wash_table_column_name, deserialize_via_marshal
 from invenio.search_engine import record_exists, get_all_restricted_recids, get_all_field_values, search_unit_in_bibxxx, get_record
+from invenio.search_engine_utils import get_fieldvalues_for_records
 from invenio.bibformat import format_record
 from invenio.bibrecord import record_get_field_instances
 from invenio.errorlib import register_exception
-from invenio.oai_repository_config import CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
+from invenio.oai_repository_config import CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC, \
+     CFG_OAI_REPOSITORY_RECID_LIST_CACHE_SIZE, \
+     CFG_OAI_REPOSITORY_SET_CACHE_MAX_DELTA
 
 CFG_VERBS = {
     'GetRecord'          : ['identifier', 'metadataPrefix'],
@@ -464,49 +463,38 @@ def oai_list_records_or_identifiers(req, argd):
     if argd.get('resumptionToken'):
         resumption_token_was_specified = True
         try:
-            cache = oai_cache_load(argd['resumptionToken'])
-            last_recid = cache['last_recid']
-            argd = cache['argd']
-            complete_list = cache['complete_list']
-            complete_list = filter_out_based_on_date_range(complete_list, argd.get('from', ''), argd.get('until', ''))
-        except Exception:
-            register_exception(alert_admin=True)
+            argd, snapshot, last_recid = oai_decode_resumption_token(argd['resumptionToken'])
+        except ValueError:
             req.write(oai_error(argd, [("badResumptionToken", "ResumptionToken expired or invalid: %s" % argd['resumptionToken'])]))
             return
+        argd['verb'] = verb
+        complete_list = oai_get_sorted_recid_list(argd.get('set', ""), argd.get('from', ""), argd.get('until', ""), snapshot)
     else:
         last_recid = 0
-        complete_list = oai_get_recid_list(argd.get('set', ""), argd.get('from', ""), argd.get('until', ""))
+        snapshot = get_utc_now()
+        complete_list = oai_get_sorted_recid_list(argd.get('set', ""), argd.get('from', ""), argd.get('until', ""), snapshot)
 
         if not complete_list: # noRecordsMatch error
             req.write(oai_error(argd, [("noRecordsMatch", "no records correspond to the request")]))
             return
 
-    cursor = 0
-    for cursor, recid in enumerate(complete_list):
-        ## Let's fast-forward the cursor to point after the last recid that was
-        ## disseminated successfully
-        if recid > last_recid:
-            break
+    ## Let's fast-forward the cursor to point after the last recid that was
+    ## disseminated successfully
+    cursor = bisect_right(complete_list, last_recid)
 
     req.write(oai_header(argd, verb))
-    for recid in list(complete_list)[cursor:cursor+CFG_OAI_LOAD]:
+    for recid in complete_list[cursor:cursor+CFG_OAI_LOAD]:
         req.write(print_record(recid, argd['metadataPrefix'], verb=verb, set_spec=argd.get('set')))
 
-    if list(complete_list)[cursor+CFG_OAI_LOAD:]:
-        resumption_token = oai_generate_resumption_token(argd.get('set', ''))
-        cache = {
-            'argd': argd,
-            'last_recid': recid,
-            'complete_list': complete_list.fastdump(),
-        }
-        oai_cache_dump(resumption_token, cache)
+    if cursor + CFG_OAI_LOAD < len(complete_list):
+        expires = time.time() + CFG_OAI_EXPIRE
+        resumption_token = oai_encode_resumption_token(argd, snapshot, recid, expires)
         expdate = oai_get_response_date(CFG_OAI_EXPIRE)
         req.write(X.resumptionToken(expirationDate=expdate, cursor=cursor, completeListSize=len(complete_list))(resumption_token))
     elif resumption_token_was_specified:
         ## Since a resumptionToken was used we shall put a last empty resumptionToken
         req.write(X.resumptionToken(cursor=cursor, completeListSize=len(complete_list))(""))
     req.write(oai_footer(verb))
-    oai_cache_gc()
 
 def oai_list_sets(argd):
     """
@@ -659,6 +647,22 @@ def filter_out_based_on_date_range(recids, fromdate="", untildate=""):
 def oai_get_recid_list(set_spec="", fromdate="", untildate=""):
     """
     Returns list of recids for the OAI set 'set', modified from 'fromdate' until 'untildate'.
+
+    The set memberships precomputed by oairepositoryupdater are used
+    when available, otherwise the set is computed from the metadata.
+    """
+    set_cache = get_oai_set_cache(set_spec)
+    if set_cache is not None:
+        ret = oai_get_recid_list_from_set_cache(set_cache, set_spec, fromdate, untildate)
+        if ret is not None:
+            return ret
+    return filter_out_based_on_date_range(oai_compute_set_recids(set_spec), fromdate, untildate)
+
+def oai_compute_set_recids(set_spec=""):
+    """
+    Returns the recids belonging to the OAI set 'set_spec' according
+    to the metadata, without deleted records (depending on
+    CFG_OAI_DELETED_POLICY).
     """
     ret = intbitset()
     if not set_spec:
@@ -675,55 +679,220 @@ def oai_get_recid_list(set_spec="", fromdate="", untildate=""):
         ret -= search_unit_in_bibxxx(p='DELETED', f='980__%', type='e')
         if CFG_CERN_SITE:
             ret -= search_unit_in_bibxxx(p='DUMMY', f='980__%', type='e')
-    return filter_out_based_on_date_range(ret, fromdate, untildate)
+    return ret
 
-def oai_generate_resumption_token(set_spec):
-    """Generates unique ID for resumption token management."""
-    fd, name = tempfile.mkstemp(dir=os.path.join(CFG_CACHEDIR, 'RTdata'), prefix='%s___' % set_spec)
-    os.close(fd)
-    return os.path.basename(name)
+def oai_compute_set_recids_for_records(set_spec, recids):
+    """
+    Same as oai_compute_set_recids(), but only considering the given
+    recids, by looking at their field values.  This is meant for few
+    records, e.g. the ones modified since the set memberships were
+    precomputed.
+    """
+    ret = intbitset()
+    if not recids:
+        return ret
+    fields = [CFG_OAI_SET_FIELD]
+    if CFG_OAI_DELETED_POLICY != 'no':
+        fields.append(CFG_OAI_PREVIOUS_SET_FIELD)
+    for field in fields:
+        for recid, values in get_fieldvalues_for_records(recids, field).iteritems():
+            for value in values:
+                if not set_spec or value == set_spec or value.startswith(set_spec + ':'):
+                    ret.add(recid)
+                    break
+    if CFG_OAI_DELETED_POLICY == 'no' and ret:
+        deleted_values = ['DELETED']
+        if CFG_CERN_SITE:
+            deleted_values.append('DUMMY')
+        for recid, values in get_fieldvalues_for_records(ret, '980__%').iteritems():
+            for value in values:
+                if value in deleted_values:
+                    ret.discard(recid)
+                    break
+    return ret
 
-def oai_delete_resumption_tokens_for_set(set_spec):
+## Cache of the set memberships precomputed by oairepositoryupdater:
+## set_spec -> (last_updated, recids, date_recids, dates)
+_OAI_SET_CACHE = {}
+
+def get_oai_set_cache(set_spec=""):
+    """
+    Returns the set memberships precomputed by oairepositoryupdater
+    for the OAI set 'set_spec', as a tuple (last_updated, recids,
+    date_recids, dates), or None if they were not precomputed.
+
+    The global set ('') comes with date_recids, the exported recids
+    sorted by modification date, and dates, their modification dates
+    as YYYYMMDDhhmmss integers. For the other sets they are None.
+    """
+    res = run_sql("SELECT last_updated FROM oaiREPOSITORYSETCACHE WHERE setSpec=%s", (set_spec, ))
+    if not res:
+        if set_spec in _OAI_SET_CACHE:
+            del _OAI_SET_CACHE[set_spec]
+        return None
+    last_updated = res[0][0]
+    if set_spec in _OAI_SET_CACHE and _OAI_SET_CACHE[set_spec][0] == last_updated:
+        return _OAI_SET_CACHE[set_spec]
+    res = run_sql("SELECT recids, dateindex, last_updated FROM oaiREPOSITORYSETCACHE WHERE setSpec=%s", (set_spec, ))
+    if not res:
+        return None
+    recids, dateindex, last_updated = res[0]
+    date_recids = dates = None
+    if dateindex:
+        date_recids, dates = deserialize_via_marshal(dateindex)
+        date_recids = array('I', date_recids)
+    _OAI_SET_CACHE[set_spec] = (last_updated, intbitset(recids), date_recids, dates)
+    return _OAI_SET_CACHE[set_spec]
+
+def _get_local_datestamp(date, dtime):
     """
-    In case a set is modified by the admin interface, this will delete
-    any resumption token that is now invalid.
+    Returns the given OAI date as local time in YYYYMMDDhhmmss
+    integer format, to be compared with the precomputed dates.
+    """
+    return int(re.sub(r'\D', '', utc_to_localtime(normalize_date(date, dtime))))
+
+def oai_get_recid_list_from_set_cache(set_cache, set_spec="", fromdate="", untildate=""):
     """
-    aset = set_spec
-    while aset:
-        for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '%s___*' % set_spec)):
-            os.remove(name)
-        aset = aset.rsplit(":", 1)[0]
-    for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '___*')):
-        os.remove(name)
+    Returns list of recids for the OAI set 'set', modified from
+    'fromdate' until 'untildate', using the precomputed 'set_cache'
+    as returned by get_oai_set_cache().
 
-def oai_cache_dump(resumption_token, cache):
+    Records modified since the set memberships were precomputed are
+    checked individually.  Returns None when there are too many of
+    them for this to be worthwhile, or when no date index is available.
+    """
+    last_updated, recids, dummy_date_recids, dummy_dates = set_cache
+    if fromdate or untildate:
+        if set_spec:
+            date_cache = get_oai_set_cache("")
+        else:
+            date_cache = set_cache
+        if date_cache is None or date_cache[2] is None:
+            return None
+        last_updated = min(last_updated, date_cache[0])
+    modified = run_sql("SELECT id, DATE_FORMAT(modification_date, '%%Y%%m%%d%%H%%i%%s') FROM bibrec WHERE modification_date>=%s", (last_updated, ), CFG_OAI_REPOSITORY_SET_CACHE_MAX_DELTA + 1)
+    if len(modified) > CFG_OAI_REPOSITORY_SET_CACHE_MAX_DELTA:
+        return None
+    modified_recids = intbitset([row[0] for row in modified])
+    ret = recids - modified_recids
+    ret |= oai_compute_set_recids_for_records(set_spec, modified_recids)
+    if fromdate or untildate:
+        dummy, dummy_recids, date_recids, dates = date_cache
+        lower = 0
+        upper = len(dates)
+        if fromdate:
+            fromdate = _get_local_datestamp(fromdate, "T00:00:00Z")
+            lower = bisect_left(dates, fromdate)
+        if untildate:
+            untildate = _get_local_datestamp(untildate, "T23:59:59Z")
+            upper = bisect_right(dates, untildate)
+        if lower > 0 or upper < len(dates):
+            in_range = intbitset(date_recids[lower:upper]) - modified_recids
+            in_range |= intbitset([recid for recid, date in modified
+                                   if (not fromdate or int(date or 0) >= fromdate) and
+                                      (not untildate or int(date or 0) <= untildate)])
+            ret &= in_range
+    return ret - get_all_restricted_recids()
+
+## Cache of sorted recid lists, used to serve the successive pages of
+## the harvests without recomputing the whole set:
+## (set_spec, fromdate, untildate) -> (creation time, UTC time of the
+## computation, array of recids)
+## The cache lives in each process: oai_delete_resumption_tokens_for_set()
+## only clears it in the process that calls it.
+_OAI_RECID_LIST_CACHE = {}
+
+def oai_get_sorted_recid_list(set_spec="", fromdate="", untildate="", snapshot=""):
+    """
+    Same as oai_get_recid_list(), but returns the recids as a sorted
+    array, kept in memory for CFG_OAI_EXPIRE seconds so that
+    resuming a harvest only costs a binary search.  All the harvests
+    of the same set and dates share the same list.
+
+    When no untildate is given, the records modified after snapshot
+    (the UTC time at which the harvest started) are left out, as if it
+    was the until date.
     """
-    Given a resumption_token and the cache, stores the cache.
+    key = (set_spec, fromdate, untildate)
+    now = time.time()
+    entry = _OAI_RECID_LIST_CACHE.get(key)
+    if entry is not None:
+        timestamp, computed, recids = entry
+        ## A list computed before the harvest started may miss some of
+        ## the records modified since then.
+        if now - timestamp > CFG_OAI_EXPIRE or (snapshot and computed < snapshot):
+            entry = None
+    if entry is None:
+        computed = get_utc_now()
+        recids = array('I', oai_get_recid_list(set_spec, fromdate, untildate))
+        if key not in _OAI_RECID_LIST_CACHE and \
+               len(_OAI_RECID_LIST_CACHE) >= CFG_OAI_REPOSITORY_RECID_LIST_CACHE_SIZE:
+            ## Let's forget the oldest list
+            oldest = min(_OAI_RECID_LIST_CACHE.iteritems(), key=lambda item: item[1][0])[0]
+            del _OAI_RECID_LIST_CACHE[oldest]
+        _OAI_RECID_LIST_CACHE[key] = (now, computed, recids)
+    if snapshot and not untildate:
+        modified = intbitset(run_sql("SELECT id FROM bibrec WHERE modification_date>%s",
+                                     (utc_to_localtime(snapshot), )))
+        if modified:
+            recids = array('I', [recid for recid in recids if recid not in modified])
+    return recids
+
+def oai_encode_resumption_token(argd, snapshot, last_recid, expires):
     """
-    cPickle.dump(cache, open(os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token), 'w'), -1)
+    Return a resumption token carrying everything needed to serve the
+    next page: the original arguments of the request, the UTC time at
+    which the harvest started (used as until date when none was given),
+    the last disseminated recid and the expiration time of the token.
+    """
+    params = {
+        'm': argd.get('metadataPrefix', ''),
+        's': argd.get('set', ''),
+        'f': argd.get('from', ''),
+        'u': argd.get('until', ''),
+        't': snapshot,
+        'r': last_recid,
+        'e': int(expires),
+    }
+    return base64.urlsafe_b64encode(urllib.urlencode(sorted(params.items()))).rstrip('=')
 
-def oai_cache_load(resumption_token):
+def oai_decode_resumption_token(resumption_token):
     """
-    Restores the cache from the resumption_token.
+    Decode a resumption token generated by oai_encode_resumption_token().
+
+    @return: (argd, snapshot, last_recid)
+    @raise ValueError: if the token is invalid or expired.
     """
-    fullpath = os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token)
-    if os.path.dirname(os.path.abspath(fullpath)) != os.path.abspath(os.path.join(CFG_CACHEDIR, 'RTdata')):
-        raise ValueError("Invalid path")
-    return cPickle.load(open(fullpath))
+    try:
+        token = str(resumption_token)
+        token += '=' * (-len(token) % 4)
+        params = dict(cgi.parse_qsl(base64.urlsafe_b64decode(token), keep_blank_values=True, strict_parsing=True))
+        argd = {}
+        for name, param in (('metadataPrefix', 'm'), ('set', 's'), ('from', 'f'), ('until', 'u')):
+            if params[param]:
+                argd[name] = params[param]
+        snapshot = params['t']
+        last_recid = int(params['r'])
+        expires = int(params['e'])
+    except (TypeError, KeyError, UnicodeError, ValueError):
+        raise ValueError("Invalid resumption token: %s" % resumption_token)
+    if expires < time.time():
+        raise ValueError("Expired resumption token: %s" % resumption_token)
+    if not check_date(snapshot) or argd.get('metadataPrefix') not in CFG_OAI_METADATA_FORMATS:
+        raise ValueError("Invalid resumption token: %s" % resumption_token)
+    return argd, snapshot, last_recid
 
-def oai_cache_gc():
+def oai_delete_resumption_tokens_for_set(set_spec):
     """
-    OAI Cache Garbage Collector.
+    In case a set is modified by the admin interface, this will forget
+    the cached recid lists that are now invalid, so that pending
+    harvests are resumed over the new set content.  Only the cache of
+    the current process is cleared: the other processes keep serving
+    their lists until they expire, after CFG_OAI_EXPIRE seconds.
     """
-    for file_ in os.listdir(os.path.join(CFG_CACHEDIR, 'RTdata')):
-        filename = os.path.join(os.path.join(CFG_CACHEDIR, 'RTdata', file_))
-        # cache entry expires when not modified during a specified period of time
-        if ((time.time() - os.path.getmtime(filename)) > CFG_OAI_EXPIRE):
-            try:
-                os.remove(filename)
-            except OSError, e:
-                # Most probably the cache was already deleted
-                pass
+    for key in _OAI_RECID_LIST_CACHE.keys():
+        if not key[0] or key[0] == set_spec or set_spec.startswith(key[0] + ':'):
+            del _OAI_RECID_LIST_CACHE[key]
 
 def get_all_sets():
     """
@@ -24,6 +24,7 @@ __revision__ = "$Id$"
 
 import unittest
 import re
+import time
 
 from cStringIO import StringIO
 
@@ -80,8 +81,63 @@ class TestErrorCodes(unittest.TestCase):
 
         self.assertNotEqual([], [code for (code, dummy_text) in oai_repository_server.check_argd({'verb': 'ListRecords', 'resumptionToken': ''}) if code == 'badResumptionToken'])
 
+class TestResumptionToken(unittest.TestCase):
+    """Test for the encoding of resumption tokens."""
+
+    def test_resumption_token_round_trip(self):
+        """oairepository - encoding and decoding resumption tokens"""
+        argd = {'verb': 'ListRecords', 'metadataPrefix': 'marcxml', 'set': 'cern:experiment', 'from': '2001-01-01'}
+        token = oai_repository_server.oai_encode_resumption_token(argd, '2010-01-01T12:00:00Z', 42, time.time() + 60)
+        self.assertEqual(None, re.search(r'[^A-Za-z0-9_-]', token))
+        self.assertEqual(({'metadataPrefix': 'marcxml', 'set': 'cern:experiment', 'from': '2001-01-01'}, '2010-01-01T12:00:00Z', 42),
+                         oai_repository_server.oai_decode_resumption_token(token))
+
+    def test_bad_resumption_token(self):
+        """oairepository - rejecting expired or invalid resumption tokens"""
+        argd = {'verb': 'ListRecords', 'metadataPrefix': 'marcxml'}
+        token = oai_repository_server.oai_encode_resumption_token(argd, '2010-01-01T12:00:00Z', 42, time.time() - 60)
+        self.assertRaises(ValueError, oai_repository_server.oai_decode_resumption_token, token)
+        self.assertRaises(ValueError, oai_repository_server.oai_decode_resumption_token, 'foobar')
+        token = oai_repository_server.oai_encode_resumption_token(argd, '2010-01-01T12:00:00Z', 42, time.time() + 60)
+        self.assertRaises(ValueError, oai_repository_server.oai_decode_resumption_token, token[:-5])
+
+class TestSortedRecidListCache(unittest.TestCase):
+    """Test the cache of the recid lists of the harvests."""
+
+    def setUp(self):
+        self.old_functions = (oai_repository_server.oai_get_recid_list,
+                              oai_repository_server.run_sql,
+                              oai_repository_server.get_utc_now)
+        self.computed = []
+        def oai_get_recid_list(set_spec="", fromdate="", untildate=""):
+            self.computed.append((set_spec, fromdate, untildate))
+            return [1, 2, 3]
+        oai_repository_server.oai_get_recid_list = oai_get_recid_list
+        ## record 2 was modified after the harvests started
+        oai_repository_server.run_sql = lambda sql, params: [(2, )]
+        oai_repository_server.get_utc_now = lambda: '2013-01-01T12:00:00Z'
+        oai_repository_server._OAI_RECID_LIST_CACHE.clear()
+
+    def tearDown(self):
+        (oai_repository_server.oai_get_recid_list,
+         oai_repository_server.run_sql,
+         oai_repository_server.get_utc_now) = self.old_functions
+        oai_repository_server._OAI_RECID_LIST_CACHE.clear()
+
+    def test_harvests_share_recid_list(self):
+        """oairepository - harvests started at different times share their recid list"""
+        self.assertEqual([1, 3], list(oai_repository_server.oai_get_sorted_recid_list("cern", "", "", "2013-01-01T11:00:00Z")))
+        self.assertEqual([1, 3], list(oai_repository_server.oai_get_sorted_recid_list("cern", "", "", "2013-01-01T11:30:00Z")))
+        self.assertEqual([1, 2, 3], list(oai_repository_server.oai_get_sorted_recid_list("cern", "", "2013-01-01", "2013-01-01T11:30:00Z")))
+        self.assertEqual([("cern", "", ""), ("cern", "", "2013-01-01")], self.computed)
+        ## a harvest started after the list was computed needs a new one
+        oai_repository_server.oai_get_sorted_recid_list("cern", "", "", "2013-01-01T12:30:00Z")
+        self.assertEqual(3, len(self.computed))
+
 TEST_SUITE = make_test_suite(TestVerbs,
-                             TestErrorCodes)
+                             TestErrorCodes,
+                             TestResumptionToken,
+                             TestSortedRecidListCache)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -46,7 +46,8 @@ from invenio.oai_repository_config import CFG_OAI_REPOSITORY_MARCXML_SIZE, \
      CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
 from invenio.search_engine import perform_request_search, get_record, search_unit_in_bibxxx
 from invenio.intbitset import intbitset
-from invenio.dbquery import run_sql
+from invenio.dbquery import run_sql, serialize_via_marshal
+from invenio.oai_repository_server import get_all_sets, oai_compute_set_recids
 from invenio.bibtask import \
      task_get_option, \
      task_set_option, \
@@ -59,7 +60,7 @@ from invenio.bibrecord import \
      record_get_field_value, \
      record_get_field_values, \
      record_add_field, \
-     record_xml_output
+     record_xml_write
 
 def get_set_definitions(set_spec):
     """
@@ -283,6 +284,36 @@ def repository_size():
     """Read repository size"""
     return len(search_unit_in_bibxxx(p="*", f=CFG_OAI_SET_FIELD, type="e"))
 
+def update_oai_set_cache():
+    """
+    Precompute the records belonging to each OAI set, as exposed by
+    the OAI repository server, and store them in oaiREPOSITORYSETCACHE.
+    The global set also gets the list of its records sorted by
+    modification date, so that the server can select date ranges
+    without querying the bibrec table.
+
+    Records modified afterwards are checked individually by the
+    server, so the cache stays usable until the next run.
+    """
+    last_updated = run_sql("SELECT NOW()")[0][0]
+    set_specs = [''] + sorted(get_all_sets().keys())
+    for i, set_spec in enumerate(set_specs):
+        task_update_progress("Precomputing OAI set %s out of %s" % (i + 1, len(set_specs)))
+        recids = oai_compute_set_recids(set_spec)
+        dateindex = None
+        if not set_spec:
+            date_recids = []
+            dates = []
+            for recid, date in run_sql("SELECT id, DATE_FORMAT(modification_date, '%Y%m%d%H%i%s') FROM bibrec ORDER BY modification_date, id"):
+                if recid in recids:
+                    date_recids.append(recid)
+                    dates.append(int(date or 0))
+            dateindex = serialize_via_marshal((date_recids, dates))
+        write_message("%s recids are exposed in OAI set '%s'" % (len(recids), set_spec), verbose=2)
+        run_sql("REPLACE INTO oaiREPOSITORYSETCACHE (setSpec, recids, dateindex, last_updated) VALUES (%s, %s, %s, %s)",
+                (set_spec, recids.fastdump(), dateindex, last_updated))
+    run_sql("DELETE FROM oaiREPOSITORYSETCACHE WHERE last_updated<%s", (last_updated, ))
+
 ### MAIN ###
 def oairepositoryupdater_task():
     """Main business logic code of oai_archive"""
@@ -335,6 +366,8 @@ def oairepositoryupdater_task():
     all_affected_recids |= missing_oaiid | no_more_exported_recids
     write_message("%s recids should updated" % (len(all_affected_recids)), verbose=2)
 
+    update_oai_set_cache()
+
     if not all_affected_recids:
         write_message("Nothing to do!")
         return True
@@ -406,7 +439,7 @@ def oairepositoryupdater_task():
 
         record_add_field(new_record, tag="001", controlfield_value=str(recid))
         record_add_field(new_record, tag=CFG_OAI_ID_FIELD[:3], ind1=CFG_OAI_ID_FIELD[3], ind2=CFG_OAI_ID_FIELD[4], subfields=subfields)
-        oai_out.write(record_xml_output(new_record))
+        record_xml_write(oai_out.write, new_record)
         tot += 1
         if tot == CFG_OAI_REPOSITORY_MARCXML_SIZE:
             oai_out.write("</collection>")
@@ -53,6 +53,7 @@ import datetime
 from invenio.config import CFG_BIBRANK_SHOW_DOWNLOAD_STATS
 from invenio.config import CFG_WEBAUTHORPROFILE_CACHE_EXPIRED_DELAY_LIVE
 from invenio.config import CFG_WEBAUTHORPROFILE_MAX_HEP_CHOICES
+from invenio.config import CFG_WEBAUTHORPROFILE_MAX_KEYWORD_LIST
 from invenio.config import CFG_WEBAUTHORPROFILE_USE_BIBAUTHORID
 
 #After this delay, we assume that a process computing a empty claimed cache is dead and we
@@ -63,6 +64,9 @@ RECOMPUTE_PRECACHED_ELEMENT_DELAY = datetime.timedelta(minutes=30)
 #up-to-date
 CACHE_IS_OUTDATED_DELAY = datetime.timedelta(days=CFG_WEBAUTHORPROFILE_CACHE_EXPIRED_DELAY_LIVE)
 
+#Only the first keywords are displayed (see tmpl_keyword_box), no need to compute more
+MAX_KEYWORDS = CFG_WEBAUTHORPROFILE_MAX_KEYWORD_LIST > 0 and CFG_WEBAUTHORPROFILE_MAX_KEYWORD_LIST or None
+
 #tag constants
 AUTHOR_TAG = "100__a"
 AUTHOR_INST_TAG = "100__u"
@@ -471,7 +475,8 @@ def _get_kwtuples_bai(pubs, person_id):
     @param person_id: int person id
     '''
     tup = get_most_popular_field_values(pubs,
-                            (KEYWORD_TAG, FKEYWORD_TAG), count_repetitive_values=False)
+                            (KEYWORD_TAG, FKEYWORD_TAG), count_repetitive_values=False,
+                            nb_values=MAX_KEYWORDS)
     return tup
 
 def _get_collabtuples_bai(pubs, person_id):
@@ -678,7 +683,8 @@ def _get_kwtuples_fallback(pubs, person_id):
     @param person_id: int person id
     '''
     tup = get_most_popular_field_values(pubs,
-                            (KEYWORD_TAG, FKEYWORD_TAG), count_repetitive_values=False)
+                            (KEYWORD_TAG, FKEYWORD_TAG), count_repetitive_values=False,
+                            nb_values=MAX_KEYWORDS)
     return tup
 
 def _get_collabtuples_fallback(pubs, person_id):
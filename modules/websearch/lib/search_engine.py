@@ -29,6 +29,8 @@ __revision__ = "$Id$"
 import cgi
 import cStringIO
 import copy
+import heapq
+import array
 import string
 import os
 import re
@@ -82,7 +84,8 @@ from invenio.search_engine_config import \
      InvenioWebSearchWildcardLimitError, \
      CFG_WEBSEARCH_IDXPAIRS_FIELDS,\
      CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH
-from invenio.search_engine_utils import get_fieldvalues
+from invenio.search_engine_utils import get_fieldvalues, get_fieldvalues_for_records, \
+     get_sorted_tail
 from invenio.bibrecord import create_record
 from invenio.bibrank_record_sorter import get_bibrank_methods, is_method_valid, rank_records as rank_records_bibrank
 from invenio.bibrank_downloads_similarity import register_page_view_event, calculate_reading_similarity_list
@@ -3804,7 +3807,11 @@ class BibSortDataCacher(DataCacher):
                 data_dict_ordered = deserialize_via_marshal(res_data[0][0])
             except:
                 data_dict_ordered = {}
-            alldicts['data_dict_ordered'] = data_dict_ordered # recid: weight
+            # recid: weight, as a dense array (-1 if no weight)
+            alldicts['ranks'] = get_bibsort_ranks_array(data_dict_ordered)
+            # recids that have a weight
+            alldicts['ranked_recids'] = intbitset(data_dict_ordered.keys())
+            del data_dict_ordered
             if not res_buckets:
                 alldicts['bucket_data'] = {}
                 return alldicts
@@ -3835,6 +3842,19 @@ class BibSortDataCacher(DataCacher):
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
+def get_bibsort_ranks_array(data_dict_ordered):
+    """Return the weights of the BibSort dictionary DATA_DICT_ORDERED
+    (recid: weight) as an array indexed by recid, holding -1 for the
+    recids that have no weight.  This takes a few bytes per recid,
+    instead of the ~100 bytes per entry of the dictionary, and lets
+    the weights of a whole hitset be fetched by C-level indexing."""
+    if not data_dict_ordered:
+        return array.array('l')
+    ranks = array.array('l', [-1]) * (max(data_dict_ordered) + 1)
+    for recid, weight in data_dict_ordered.iteritems():
+        ranks[recid] = weight
+    return ranks
+
 def get_sorting_methods():
     if not CFG_BIBSORT_BUCKETS: # we do not want to use buckets
         return {}
@@ -3990,15 +4010,11 @@ def sort_records_bibsort(req, recIDs, sort_method, sort_field='', sort_order='d'
         solution.union_update(input_recids & sort_cache['bucket_data'][bucket_no])
         if len(solution) >= irec_max:
             break
-    dict_solution = {}
-    missing_records = []
-    for recid in solution:
-        try:
-            dict_solution[recid] = sort_cache['data_dict_ordered'][recid]
-        except KeyError:
-            #recid is in buckets, but not in the bsrMETHODDATA,
-            #maybe because the value has been deleted, but the change has not yet been propagated to the buckets
-            missing_records.append(recid)
+    ranks = sort_cache['ranks']
+    ranked_solution = solution & sort_cache['ranked_recids']
+    #recids in buckets, but not in the bsrMETHODDATA,
+    #maybe because the value has been deleted, but the change has not yet been propagated to the buckets
+    missing_records = list(solution - ranked_solution)
     #check if there are recids that are not in any bucket -> to be added at the end/top, ordered by insertion date
     if len(solution) < irec_max:
         #some records have not been yet inserted in the bibsort structures
@@ -4007,22 +4023,26 @@ def sort_records_bibsort(req, recIDs, sort_method, sort_field='', sort_order='d'
     #the records need to be sorted in reverse order for the print record function
     #the return statement should be equivalent with the following statements
     #(these are clearer, but less efficient, since they revert the same list twice)
-    #sorted_solution = (missing_records + sorted(dict_solution, key=dict_solution.__getitem__, reverse=sort_order=='d'))[:irec_max]
+    #sorted_solution = (missing_records + sorted(ranked_solution, key=ranks.__getitem__, reverse=sort_order=='d'))[:irec_max]
     #sorted_solution.reverse()
     #return sorted_solution
+    #we return all the records up to irec_max, but on the reverted list,
+    #i.e. the last irec_max records of the sorted list; only these need to be sorted
     if sort_method.strip().lower().startswith('latest') and sort_order == 'd':
         # if we want to sort the records on their insertion date, add the mission records at the top
-        solution = sorted(dict_solution, key=dict_solution.__getitem__, reverse=sort_order=='a') + missing_records
+        nb_missing_records = min(len(missing_records), irec_max)
+        solution = get_sorted_tail(ranked_solution, ranks.__getitem__, sort_order=='a', irec_max - nb_missing_records) + \
+                   missing_records[len(missing_records) - nb_missing_records:]
     else:
-        solution = missing_records + sorted(dict_solution, key=dict_solution.__getitem__, reverse=sort_order=='a')
-    #calculate the min index on the reverted list
-    index_min = max(len(solution) - irec_max, 0) #just to be sure that the min index is not negative
-    #return all the records up to irec_max, but on the reverted list
+        nb_ranked_records = min(len(ranked_solution), irec_max)
+        nb_missing_records = min(len(missing_records), irec_max - nb_ranked_records)
+        solution = missing_records[len(missing_records) - nb_missing_records:] + \
+                   get_sorted_tail(ranked_solution, ranks.__getitem__, sort_order=='a', nb_ranked_records)
     if sort_or_rank == 'r':
         # we need the recids, with values
-        return (solution[index_min:], [dict_solution.get(record, 0) for record in solution[index_min:]])
+        return (solution, [record in ranked_solution and ranks[record] or 0 for record in solution])
     else:
-        return solution[index_min:]
+        return solution
 
 
 def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_pattern='', verbose=0, of='hb', ln=CFG_SITE_LANG, rg=None, jrec=None):
@@ -4063,17 +4083,21 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
             write_warning("Sorting preferentially by %s." % cgi.escape(sort_pattern), req=req)
      ## check if we have sorting tag defined:
     if tags:
-        # fetch the necessary field values:
+        # fetch the necessary field values, for all records at once:
+        tags_values = []
+        for tag in tags:
+            tag_values = get_fieldvalues_for_records(recIDs, tag)
+            if CFG_CERN_SITE and tag == '773__c':
+                # CERN hack: journal sorting
+                # 773__c contains page numbers, e.g. 3-13, and we want to sort by 3, and numerically:
+                for recID, values in tag_values.iteritems():
+                    tag_values[recID] = ["%050s" % x.split("-", 1)[0] for x in values]
+            tags_values.append(tag_values)
         for recID in recIDs:
             val = "" # will hold value for recID according to which sort
             vals = [] # will hold all values found in sorting tag for recID
-            for tag in tags:
-                if CFG_CERN_SITE and tag == '773__c':
-                    # CERN hack: journal sorting
-                    # 773__c contains page numbers, e.g. 3-13, and we want to sort by 3, and numerically:
-                    vals.extend(["%050s" % x.split("-", 1)[0] for x in get_fieldvalues(recID, tag)])
-                else:
-                    vals.extend(get_fieldvalues(recID, tag))
+            for tag_values in tags_values:
+                vals.extend(tag_values.get(recID, []))
             if sort_pattern:
                 # try to pick that tag value that corresponds to sort pattern
                 bingo = 0
@@ -4092,21 +4116,21 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
                 recIDs_dict[val].append(recID)
             else:
                 recIDs_dict[val] = [recID]
-        # sort them:
-        recIDs_dict_keys = recIDs_dict.keys()
-        recIDs_dict_keys.sort()
-        # now that keys are sorted, create output array:
-        for k in recIDs_dict_keys:
-            for s in recIDs_dict[k]:
-                recIDs_out.append(s)
-        # ascending or descending?
+        # sort them, but only the values that make it into the
+        # last irec_max records of the output (every value holds at
+        # least one record):
         if sort_order == 'a':
-            recIDs_out.reverse()
+            # descending order of values, records of a value reversed
+            recIDs_dict_keys = get_sorted_tail(recIDs_dict.keys(), reverse=True, nb_items=irec_max)
+            for k in recIDs_dict_keys:
+                recIDs_out.extend(recIDs_dict[k][::-1])
+        else:
+            recIDs_dict_keys = get_sorted_tail(recIDs_dict.keys(), nb_items=irec_max)
+            for k in recIDs_dict_keys:
+                recIDs_out.extend(recIDs_dict[k])
         # okay, we are done
         # return only up to the maximum that we need to sort
-        if len(recIDs_out) != len(recIDs):
-            dummy, irec_max = get_interval_for_records_to_sort(len(recIDs_out), jrec, rg)
-            index_min = max(len(recIDs_out) - irec_max, 0) #just to be sure that the min index is not negative
+        index_min = max(len(recIDs_out) - irec_max, 0) #just to be sure that the min index is not negative
         return recIDs_out[index_min:]
     else:
         # good, no sort needed
@@ -6346,7 +6370,7 @@ def get_all_field_values(tag):
     table = 'bib%02dx' % int(tag[:2])
     return [row[0] for row in run_sql("SELECT DISTINCT(value) FROM %s WHERE tag=%%s" % table, (tag, ))]
 
-def get_most_popular_field_values(recids, tags, exclude_values=None, count_repetitive_values=True):
+def get_most_popular_field_values(recids, tags, exclude_values=None, count_repetitive_values=True, nb_values=None):
     """
     Analyze RECIDS and look for TAGS and return most popular values
     and the frequency with which they occur sorted according to
@@ -6360,6 +6384,9 @@ def get_most_popular_field_values(recids, tags, exclude_values=None, count_repet
     (But, if the same value occurs in another record, we count it, of
     course.)
 
+    If NB_VALUES is set, return only the NB_VALUES most popular values
+    (selected without sorting all the values).
+
     Example:
      >>> get_most_popular_field_values(range(11,20), '980__a')
      (('PREPRINT', 10), ('THESIS', 7), ...)
@@ -6369,14 +6396,6 @@ def get_most_popular_field_values(recids, tags, exclude_values=None, count_repet
      (('Ellis, N', 7), ...)
     """
 
-    def _get_most_popular_field_values_helper_sorter(val1, val2):
-        "Compare VAL1 and VAL2 according to, firstly, frequency, then secondly, alphabetically."
-        compared_via_frequencies = cmp(valuefreqdict[val2], valuefreqdict[val1])
-        if compared_via_frequencies == 0:
-            return cmp(val1.lower(), val2.lower())
-        else:
-            return compared_via_frequencies
-
     valuefreqdict = {}
     ## sanity check:
     if not exclude_values:
@@ -6391,20 +6410,18 @@ def get_most_popular_field_values(recids, tags, exclude_values=None, count_repet
         for tag in tags:
             vals_to_count.extend(get_fieldvalues(recids, tag, sort=False))
     else:
-        # counting technique B: must count record-by-record: (slow)
+        # counting technique B: must count record-by-record, but
+        # values are fetched for many records at once:
+        tags_values = [get_fieldvalues_for_records(recids, tag) for tag in tags]
         for recid in recids:
-            vals_in_rec = []
-            for tag in tags:
-                for val in get_fieldvalues(recid, tag, False):
-                    vals_in_rec.append(val)
             # do not count repetitive values within this record
             # (even across various tags, so need to unify again):
             dtmp = {}
-            for val in vals_in_rec:
-                dtmp[val.lower()] = 1
-                displaytmp[val.lower()] = val
-            vals_in_rec = dtmp.keys()
-            vals_to_count.extend(vals_in_rec)
+            for tag_values in tags_values:
+                for val in tag_values.get(recid, ()):
+                    dtmp[val.lower()] = 1
+                    displaytmp[val.lower()] = val
+            vals_to_count.extend(dtmp.iterkeys())
     ## are we to exclude some of found values?
     for val in vals_to_count:
         if val not in exclude_values:
@@ -6412,17 +6429,15 @@ def get_most_popular_field_values(recids, tags, exclude_values=None, count_repet
                 valuefreqdict[val] += 1
             else:
                 valuefreqdict[val] = 1
-    ## sort by descending frequency of values:
+    ## sort by descending frequency of values, then alphabetically:
+    sort_key = lambda val: (-valuefreqdict[val], val.lower())
+    if nb_values is None:
+        vals = sorted(valuefreqdict.iterkeys(), key=sort_key)
+    else:
+        vals = heapq.nsmallest(nb_values, valuefreqdict.iterkeys(), key=sort_key)
     out = ()
-    vals = valuefreqdict.keys()
-    vals.sort(_get_most_popular_field_values_helper_sorter)
     for val in vals:
-        tmpdisplv = ''
-        if displaytmp.has_key(val):
-            tmpdisplv = displaytmp[val]
-        else:
-            tmpdisplv = val
-        out += (tmpdisplv, valuefreqdict[val]),
+        out += (displaytmp.get(val, val), valuefreqdict[val]),
     return out
 
 def profile(p="", f="", c=CFG_SITE_NAME):
@@ -25,6 +25,7 @@ __revision__ = \
 import unittest
 
 from invenio import search_engine
+from invenio import search_engine_utils
 from invenio.testutils import make_test_suite, run_test_suite
 
 class TestMiscUtilityFunctions(unittest.TestCase):
@@ -39,6 +40,27 @@ class TestMiscUtilityFunctions(unittest.TestCase):
         self.assertEqual(search_engine.ziplist([1, 2, 3], ['a', 'b', 'c'], [9, 8, 7]),
                          [[1, 'a', 9], [2, 'b', 8], [3, 'c', 7]])
 
+    def test_bibsort_ranks_array(self):
+        """search engine - dense array of BibSort weights"""
+        ranks = search_engine.get_bibsort_ranks_array({1: 16, 3: 8, 6: 24})
+        self.assertEqual(list(ranks), [-1, 16, -1, 8, -1, -1, 24])
+        self.assertEqual(sorted([6, 1, 3], key=ranks.__getitem__), [3, 1, 6])
+        self.assertEqual(len(search_engine.get_bibsort_ranks_array({})), 0)
+
+    def test_get_sorted_tail(self):
+        """search engine - partial sort of the last elements"""
+        items = [(i * 7919) % 101 for i in range(100)]
+        tie_key = lambda x: x % 10
+        for reverse in (False, True):
+            for nb_items in (0, 1, 5, 24, 25, 100, 150, None):
+                expected = sorted(items, key=tie_key, reverse=reverse)
+                if nb_items is not None:
+                    expected = nb_items and expected[-nb_items:] or []
+                self.assertEqual(search_engine_utils.get_sorted_tail(items, tie_key, reverse, nb_items),
+                                 expected)
+        self.assertEqual(search_engine_utils.get_sorted_tail([3, 1, 2, 5, 4, 9, 8, 7, 6], nb_items=2),
+                         [8, 9])
+
 
 class TestWashQueryParameters(unittest.TestCase):
     """Test for washing of search query parameters."""
@@ -21,7 +21,10 @@
 
 """Invenio search engine utilities."""
 
-from invenio.dbquery import run_sql
+import heapq
+from itertools import count, izip, imap
+
+from invenio.dbquery import run_sql, run_sql_in
 
 def get_fieldvalues(recIDs, tag, repetitive_values=True, sort=True):
     """
@@ -81,3 +84,80 @@ def get_fieldvalues(recIDs, tag, repetitive_values=True, sort=True):
         for row in res:
             out.append(row[0])
     return out
+
+def get_fieldvalues_for_records(recIDs, tag, chunk_size=5000):
+    """
+    Return the field values for field TAG of all the given record IDs,
+    as a dictionary {recID: [values]}.  Records without value for TAG
+    are not present in the dictionary.  Values of a record come in the
+    same order as with get_fieldvalues(recID, TAG).
+
+    Values are fetched with one query per CHUNK_SIZE records, instead
+    of one query per record.
+    """
+    out = {}
+    if tag == "001___":
+        # We have asked for tag 001 (=recID) that is not stored in bibXXx
+        # tables.
+        for recID in recIDs:
+            out[recID] = [str(recID)]
+        return out
+    # we are going to look inside bibXXx tables
+    digits = tag[0:2]
+    try:
+        intdigits = int(digits)
+        if intdigits < 0 or intdigits > 99:
+            raise ValueError
+    except ValueError:
+        # invalid tag value asked for
+        return out
+    bx = "bib%sx" % digits
+    bibx = "bibrec_bib%sx" % digits
+    query = "SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx " \
+            "WHERE bibx.id_bibrec IN (%%(ids)s) AND bx.id=bibx.id_bibxxx AND " \
+            "bx.tag LIKE %%s ORDER BY bibx.field_number, bx.tag ASC" % \
+            (bx, bibx)
+    for recID, rows in run_sql_in(query, recIDs, (tag,),
+                                  chunk_size=chunk_size).iteritems():
+        out[recID] = [row[0] for row in rows]
+    return out
+
+def get_sorted_tail(items, key=None, reverse=False, nb_items=None):
+    """
+    Return the last NB_ITEMS elements of sorted(ITEMS, key=KEY,
+    reverse=REVERSE), in the same order and with the same tie-breaking
+    as the full sort (which is stable).
+
+    When only a small window of a big list is needed (e.g. the first
+    page of a sorted hitset, which is at the end of the list since
+    records are printed in reverse order), the window is selected with
+    a heap in O(n log NB_ITEMS) instead of sorting the whole list.
+
+    @param items: iterable of elements to sort
+    @param key: function returning the sort key of an element
+    @param reverse: if True, sort in descending order
+    @param nb_items: number of elements to return (None or more than
+                     the number of ITEMS for all of them)
+    @return: list of the last NB_ITEMS sorted elements
+    """
+    if nb_items is not None and nb_items <= 0:
+        return []
+    items = list(items)
+    if nb_items is None or nb_items * 4 >= len(items):
+        # the window is a big part of the list: sorting it is faster
+        sorted_items = sorted(items, key=key, reverse=reverse)
+        if nb_items is not None:
+            sorted_items = sorted_items[-nb_items:]
+        return sorted_items
+    if key is None:
+        keys = items
+    else:
+        keys = imap(key, items)
+    # decorate with the position of the element, so that elements with
+    # equal keys come in the same order as with a stable sort
+    if reverse:
+        window = heapq.nsmallest(nb_items, izip(keys, count(0, -1), items))
+    else:
+        window = heapq.nlargest(nb_items, izip(keys, count(), items))
+    window.reverse()
+    return [item for dummy_key, dummy_position, item in window]
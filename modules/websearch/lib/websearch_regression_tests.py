@@ -52,7 +52,7 @@ from invenio.search_engine import perform_request_search, \
     search_pattern, search_unit, search_unit_in_bibrec, \
     wash_colls, record_public_p
 from invenio import search_engine_summarizer
-from invenio.search_engine_utils import get_fieldvalues
+from invenio.search_engine_utils import get_fieldvalues, get_fieldvalues_for_records
 from invenio.intbitset import intbitset
 from invenio.search_engine import intersect_results_with_collrecs
 
@@ -2192,6 +2192,15 @@ class WebSearchSummarizerTest(unittest.TestCase):
         self.assertEqual((('REPORT', 1), ('THESIS', 1)),
                          get_most_popular_field_values((41,), ('690C_a', '980__a'), count_repetitive_values=False))
 
+    def test_most_popular_field_values_nb_values(self):
+        """websearch - most popular field values, only the most popular ones"""
+        from invenio.search_engine import get_most_popular_field_values
+        self.assertEqual((('PREPRINT', 37), ('ARTICLE', 28), ('BOOK', 14)),
+                         get_most_popular_field_values(range(0,100), '980__a', nb_values=3))
+        self.assertEqual((('REPORT', 1),),
+                         get_most_popular_field_values((41,), ('690C_a', '980__a'),
+                                                       count_repetitive_values=False, nb_values=1))
+
     def test_ellis_citation_summary(self):
         """websearch - query ellis, citation summary output format"""
         self.assertEqual([],
@@ -2267,6 +2276,15 @@ class WebSearchGetFieldValuesTest(unittest.TestCase):
         self.assertEqual(get_fieldvalues([17, 18], '909C1u', repetitive_values=False),
                          ['CERN'])
 
+    def test_get_fieldvalues_for_records(self):
+        """websearch - get_fieldvalues_for_records() for list of recIDs"""
+        self.assertEqual(get_fieldvalues_for_records([], '700__a'), {})
+        self.assertEqual(get_fieldvalues_for_records([10, 13], '001___'),
+                         {10: ['10'], 13: ['13']})
+        self.assertEqual(get_fieldvalues_for_records([18, 13], '700__a', chunk_size=1),
+                         {18: get_fieldvalues(18, '700__a'),
+                          13: get_fieldvalues(13, '700__a')})
+
 class WebSearchAddToBasketTest(unittest.TestCase):
     """Test of the add-to-basket presence depending on user rights."""
 
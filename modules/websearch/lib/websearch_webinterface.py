@@ -85,7 +85,7 @@ from invenio.config import \
      CFG_INSPIRE_SITE, \
      CFG_WEBSEARCH_WILDCARD_LIMIT, \
      CFG_SITE_RECORD
-from invenio.dbquery import Error
+from invenio.dbquery import Error, sql_routing_start
 from invenio.webinterface_handler import wash_urlargd, WebInterfaceDirectory
 from invenio.urlutils import redirect_to_url, make_canonical_urlargd, drop_default_urlargd
 from invenio.htmlutils import get_mathjax_header
@@ -253,6 +253,8 @@ class WebInterfaceRecordPages(WebInterfaceDirectory):
         return
 
     def __call__(self, req, form):
+        ## record pages can be served from the DB slaves
+        sql_routing_start()
         argd = wash_search_urlargd(form)
 
         argd['recid'] = self.recid
@@ -356,6 +358,8 @@ class WebInterfaceRecordRestrictedPages(WebInterfaceDirectory):
         return
 
     def __call__(self, req, form):
+        ## record pages can be served from the DB slaves
+        sql_routing_start()
         argd = wash_search_urlargd(form)
         argd['recid'] = self.recid
         if self.format is not None:
@@ -428,6 +432,9 @@ class WebInterfaceSearchResultsPages(WebInterfaceDirectory):
         if req.method == 'POST':
             raise apache.SERVER_RETURN, apache.HTTP_METHOD_NOT_ALLOWED
 
+        ## search results can be served from the DB slaves
+        sql_routing_start()
+
         uid = getUid(req)
         user_info = collect_user_info(req)
         if uid == -1:
@@ -821,6 +828,9 @@ def display_collection(req, c, aas, verbose, ln, em=""):
     in the collection cache."""
     _ = gettext_set_language(ln)
 
+    ## collection pages can be served from the DB slaves
+    sql_routing_start()
+
     req.argd = drop_default_urlargd({'aas': aas, 'verbose': verbose, 'ln': ln, 'em' : em},
                                     search_interface_default_urlargd)
 
@@ -1082,6 +1092,8 @@ class WebInterfaceRecordExport(WebInterfaceDirectory):
         return
 
     def __call__(self, req, form):
+        ## formatted records can be served from the DB slaves
+        sql_routing_start()
         argd = wash_search_urlargd(form)
         argd['recid'] = self.recid
 
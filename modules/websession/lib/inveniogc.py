@@ -28,7 +28,7 @@ import datetime
 import time
 import os
 try:
-    from invenio.dbquery import run_sql, wash_table_column_name
+    from invenio.dbquery import run_sql, run_sql_iter, wash_table_column_name
     from invenio.config import CFG_LOGDIR, CFG_TMPDIR, CFG_CACHEDIR, \
          CFG_TMPSHAREDDIR, CFG_WEBSEARCH_RSS_TTL, CFG_PREFIX, \
          CFG_WEBSESSION_NOT_CONFIRMED_EMAIL_ADDRESS_EXPIRE_IN_DAYS
@@ -39,6 +39,7 @@ try:
     from invenio.bibsched import gc_tasks
     from invenio.websubmit_config import CFG_WEBSUBMIT_TMP_VIDEO_PREFIX
     from invenio.dateutils import convert_datestruct_to_datetext
+    from invenio.intbitset import intbitset
 except ImportError, e:
     print "Error: %s" % (e,)
     sys.exit(1)
@@ -369,18 +370,23 @@ def guest_user_garbage_collector():
     # get uids
     write_message("""  SELECT u.id\n  FROM user AS u LEFT JOIN session AS s\n  ON u.id = s.uid\n  WHERE s.uid IS NULL AND u.email = ''""", verbose=9)
 
-    result = run_sql("""SELECT u.id
+    # there can be millions of guest users: stream their ids into a
+    # compact intbitset rather than fetching all the rows at once
+    result = intbitset()
+    for rows in run_sql_iter("""SELECT u.id
     FROM user AS u LEFT JOIN session AS s
     ON u.id = s.uid
-    WHERE s.uid IS NULL AND u.email = ''""")
+    WHERE s.uid IS NULL AND u.email = ''""", batches=True):
+        result |= intbitset(rows)
     write_message(result, verbose=9)
 
     if result:
+        result = result.tolist()
         # work on slices of result list in case of big result
         for i in range(0, len(result), CFG_MYSQL_ARGUMENTLIST_SIZE):
             # create string of uids
             uidstr = ''
-            for (id_user,) in result[i:i + CFG_MYSQL_ARGUMENTLIST_SIZE]:
+            for id_user in result[i:i + CFG_MYSQL_ARGUMENTLIST_SIZE]:
                 if uidstr: uidstr += ','
                 uidstr += "%s" % (id_user,)
 
@@ -48,6 +48,9 @@ from invenio.config import CFG_WEBDIR, CFG_SITE_LANG, \
     CFG_WEBSTYLE_HTTP_STATUS_ALERT_LIST, CFG_DEVEL_SITE, CFG_SITE_URL, \
     CFG_SITE_SECURE_URL, CFG_WEBSTYLE_REVERSE_PROXY_IPS
 from invenio.errorlib import register_exception, get_pretty_traceback
+from invenio.dbquery import release_connections, is_sql_profiling_enabled, \
+     check_sql_profiling_flag, sql_profile_start, sql_profile_stop, \
+     log_sql_profile, sql_routing_stop
 
 ## Static files are usually handled directly by the webserver (e.g. Apache)
 ## However in case WSGI is required to handle static files too (such
@@ -470,6 +473,9 @@ def application(environ, start_response):
     ## Needed for mod_wsgi, see: <http://code.google.com/p/modwsgi/wiki/ApplicationIssues>
     req = SimulatedModPythonRequest(environ, start_response)
     #print 'Starting mod_python simulation'
+    check_sql_profiling_flag()
+    if is_sql_profiling_enabled():
+        sql_profile_start()
     try:
         try:
             if (CFG_FULL_HTTPS or (CFG_HAS_HTTPS_SUPPORT and get_session(req).need_https)) and not req.is_https():
@@ -565,6 +571,13 @@ def application(environ, start_response):
         for (callback, data) in req.get_cleanups():
             callback(data)
 
+        ## the DB connections of this thread can serve other requests
+        sql_routing_stop()
+        release_connections()
+        sql_profile = sql_profile_stop()
+        if sql_profile:
+            log_sql_profile(sql_profile, req.unparsed_uri)
+
         ## as suggested in
         ## <http://www.python.org/doc/2.3.5/lib/module-gc.html>
         gc.enable()